@@ -0,0 +1,97 @@
+"""
+Broadcast benchmark: bytes downloaded by each activation of a map whose calls
+use the same numpy array, captured in the function (without broadcast) or
+referenced with FunctionExecutor.broadcast(). The activations run one after
+the other in a few warm containers, each one with its own broadcast cache in a
+temporary directory, and the storage is kept in memory.
+
+    python examples/broadcast_benchmark.py [--size-mb 100] [--activations 100] [--containers 4]
+"""
+import io
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from pywren_ibm_cloud import broadcast, serializers
+
+STORAGE_CONFIG = {'backend': 'ibm_cos', 'prefix': 'pywren.jobs', 'bucket': 'bucket', 'ibm_cos': {}}
+
+
+class MemoryStorage:
+    """
+    In-memory InternalStorage with the broadcast objects operations
+    """
+
+    def __init__(self):
+        self.prefix = STORAGE_CONFIG['prefix']
+        self.objects = {}
+        self.broadcast_cache_dir = None
+
+    def get_storage_config(self):
+        return STORAGE_CONFIG
+
+    def broadcast_exists(self, key):
+        return key in self.objects
+
+    def put_broadcast(self, key, body):
+        self.objects[key] = body if isinstance(body, bytes) else b''.join(body)
+
+    def get_broadcast(self, key):
+        return io.BytesIO(self.objects[key])
+
+
+def run_activations(obj, activations, containers):
+    """
+    :return: list of (downloaded bytes, load time) of each activation
+    """
+    storage = MemoryStorage()
+    broadcast.InternalStorage = lambda storage_config: storage
+    reference = pickle.dumps(broadcast.create_broadcast(storage, obj))
+    cache_dirs = [tempfile.mkdtemp() for _ in range(containers)]
+
+    results = []
+    try:
+        for activation in range(activations):
+            storage.broadcast_cache_dir = cache_dirs[activation % containers]
+            downloaded_bytes = broadcast.downloaded_bytes
+            start = time.time()
+            shared = pickle.loads(reference)
+            shared.value.sum()
+            load_time = time.time() - start
+            results.append((len(reference) + broadcast.downloaded_bytes - downloaded_bytes, load_time))
+            shared.close()
+    finally:
+        for cache_dir in cache_dirs:
+            shutil.rmtree(cache_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=100, help='size of the shared array')
+    parser.add_argument('--activations', type=int, default=100, help='number of activations')
+    parser.add_argument('--containers', type=int, default=4, help='number of warm containers')
+    args = parser.parse_args()
+
+    obj = np.random.random(args.size_mb * 1024 ** 2 // 8)
+
+    # Without broadcast, every activation downloads the function with the array
+    func_bytes = len(serializers.dumps(obj))
+    print('{:>10}: {:>10.1f} MB per activation, {:>10.1f} MB in total'
+          .format('closure', func_bytes / 1024 ** 2, func_bytes * args.activations / 1024 ** 2))
+
+    results = run_activations(obj, args.activations, args.containers)
+    downloaded = [downloaded_bytes for downloaded_bytes, _ in results]
+    cold = [load_time for _, load_time in results[:args.containers]]
+    warm = [load_time for _, load_time in results[args.containers:]] or [0]
+    print('{:>10}: {:>10.1f} MB per activation, {:>10.1f} MB in total, {} bytes in a warm container'
+          .format('broadcast', sum(downloaded) / len(downloaded) / 1024 ** 2, sum(downloaded) / 1024 ** 2,
+                  min(downloaded)))
+    print('{:>10}  load and read {:.1f} ms in a cold container, {:.1f} ms in a warm one'
+          .format('', sum(cold) / len(cold) * 1000, sum(warm) / len(warm) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,11 +17,25 @@ def my_function_get(co, internal_storage):
     return data
 
 
+def my_function_put_bytes(text, internal_storage):
+    # bytes are stored as is, so they can be read by ranges
+    return internal_storage.put_object(text.encode())
+
+
+def my_function_get_range(co, internal_storage):
+    return internal_storage.get_object_range(co, 0, 4).decode()
+
+
 if __name__ == "__main__":
     pw = pywren.ibm_cf_executor()
     pw.call_async(my_function_put, 'Hello World')
     cloudobjects = pw.get_result()
     pw.map(my_function_get, cloudobjects)
     print(pw.get_result())
+
+    pw.call_async(my_function_put_bytes, 'Hello World')
+    cloudobject = pw.get_result()
+    pw.call_async(my_function_get_range, cloudobject)
+    print(pw.get_result())
     pw.create_timeline_plots('/home/josep/pywren_plots', 'no_rabbitmq')
     pw.clean()
@@ -0,0 +1,71 @@
+"""
+Compression benchmark: prints the bytes that would be transferred to and from
+the storage for typical pickled objects (function, map arguments and results),
+with and without compression, and the time to compress them and to decompress
+them as a stream as the workers do.
+
+    python examples/compression_benchmark.py [--codecs zlib] [--runs N]
+"""
+import io
+import time
+import pickle
+import random
+import string
+import argparse
+import numpy as np
+from pywren_ibm_cloud import serializers
+from pywren_ibm_cloud.storage.compression import compress, decompress_stream
+
+
+def my_map_function(x, text):
+    return {word: len(word) * x for word in text.split()}
+
+
+def create_objects():
+    random.seed(0)
+    words = [''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(2, 10)))
+             for _ in range(1000)]
+    text = ' '.join(random.choice(words) for _ in range(200000))
+    return {
+        'function': pickle.dumps({'func': pickle.dumps(my_map_function, -1), 'module_archive': None}, -1),
+        'small args': pickle.dumps({'x': 1, 'text': 'hello world'}, -1),
+        'text args': pickle.dumps({'x': 1, 'text': text}, -1),
+        'dict result': pickle.dumps(my_map_function(1, text), -1),
+        'int list': pickle.dumps(list(range(1000000)), -1),
+        'int ndarray': serializers.dumps({'result': np.arange(1000000) % 1000}),
+        'float ndarray': serializers.dumps({'result': np.random.random(1000000)}),
+    }
+
+
+def best_time(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--codecs', nargs='+', default=['zlib'], help='negotiated compression codecs')
+    parser.add_argument('--runs', type=int, default=3, help='runs of each operation, the best one is shown')
+    args = parser.parse_args()
+
+    print('{:>14} {:>12} {:>12} {:>7} {:>12} {:>14}'
+          .format('object', 'bytes', 'transferred', 'ratio', 'compress ms', 'decompress ms'))
+    total_bytes = total_transferred = 0
+    for name, data in create_objects().items():
+        compress_time, compressed = best_time(lambda: compress(data, args.codecs), args.runs)
+        decompress_time, _ = best_time(lambda: decompress_stream(io.BytesIO(compressed)).read(), args.runs)
+        total_bytes += len(data)
+        total_transferred += len(compressed)
+        print('{:>14} {:>12} {:>12} {:>7.2f} {:>12.1f} {:>14.1f}'
+              .format(name, len(data), len(compressed), len(compressed) / len(data),
+                      compress_time * 1000, decompress_time * 1000))
+    print('{:>14} {:>12} {:>12} {:>7.2f}'.format('total', total_bytes, total_transferred,
+                                                  total_transferred / total_bytes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Client benchmark of a large map: creates the futures of a job of many calls,
+as the invoker does, without invoking anything, and prints the memory they
+use and the time of one monitor loop over them (the check of the pending calls).
+
+    python examples/futures_benchmark.py [--calls N]
+"""
+import time
+import argparse
+import resource
+import tracemalloc
+from pywren_ibm_cloud.future import JobStore, JobState
+
+STORAGE_CONFIG = {'backend': 'ibm_cos', 'prefix': 'pywren.jobs', 'bucket': 'bucket', 'ibm_cos': {}}
+
+
+def create_futures(total_calls):
+    job_meta = {'func_name': 'my_map_function', 'runtime_memory': 256, 'executor_id': 'executor', 'job_id': '000'}
+    data_ranges = [(i * 100, i * 100 + 99) for i in range(total_calls)]
+    store = JobStore('executor', '000', STORAGE_CONFIG, job_meta, total_calls, data_ranges)
+    futures = store.futures()
+    for f in futures:
+        f.activation_id = '{:032x}'.format(f._index)
+        f.invoke_status['host_submit_time'] = time.time()
+        f.invoke_status['invoke_time'] = 0.01
+        f.invoke_status['compute_region'] = 'eu-de'
+        f._set_state(JobState.invoked)
+    return futures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=100000, help='number of calls of the job')
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    futures = create_futures(args.calls)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Half of the calls are done
+    for f in futures[::2]:
+        f._set_state(JobState.success)
+
+    loops = 10
+    start = time.time()
+    for _ in range(loops):
+        not_dones = [f for f in futures if not f.done]
+    loop_time = (time.time() - start) / loops
+
+    print('Calls: {}'.format(args.calls))
+    print('Futures memory: {:.1f} MB'.format(allocated / 1024 ** 2))
+    print('Client max RSS: {:.1f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    print('Monitor loop: {:.1f} ms ({} pending)'.format(loop_time * 1000, len(not_dones)))
+
+
+if __name__ == "__main__":
+    main()
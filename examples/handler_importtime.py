@@ -0,0 +1,71 @@
+"""
+Cold start benchmark of the function handler: builds the handler zip of the
+IBM Cloud Functions runtime with and without the compiled Python files, extracts
+each one to a new directory, as a cold container does, and measures the import
+time of its entry point with 'python -X importtime'. The bytecode is not written
+back (-B), so every run is a cold start. Run it with the Python version of the
+runtime, and with its dependencies installed:
+
+    python examples/handler_importtime.py [--runs N]
+"""
+import os
+import io
+import sys
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+from pywren_ibm_cloud.utils import version_str
+from pywren_ibm_cloud.compute.backends.ibm_cf.ibm_cf import ComputeBackend
+
+ENTRY_POINT = 'from pywren_ibm_cloud.compute.backends.ibm_cf.entry_point import main'
+
+
+def import_time(handler_dir):
+    """
+    Imports the entry point of the handler in a new interpreter.
+    :return: (total import time, import time of the pywren_ibm_cloud modules) in microseconds
+    """
+    statement = 'import sys; sys.path.insert(0, {!r}); {}'.format(handler_dir, ENTRY_POINT)
+    proc = subprocess.run([sys.executable, '-B', '-X', 'importtime', '-c', statement],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise Exception('Unable to import the handler:\n{}'.format(proc.stderr))
+
+    total = 0
+    pywren = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, _, module = line[len('import time:'):].split('|')
+        total += int(self_time)
+        if module.strip().startswith('pywren_ibm_cloud'):
+            pywren += int(self_time)
+    return total, pywren
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts of each handler, the best one is shown')
+    args = parser.parse_args()
+
+    backend = ComputeBackend.__new__(ComputeBackend)
+    print('{:>10} {:>10} {:>12} {:>18}'.format('handler', 'zip KB', 'import ms', 'pywren import ms'))
+    for name, python_ver in (('source', None), ('compiled', version_str(sys.version_info))):
+        handler_zip = backend._create_handler_zip(python_ver)
+        runs = []
+        for _ in range(args.runs):
+            handler_dir = tempfile.mkdtemp()
+            try:
+                zipfile.ZipFile(io.BytesIO(handler_zip)).extractall(handler_dir)
+                runs.append(import_time(handler_dir))
+            finally:
+                shutil.rmtree(handler_dir)
+        total, pywren = min(runs)
+        print('{:>10} {:>10} {:>12.1f} {:>18.1f}'.format(name, len(handler_zip) // 1024, total / 1000, pywren / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Invocation benchmark: time until all the calls of a job are started, invoked
+from the client or through a tree of remote invokers.
+
+The calls are invoked by the Invoker with a simulated compute backend that
+records every invocation. The invoker activations run remote_invoker() in this
+process, so the tree of invocations is the one of a real job. The start time
+of each activation is then computed with a simulated clock: each invocation
+request takes --invoke-ms in one of the threads of the invoker that makes it,
+and an activation starts --start-ms after its request. The time measured in a
+single process would only add up the CPU time of all the invokers.
+
+    python examples/invoke_benchmark.py [--calls 10000 50000] [--fanout 100] [--invoke-pool-threads 128]
+"""
+import argparse
+from collections import defaultdict
+from pywren_ibm_cloud import invoker
+
+CONFIG = {'pywren': {'storage_backend': 'ibm_cos', 'storage_prefix': 'pywren.jobs', 'storage_bucket': 'bucket',
+                     'compute_backend': 'ibm_cf', 'invocation_retry': True, 'retry_sleeps': [1], 'retries': 1},
+          'ibm_cos': {}, 'ibm_cf': {}}
+
+
+class SimulatedCompute:
+    """
+    Compute backend that records the invocations. Invoker activations run
+    remote_invoker() in the invoking thread.
+    """
+
+    def __init__(self):
+        self.region = None
+        self.concurrency = None
+        self.invoker_ranges = []
+        self.calls = 0
+
+    def invoke(self, runtime_name, runtime_memory, payload):
+        if payload.get('remote_invoker'):
+            self.invoker_ranges.append(tuple(payload['call_range']))
+            invoker.remote_invoker(payload)
+        else:
+            self.calls += 1
+        return 'activation' + payload['call_id']
+
+    def start_times(self, total_calls, threads, invoke_latency, start_latency):
+        """
+        :return: (time when the client finishes invoking, time when each call starts)
+        """
+        # The parent of an invocation is the smallest invoker range that contains it, or
+        # the client. Ranges are visited from the largest one, so parents come first.
+        owner = [None] * total_calls
+        parents = {}
+        for call_range in sorted(self.invoker_ranges, key=lambda r: r[0] - r[1]):
+            parents[call_range] = owner[call_range[0]]
+            for i in range(*call_range):
+                owner[i] = call_range
+
+        children = defaultdict(list)
+        for call_range, parent in parents.items():
+            children[parent].append((call_range, True))
+        for i in range(total_calls):
+            children[owner[i]].append(((i, i + 1), False))
+
+        # The children of an invoker are invoked in order by its pool of threads
+        start_time = {None: 0}
+        call_start_times = []
+        client_time = 0
+        for parent in [None] + sorted(parents, key=lambda r: r[0] - r[1]):
+            siblings = sorted(children[parent])
+            workers = max(1, min(threads, len(siblings)))
+            for j, (call_range, is_invoker) in enumerate(siblings):
+                invoked = start_time[parent] + (j // workers + 1) * invoke_latency
+                if parent is None:
+                    client_time = invoked
+                if is_invoker:
+                    start_time[call_range] = invoked + start_latency
+                else:
+                    call_start_times.append(invoked + start_latency)
+
+        return client_time, call_start_times
+
+
+def time_to_all_started(total_calls, remote_invocation, args):
+    compute = SimulatedCompute()
+    invoker.Compute = lambda compute_config: compute
+    job_invoker = invoker.Invoker(CONFIG, 'executor')
+    # Log the start of the job instead of printing it
+    job_invoker.log_level = 'INFO'
+    job_description = {'job_id': '000', 'func_name': 'my_map_function', 'total_calls': total_calls,
+                       'data_ranges': [(-1, -1)] * total_calls, 'host_job_meta': {},
+                       'func_key': 'func_key', 'data_key': 'data_key', 'task_execution_timeout': 600,
+                       'compression_codecs': [], 'extra_env': None, 'extra_meta': None,
+                       'overwrite_invoke_args': None, 'runtime_name': 'runtime', 'runtime_memory': 256,
+                       'invoke_pool_threads': args.invoke_pool_threads, 'remote_invocation': remote_invocation,
+                       'remote_invocation_fanout': args.fanout, 'trace_context': None}
+    job_invoker.run(job_description)
+    assert compute.calls == total_calls
+
+    client_time, call_start_times = compute.start_times(total_calls, args.invoke_pool_threads,
+                                                        args.invoke_ms / 1000, args.start_ms / 1000)
+    return client_time, max(call_start_times), len(compute.invoker_ranges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, nargs='+', default=[10000, 50000], help='number of calls of the job')
+    parser.add_argument('--fanout', type=int, default=100, help='calls started by each remote invoker')
+    parser.add_argument('--invoke-pool-threads', type=int, default=128, help='threads of each invoker')
+    parser.add_argument('--invoke-ms', type=float, default=50, help='duration of an invocation request')
+    parser.add_argument('--start-ms', type=float, default=500, help='start time of an activation')
+    args = parser.parse_args()
+
+    print('{:>7} {:>8} {:>10} {:>14} {:>18}'.format('calls', 'invoker', 'invokers', 'client time s',
+                                                     'all started in s'))
+    for total_calls in args.calls:
+        for remote_invocation in (False, True):
+            client_time, all_started, invokers = time_to_all_started(total_calls, remote_invocation, args)
+            print('{:>7} {:>8} {:>10} {:>14.2f} {:>18.2f}'.format(total_calls,
+                                                                  'remote' if remote_invocation else 'client',
+                                                                  invokers, client_time, all_started))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+PyWren example and benchmark using the shuffle of the map_reduce method.
+
+Synthetic word count over 10 GB of text: each map function generates
+TEXT_SIZE bytes of random words and counts them. The counts are shuffled
+into N partitions and each reducer adds up the counts of its partition.
+The word count is run with 1, 16 and 64 reducers.
+"""
+import time
+import random
+from collections import Counter
+import pywren_ibm_cloud as pywren
+
+TOTAL_SIZE = 10 * 1024 ** 3  # 10GB
+TEXT_SIZE = 100 * 1024 ** 2  # 100MB per map function
+VOCABULARY_SIZE = 1000000
+
+iterdata = list(range(TOTAL_SIZE // TEXT_SIZE))
+
+
+def my_map_function(seed):
+    rand = random.Random(seed)
+    counts = Counter()
+    size = 0
+    while size < TEXT_SIZE:
+        word = 'w{}'.format(rand.randrange(VOCABULARY_SIZE))
+        counts[word] += 1
+        size += len(word) + 1
+    return counts
+
+
+def my_reduce_function(results):
+    counts = Counter()
+    for word, count in results:
+        counts[word] += count
+    return len(counts), sum(counts.values())
+
+
+if __name__ == "__main__":
+    for reducers in (1, 16, 64):
+        pw = pywren.ibm_cf_executor()
+        start = time.time()
+        pw.map_reduce(my_map_function, iterdata, my_reduce_function,
+                      shuffle_partitions=reducers)
+        # One result per partition
+        results = pw.get_result()
+        elapsed = time.time() - start
+        words = sum(distinct for distinct, _ in results)
+        total = sum(total for _, total in results)
+        print('{} reducers: {} distinct words, {} words in {:.2f}s'.format(reducers, words, total, elapsed))
+        pw.clean()
@@ -0,0 +1,86 @@
+"""
+Dependency walk benchmark: time to find the modules to transmit with a job
+whose function imports a package with hundreds of modules. The package is
+generated in a temporary directory, every module imports a few others, and the
+walk runs with an empty imports cache, with a new analyzer that reuses the
+cache file (a new process), and with the analyzer shared by the jobs of the
+process, as FunctionExecutor does with each job.
+
+    python examples/module_dependency_benchmark.py [--modules 500] [--imports 5] [--runs 5]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import importlib
+from pywren_ibm_cloud.libs.cloudpipe import module_dependency
+
+
+def create_package(base_dir, modules, imports):
+    """
+    Writes the package 'bench_pkg' with the given number of modules in two levels
+    of subpackages, each module importing some random modules of the package.
+    """
+    names = ['bench_pkg.sub{}.mod{}'.format(i % 10, i) for i in range(modules)]
+    for subpackage in set(name.rsplit('.', 1)[0] for name in names) | {'bench_pkg'}:
+        package_dir = os.path.join(base_dir, *subpackage.split('.'))
+        os.makedirs(package_dir, exist_ok=True)
+        with open(os.path.join(package_dir, '__init__.py'), 'w') as init_file:
+            init_file.write('import json\n')
+    for name in names:
+        with open(os.path.join(base_dir, *name.split('.')) + '.py', 'w') as module_file:
+            module_file.write('import os\nimport json\n')
+            for imported in random.sample(names, imports):
+                module_file.write('import {}\n'.format(imported))
+            module_file.write('\n\ndef func(x):\n    return x + 1\n' * 20)
+    importlib.invalidate_caches()
+
+
+def walk(analyzer):
+    start = time.time()
+    paths = analyzer.analyze(['bench_pkg'], ignore=['os', 'json'])
+    elapsed = time.time() - start
+    assert len(paths) == 1
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', type=int, default=500, help='modules of the package')
+    parser.add_argument('--imports', type=int, default=5, help='imports of each module')
+    parser.add_argument('--runs', type=int, default=5, help='walks of each kind, the best one is shown')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        create_package(base_dir, args.modules, args.imports)
+        sys.path.insert(0, base_dir)
+        cache_file = os.path.join(base_dir, 'module_imports.json')
+
+        cold = []
+        for _ in range(args.runs):
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            module_dependency._imports_caches.clear()
+            cold.append(walk(module_dependency.ModuleDependencyAnalyzer(cache_file)))
+
+        warm_cache = []
+        for _ in range(args.runs):
+            module_dependency._imports_caches.clear()
+            warm_cache.append(walk(module_dependency.ModuleDependencyAnalyzer(cache_file)))
+
+        shared = []
+        analyzer = module_dependency.ModuleDependencyAnalyzer(cache_file)
+        walk(analyzer)
+        for _ in range(args.runs):
+            shared.append(walk(analyzer))
+
+    print('{} modules, {} imports each'.format(args.modules, args.imports))
+    print('{:>24}: {:>8.1f} ms'.format('empty imports cache', min(cold) * 1000))
+    print('{:>24}: {:>8.1f} ms'.format('cache file, new analyzer', min(warm_cache) * 1000))
+    print('{:>24}: {:>8.1f} ms'.format('shared analyzer', min(shared) * 1000))
+
+
+if __name__ == "__main__":
+    main()
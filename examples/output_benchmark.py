@@ -0,0 +1,88 @@
+"""
+Memory benchmark of storing and reading a large function result: a numpy array
+is serialized and written to a file, as the function does with output.pickle,
+and read back, as ResponseFuture.result() does. Each side runs in its own
+process, which prints its peak RSS, with the whole pickle in memory
+(pickle.dumps/pickle.loads) and with the streaming serializers
+(serializers.dumps_stream/serializers.loads_stream).
+
+    python examples/output_benchmark.py [--size-mb 1024] [--dir /tmp]
+"""
+import os
+import sys
+import pickle
+import argparse
+import resource
+import tempfile
+import subprocess
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_output(mode, path, size_mb):
+    import numpy as np
+    from pywren_ibm_cloud import serializers
+
+    output_dict = {'result': np.ones(size_mb * 1024 ** 2 // 8)}
+    with open(path, 'wb') as output_file:
+        if mode == 'pickle':
+            output_file.write(pickle.dumps(output_dict, protocol=-1))
+        else:
+            size, body = serializers.dumps_stream(output_dict)
+            for chunk in ([body] if isinstance(body, bytes) else body):
+                output_file.write(chunk)
+
+
+def read_output(mode, path, size_mb):
+    from pywren_ibm_cloud import serializers
+
+    with open(path, 'rb') as output_file:
+        if mode == 'pickle':
+            output_dict = pickle.loads(output_file.read())
+        else:
+            output_dict = serializers.loads_stream(output_file)
+    assert output_dict['result'].nbytes == size_mb * 1024 ** 2
+
+
+def run(side, mode, path, size_mb):
+    """
+    Runs one side in a new interpreter.
+    :return: peak RSS in MiB
+    """
+    proc = subprocess.run([sys.executable, __file__, '--child', side, mode, path, '--size-mb', str(size_mb)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise Exception('Unable to run the {} side of {}:\n{}'.format(side, mode, proc.stderr))
+    return float(proc.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=1024, help='size of the result array')
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='directory of the output file')
+    parser.add_argument('--child', nargs=3, metavar=('SIDE', 'MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        side, mode, path = args.child
+        {'write': write_output, 'read': read_output}[side](mode, path, args.size_mb)
+        print(peak_rss_mb())
+        return
+
+    print('{:>8} {:>10} {:>16} {:>16}'.format('mode', 'result MB', 'write peak MB', 'read peak MB'))
+    path = os.path.join(args.dir, 'output_benchmark.{}.pickle'.format(os.getpid()))
+    try:
+        for mode in ('pickle', 'stream'):
+            write_peak = run('write', mode, path, args.size_mb)
+            read_peak = run('read', mode, path, args.size_mb)
+            print('{:>8} {:>10} {:>16.0f} {:>16.0f}'.format(mode, args.size_mb, write_peak, read_peak))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
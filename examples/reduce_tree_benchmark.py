@@ -0,0 +1,72 @@
+"""
+Reduction tree benchmark: time to the final result of a map_reduce with thousands
+of mappers, with a single reducer and with the reduction tree of reducer_fanin.
+
+The tree is planned as map_reduce() does, and the reduce function runs over the
+groups of each level in this process. The time of each reducer is computed with a
+simulated clock: the mappers finish at random times within --map-s, a reducer
+activation starts --start-ms after the reducers of the level are invoked, and it
+downloads its results one after the other, each one in --get-ms, once they are
+all done. The memory of a reducer is the size of the results it keeps.
+
+    python examples/reduce_tree_benchmark.py [--mappers 1000 5000 20000] [--fanin 10 100] [--result-kb 1024]
+"""
+import random
+import argparse
+from pywren_ibm_cloud.job.job import plan_reduce_levels, split_reduce_groups
+
+
+def reduce_tree(map_done, reducer_fanin, start_s, get_s):
+    """
+    Reduces the mappers with the tree of reducer_fanin (None for a single reducer).
+    :param map_done: list of (time when the mapper is done, result) of each mapper
+    :return: (time of the final result, final result, reducers, most results of a reducer)
+    """
+    futures = map_done
+    reducers = 1
+    most_results = 0
+    for _ in plan_reduce_levels(len(futures), reducer_fanin):
+        groups = split_reduce_groups(futures, reducer_fanin)
+        reducers += len(groups)
+        most_results = max(most_results, max(len(group) for group in groups))
+        futures = [reduce_group(group, start_s, get_s) for group in groups]
+    most_results = max(most_results, len(futures))
+    done, result = reduce_group(futures, start_s, get_s)
+    return done, result, reducers, most_results
+
+
+def reduce_group(group, start_s, get_s):
+    """
+    Reducer of a group of futures, invoked at time 0 like the levels of map_reduce().
+    :return: (time when the reducer is done, result)
+    """
+    done = max(start_s, max(done for done, _ in group)) + len(group) * get_s
+    return done, sum(result for _, result in group)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mappers', type=int, nargs='+', default=[1000, 5000, 20000], help='mappers of the job')
+    parser.add_argument('--fanin', type=int, nargs='+', default=[10, 100], help='reducer_fanin of the trees')
+    parser.add_argument('--result-kb', type=int, default=1024, help='size of each map result')
+    parser.add_argument('--map-s', type=float, default=30, help='mappers finish within this time')
+    parser.add_argument('--start-ms', type=float, default=500, help='start time of an activation')
+    parser.add_argument('--get-ms', type=float, default=20, help='download time of a result')
+    args = parser.parse_args()
+
+    print('{:>8} {:>7} {:>9} {:>14} {:>16} {:>16}'.format('mappers', 'fan-in', 'reducers', 'most results',
+                                                          'reducer MB', 'final result s'))
+    for mappers in args.mappers:
+        map_done = [(random.uniform(0, args.map_s), 1) for _ in range(mappers)]
+        for reducer_fanin in [None] + args.fanin:
+            done, result, reducers, most_results = reduce_tree(map_done, reducer_fanin,
+                                                               args.start_ms / 1000, args.get_ms / 1000)
+            assert result == mappers
+            print('{:>8} {:>7} {:>9} {:>14} {:>16.0f} {:>16.1f}'.format(mappers, reducer_fanin or '-', reducers,
+                                                                        most_results,
+                                                                        most_results * args.result_kb / 1024,
+                                                                        done))
+
+
+if __name__ == "__main__":
+    main()
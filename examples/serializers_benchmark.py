@@ -0,0 +1,61 @@
+"""
+Encode/decode benchmark of the data serializer: serializes a dict with a numpy
+array (and a pandas DataFrame, when pandas is installed) with pickle and with
+pywren_ibm_cloud.serializers, and prints the time of dumps, loads from bytes
+(as read from the storage) and loads_stream from a file-like object.
+
+    python examples/serializers_benchmark.py [--size-mb 10 100] [--runs N]
+"""
+import io
+import time
+import pickle
+import argparse
+import numpy as np
+from pywren_ibm_cloud import serializers
+
+
+def best_time(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def create_objects(size_mb):
+    objects = {'ndarray': {'x': np.random.random(size_mb * 1024 ** 2 // 8)}}
+    try:
+        import pandas as pd
+        rows = size_mb * 1024 ** 2 // 16
+        objects['dataframe'] = {'x': pd.DataFrame({'a': np.random.random(rows), 'b': np.arange(rows)})}
+    except ImportError:
+        pass
+    return objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, nargs='+', default=[10, 100], help='size of the data')
+    parser.add_argument('--runs', type=int, default=5, help='runs of each operation, the best one is shown')
+    args = parser.parse_args()
+
+    print('{:>10} {:>6} {:>12} {:>10} {:>10} {:>12}'
+          .format('object', 'MB', 'serializer', 'dumps ms', 'loads ms', 'stream ms'))
+    for size_mb in args.size_mb:
+        for name, obj in create_objects(size_mb).items():
+            dumps_time, data = best_time(lambda: pickle.dumps(obj, protocol=-1), args.runs)
+            loads_time, _ = best_time(lambda: pickle.loads(data), args.runs)
+            stream_time, _ = best_time(lambda: pickle.load(io.BytesIO(data)), args.runs)
+            print('{:>10} {:>6} {:>12} {:>10.1f} {:>10.1f} {:>12.1f}'
+                  .format(name, size_mb, 'pickle', dumps_time * 1000, loads_time * 1000, stream_time * 1000))
+
+            dumps_time, data = best_time(lambda: serializers.dumps(obj), args.runs)
+            loads_time, loaded = best_time(lambda: serializers.loads(data), args.runs)
+            stream_time, _ = best_time(lambda: serializers.loads_stream(io.BytesIO(data)), args.runs)
+            print('{:>10} {:>6} {:>12} {:>10.1f} {:>10.1f} {:>12.1f}'
+                  .format(name, size_mb, 'serializers', dumps_time * 1000, loads_time * 1000, stream_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Startup benchmark: measures the import time of the PyWren client and of the
+function entry point with 'python -X importtime', and prints the total time
+and the slowest imports of each one.
+Run it in the same environment as the client (or the runtime image) to check
+that a change does not make the client or the cold start slower:
+
+    python examples/startup_importtime.py [--top N] [--runs N]
+"""
+import sys
+import argparse
+import subprocess
+
+ENTRY_POINTS = {
+    'client': 'import pywren_ibm_cloud',
+    'entry_point.main': 'from pywren_ibm_cloud.compute.backends.ibm_cf.entry_point import main',
+}
+
+
+def import_times(statement):
+    """
+    Runs the statement in a new interpreter with -X importtime.
+    :return: dict with the cumulative import time, in microseconds, of each module
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise Exception('Unable to run "{}":\n{}'.format(statement, proc.stderr))
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Only the top level imports, the cumulative time includes the nested ones
+        if not module[1:].startswith(' '):
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to show')
+    parser.add_argument('--runs', type=int, default=5, help='runs of each entry point, the best one is shown')
+    args = parser.parse_args()
+
+    for name, statement in ENTRY_POINTS.items():
+        # The first run also compiles the bytecode, so it is not counted
+        import_times(statement)
+        runs = [import_times(statement) for _ in range(args.runs)]
+        best = min(runs, key=lambda times: sum(times.values()))
+        total = sum(best.values())
+
+        print('{}: {:.1f} ms'.format(name, total / 1000))
+        slowest = sorted(best.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        for module, cumulative in slowest:
+            print('    {:>8.1f} ms  {}'.format(cumulative / 1000, module))
+
+
+if __name__ == "__main__":
+    main()
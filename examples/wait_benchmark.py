@@ -0,0 +1,80 @@
+"""
+Microbenchmark of one storage poll of wait(): the futures of a job of N calls,
+half of them done, are checked against the status keys listed in the callset.
+The storage is kept in memory and no call status is found by the direct queries,
+so only the done-set computation of the client is measured.
+
+    python examples/wait_benchmark.py [--calls 10000 50000 100000]
+"""
+import time
+import argparse
+from pywren_ibm_cloud.wait import _wait_storage
+from pywren_ibm_cloud.future import JobStore, JobState
+from pywren_ibm_cloud.storage import InternalStorage, CallsetDone
+from pywren_ibm_cloud.storage.utils import create_output_key, create_status_key
+
+STORAGE_CONFIG = {'backend': 'ibm_cos', 'prefix': 'pywren.jobs', 'bucket': 'bucket', 'ibm_cos': {}}
+
+
+class MemoryStorageHandler:
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def list_keys_with_prefix(self, bucket, prefix):
+        return list(self.keys)
+
+
+class MemoryStorage:
+    """
+    In-memory InternalStorage with the same callset listing
+    """
+    get_callset_done = InternalStorage.get_callset_done
+
+    def __init__(self, keys):
+        self.prefix = STORAGE_CONFIG['prefix']
+        self.bucket = STORAGE_CONFIG['bucket']
+        self.storage_handler = MemoryStorageHandler(keys)
+
+    def get_call_status(self, executor_id, job_id, call_id):
+        return None
+
+
+def poll_time(total_calls, polls=10):
+    store = JobStore('executor', '000', STORAGE_CONFIG, {}, total_calls)
+    futures = store.futures()
+    keys = []
+    for f in futures:
+        f._set_state(JobState.invoked)
+        if f._index % 2 == 0:
+            f._set_state(JobState.success)
+            keys.append(create_status_key(STORAGE_CONFIG['prefix'], 'executor', '000', f.call_id))
+            keys.append(create_output_key(STORAGE_CONFIG['prefix'], 'executor', '000', f.call_id))
+    internal_storage = MemoryStorage(keys)
+
+    # The first poll of a wait builds the done bitmaps, the next ones skip the status keys already listed
+    done_bitmaps = CallsetDone()
+    start = time.time()
+    _wait_storage(futures, 'executor', internal_storage, True, True, 32, 64, done_bitmaps=done_bitmaps)
+    first_poll = time.time() - start
+
+    start = time.time()
+    for _ in range(polls):
+        _wait_storage(futures, 'executor', internal_storage, True, True, 32, 64, done_bitmaps=done_bitmaps)
+    return first_poll, (time.time() - start) / polls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, nargs='+', default=[10000, 50000, 100000],
+                        help='number of calls of the job')
+    args = parser.parse_args()
+
+    for total_calls in args.calls:
+        first_poll, poll = poll_time(total_calls)
+        print('{:>7} futures: first poll {:.1f} ms, next polls {:.1f} ms'
+              .format(total_calls, first_poll * 1000, poll * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import mmap
+import shutil
+import hashlib
+import logging
+from pywren_ibm_cloud import serializers
+from pywren_ibm_cloud.storage import InternalStorage
+from pywren_ibm_cloud.storage.utils import create_broadcast_key
+
+logger = logging.getLogger(__name__)
+
+# Bytes of broadcast objects downloaded by this process
+downloaded_bytes = 0
+
+
+class Broadcast:
+    """
+    Reference to a read-only object shared by the calls of the executor.
+    Only the reference is pickled with the functions and the data; the
+    object is loaded when `value` is first accessed. In the functions,
+    its buffers are read-only views of the file mapped from the container
+    cache, which is unmapped when the reference is released.
+    """
+
+    def __init__(self, storage_config, key, content_hash, size):
+        self.storage_config = storage_config
+        self.key = key
+        self.content_hash = content_hash
+        self.size = size
+        self._value = None
+        self._map = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_value'] = None
+        state['_map'] = None
+        return state
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = self._load()
+        return self._value
+
+    def close(self):
+        """
+        Releases the loaded object and unmaps the cache file. The map stays
+        open while views of it are still referenced elsewhere, and is closed
+        when the last one is garbage collected.
+        """
+        self._value = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+    def _load(self):
+        global downloaded_bytes
+
+        internal_storage = InternalStorage(self.storage_config)
+        cache_dir = internal_storage.broadcast_cache_dir
+        if cache_dir is None:
+            return serializers.loads_stream(internal_storage.get_broadcast(self.key))
+
+        # Container-level cache: the file outlives the activation, so warm
+        # containers map it again instead of downloading it
+        cache_path = os.path.join(cache_dir, self.content_hash)
+        if not os.path.isfile(cache_path) or os.path.getsize(cache_path) != self.size:
+            logger.info('Downloading broadcast object {} ({} bytes)'.format(self.key, self.size))
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+            with open(tmp_path, 'wb') as cache_file:
+                shutil.copyfileobj(internal_storage.get_broadcast(self.key), cache_file)
+            os.replace(tmp_path, cache_path)
+            downloaded_bytes += self.size
+        else:
+            logger.info('Broadcast object {} found in the local cache'.format(self.key))
+
+        with open(cache_path, 'rb') as cache_file:
+            try:
+                self._map = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return serializers.loads(cache_file.read())
+        # The pages of the page cache are shared by all the processes that map the file
+        return serializers.loads(self._map, copy=False)
+
+
+def create_broadcast(internal_storage, obj):
+    """
+    Uploads a broadcast object. Objects are content-addressed, so the same
+    object is only uploaded once.
+    :return: Broadcast instance
+    """
+    size, body = serializers.dumps_stream(obj)
+    chunks = [body] if isinstance(body, bytes) else list(body)
+    content_hash = hashlib.sha256()
+    for chunk in chunks:
+        content_hash.update(chunk)
+    content_hash = content_hash.hexdigest()
+
+    key = create_broadcast_key(internal_storage.prefix, content_hash)
+    if internal_storage.broadcast_exists(key):
+        logger.debug('Broadcast object {} already in storage'.format(key))
+    else:
+        logger.debug('Uploading broadcast object {} ({} bytes)'.format(key, size))
+        internal_storage.put_broadcast(key, chunks[0] if len(chunks) == 1 else iter(chunks))
+
+    return Broadcast(internal_storage.get_storage_config(), key, content_hash, size)
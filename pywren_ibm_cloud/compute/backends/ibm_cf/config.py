@@ -9,6 +9,7 @@ RUNTIME_DEFAULT_37 = 'ibmfunctions/action-python-v3.7'
 
 RUNTIME_TIMEOUT_DEFAULT = 600000  # Default: 600000 milliseconds => 10 minutes
 RUNTIME_MEMORY_DEFAULT = 256  # Default memory: 256 MB
+CONCURRENCY_DEFAULT = 1000  # Default concurrent activations per namespace
 
 
 def load_config(config_data=None):
@@ -61,6 +62,14 @@ def load_config(config_data=None):
         if cbr is not None and cbr not in config_data['ibm_cf']:
             raise Exception('Invalid Compute backend region: {}'.format(cbr))
 
+        for cbr in config_data['pywren'].get('compute_backend_regions') or []:
+            if cbr not in config_data['ibm_cf']:
+                raise Exception('Invalid Compute backend region: {}'.format(cbr))
+
+    for region in config_data['ibm_cf']:
+        if isinstance(config_data['ibm_cf'][region], dict) and 'concurrency' not in config_data['ibm_cf'][region]:
+            config_data['ibm_cf'][region]['concurrency'] = CONCURRENCY_DEFAULT
+
     if 'ibm_iam' not in config_data or config_data['ibm_iam'] is None:
         config_data['ibm_iam'] = {}
     if 'ibm_auth_endpoint' not in config_data['ibm_iam']:
@@ -1,17 +1,29 @@
+import io
 import os
 import sys
 import time
+import hashlib
+import importlib.util
 import logging
 import zipfile
+import threading
 import pywren_ibm_cloud
+from concurrent.futures import ThreadPoolExecutor
 from . import config as ibm_cf_config
-from pywren_ibm_cloud.utils import version_str
+from .config import CONCURRENCY_DEFAULT
+from pywren_ibm_cloud.config import DEPLOY_POOL_SIZE
+from pywren_ibm_cloud.utils import version_str, compile_bytecode
 from pywren_ibm_cloud.version import __version__
 from pywren_ibm_cloud.utils import is_cf_cluster
 from pywren_ibm_cloud.libs.ibm_cloudfunctions.client import CloudFunctionsClient
 
 logger = logging.getLogger(__name__)
-ZIP_LOCATION = os.path.join(os.getcwd(), 'cloudbutton_ibm_cf.zip')
+
+# Function handler zip, by content hash of the files it contains and whether
+# they are compiled. It is built once and shared by all the runtimes created
+# by the process.
+_handler_zips = {}
+_handler_zip_lock = threading.Lock()
 
 
 class ComputeBackend:
@@ -28,6 +40,7 @@ class ComputeBackend:
         self.cf_client = CloudFunctionsClient(self.ibm_cf_config)
         self.is_cf_cluster = is_cf_cluster()
         self.namespace = ibm_cf_config[self.region]['namespace']
+        self.concurrency = ibm_cf_config[self.region].get('concurrency', CONCURRENCY_DEFAULT)
 
         log_msg = ('PyWren v{} init for IBM Cloud Functions - Namespace: {} '
                    '- Region: {}'.format(__version__, self.namespace, self.region))
@@ -55,26 +68,58 @@ class ComputeBackend:
             image_name = ibm_cf_config.RUNTIME_DEFAULT_37
         return image_name
 
-    def _create_handler_zip(self):
-        logger.debug("Creating function handler zip in {}".format(ZIP_LOCATION))
-
-        def add_folder_to_zip(zip_file, full_dir_path, sub_dir=''):
-            for file in os.listdir(full_dir_path):
-                full_path = os.path.join(full_dir_path, file)
-                if os.path.isfile(full_path):
-                    zip_file.write(full_path, os.path.join('pywren_ibm_cloud', sub_dir, file), zipfile.ZIP_DEFLATED)
-                elif os.path.isdir(full_path) and '__pycache__' not in full_path:
-                    add_folder_to_zip(zip_file, full_path, os.path.join(sub_dir, file))
-
+    def _handler_files(self):
+        """
+        Files of the function handler zip: list of (path, name in the zip)
+        """
+        current_location = os.path.dirname(os.path.abspath(__file__))
+        module_location = os.path.dirname(os.path.abspath(pywren_ibm_cloud.__file__))
+        files = [(os.path.join(current_location, 'entry_point.py'), '__main__.py')]
+        for dir_path, dir_names, file_names in os.walk(module_location):
+            dir_names[:] = sorted(name for name in dir_names if name != '__pycache__')
+            for file_name in sorted(file_names):
+                full_path = os.path.join(dir_path, file_name)
+                files.append((full_path, os.path.join('pywren_ibm_cloud', os.path.relpath(full_path, module_location))))
+        return files
+
+    def _create_handler_zip(self, python_ver=None):
+        """
+        Returns the function handler zip. It is only built again when the content of its files changes.
+        The .pyc files hold the bytecode of the Python version of the client, so the Python files are
+        only added compiled, in __pycache__, when the runtime has the same version. Then the runtime
+        does not compile them on import.
+        :param python_ver: Python version of the runtime, as in its metadata. Default None (unknown)
+        """
+        compiled = python_ver == version_str(sys.version_info)
         try:
-            with zipfile.ZipFile(ZIP_LOCATION, 'w') as ibmcf_pywren_zip:
-                current_location = os.path.dirname(os.path.abspath(__file__))
-                module_location = os.path.dirname(os.path.abspath(pywren_ibm_cloud.__file__))
-                main_file = os.path.join(current_location, 'entry_point.py')
-                ibmcf_pywren_zip.write(main_file, '__main__.py', zipfile.ZIP_DEFLATED)
-                add_folder_to_zip(ibmcf_pywren_zip, module_location)
+            contents = []
+            zip_hash = hashlib.sha256()
+            for full_path, zip_name in self._handler_files():
+                with open(full_path, 'rb') as handler_file:
+                    content = handler_file.read()
+                zip_hash.update(zip_name.encode())
+                zip_hash.update(content)
+                contents.append((zip_name, content))
+            zip_key = (zip_hash.hexdigest(), compiled)
+
+            with _handler_zip_lock:
+                if zip_key not in _handler_zips:
+                    logger.debug("Creating function handler zip {}".format(zip_key[0][:12]))
+                    zip_buffer = io.BytesIO()
+                    with zipfile.ZipFile(zip_buffer, 'w') as ibmcf_pywren_zip:
+                        for zip_name, content in contents:
+                            ibmcf_pywren_zip.writestr(zip_name, content, zipfile.ZIP_DEFLATED)
+                            if compiled and zip_name.endswith('.py') and zip_name != '__main__.py':
+                                bytecode = compile_bytecode(content, zip_name)
+                                if bytecode is not None:
+                                    pyc_name = importlib.util.cache_from_source(zip_name)
+                                    ibmcf_pywren_zip.writestr(pyc_name, bytecode, zipfile.ZIP_DEFLATED)
+                    for key in [key for key in _handler_zips if key[0] != zip_key[0]]:
+                        del _handler_zips[key]
+                    _handler_zips[zip_key] = zip_buffer.getvalue()
+                return _handler_zips[zip_key]
         except Exception as e:
-            raise Exception('Unable to create the {} package: {}'.format(ZIP_LOCATION, e))
+            raise Exception('Unable to create the function handler zip: {}'.format(e))
 
     def build_runtime(self, docker_image_name, dockerfile):
         """
@@ -97,9 +142,10 @@ class ComputeBackend:
         if res != 0:
             exit()
 
-    def create_runtime(self, docker_image_name, memory, timeout=300000):
+    def create_runtime(self, docker_image_name, memory, timeout=300000, python_ver=None):
         """
         Creates a new runtime into IBM CF namespace from an already built Docker image
+        :param python_ver: Python version of the Docker image, from its runtime metadata
         """
         if docker_image_name == 'default':
             docker_image_name = self._get_default_runtime_image_name()
@@ -108,10 +154,7 @@ class ComputeBackend:
         self.cf_client.create_package(self.package)
         action_name = self._format_action_name(docker_image_name, memory)
 
-        self._create_handler_zip()
-
-        with open(ZIP_LOCATION, "rb") as action_zip:
-            action_bin = action_zip.read()
+        action_bin = self._create_handler_zip(python_ver)
         self.cf_client.create_action(self.package, action_name, docker_image_name, code=action_bin,
                                      memory=memory, is_binary=True, timeout=timeout)
         return action_name
@@ -130,14 +173,14 @@ class ComputeBackend:
         Deletes all runtimes from all packages
         """
         packages = self.cf_client.list_packages()
-        for pkg in packages:
-            if 'pywren_v' in pkg['name']:
-                actions = self.cf_client.list_actions(pkg['name'])
-                while actions:
-                    for action in actions:
-                        self.cf_client.delete_action(pkg['name'], action['name'])
+        with ThreadPoolExecutor(DEPLOY_POOL_SIZE) as pool:
+            for pkg in packages:
+                if 'pywren_v' in pkg['name']:
                     actions = self.cf_client.list_actions(pkg['name'])
-                self.cf_client.delete_package(pkg['name'])
+                    while actions:
+                        list(pool.map(lambda action: self.cf_client.delete_action(pkg['name'], action['name']), actions))
+                        actions = self.cf_client.list_actions(pkg['name'])
+                    self.cf_client.delete_package(pkg['name'])
 
     def list_runtimes(self, docker_image_name='all'):
         """
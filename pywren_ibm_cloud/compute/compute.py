@@ -8,11 +8,16 @@ logger = logging.getLogger(__name__)
 
 
 class Singleton(type):
+    """
+    One instance per compute backend and region
+    """
     _instances = {}
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+    def __call__(cls, compute_config):
+        backend = compute_config['backend']
+        key = (cls, backend, compute_config[backend].get('region'))
+        if key not in cls._instances:
+            cls._instances[key] = super(Singleton, cls).__call__(compute_config)
+        return cls._instances[key]
 
 
 class Compute(metaclass=Singleton):
@@ -25,6 +30,7 @@ class Compute(metaclass=Singleton):
         self.log_level = os.getenv('CB_LOG_LEVEL')
         self.config = compute_config
         self.backend = self.config['backend']
+        self.region = self.config[self.backend].get('region')
 
         self.invocation_retry = self.config['invocation_retry']
         self.retry_sleeps = self.config['retry_sleeps']
@@ -38,6 +44,9 @@ class Compute(metaclass=Singleton):
         except Exception as e:
             raise Exception("An exception was produced trying to create the '{}' compute backend: {}".format(self.backend, e))
 
+        # Maximum concurrent activations of the backend region, None if unknown
+        self.concurrency = getattr(self.compute_handler, 'concurrency', None)
+
     def invoke(self, runtime_name, memory, payload):
         """
         Invoke -- return information about this invocation
@@ -70,12 +79,13 @@ class Compute(metaclass=Singleton):
         """
         self.compute_handler.build_runtime(runtime_name, file)
 
-    def create_runtime(self, runtime_name, memory, timeout=300000):
+    def create_runtime(self, runtime_name, memory, timeout=300000, python_ver=None):
         """
         Wrapper method to create a runtime in the compute backend.
+        :param python_ver: Python version of the runtime, from its metadata
         return: the name of the runtime
         """
-        return self.compute_handler.create_runtime(runtime_name, memory, timeout=timeout)
+        return self.compute_handler.create_runtime(runtime_name, memory, timeout=timeout, python_ver=python_ver)
 
     def delete_runtime(self, runtime_name, memory):
         """
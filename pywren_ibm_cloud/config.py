@@ -27,10 +27,15 @@ STORAGE_PREFIX_DEFAULT = "pywren.jobs"
 EXECUTION_TIMEOUT = 600  # Default: 600 seconds => 10 minutes
 DATA_CLEANER_DEFAULT = False
 MAX_AGG_DATA_SIZE = 4e6
+REMOTE_INVOCATION_FANOUT = 100  # Calls started by each remote invoker
+DEPLOY_POOL_SIZE = 8  # Concurrent runtime create/delete requests
 INVOCATION_RETRY_DEFAULT = True
 RETRY_SLEEPS_DEFAULT = [1, 2, 4, 8]
 RETRIES_DEFAULT = 5
 AMQP_URL_DEFAULT = None
+COMPRESSION_DEFAULT = True
+TRACING_DEFAULT = False
+RESOURCE_SAMPLING_INTERVAL_DEFAULT = 1
 
 
 def load(config_filename):
@@ -96,6 +101,12 @@ def default_config(config_data=None):
         config_data['pywren']['retry_sleeps'] = RETRY_SLEEPS_DEFAULT
     if 'retries' not in config_data['pywren']:
         config_data['pywren']['retries'] = RETRIES_DEFAULT
+    if 'compression' not in config_data['pywren']:
+        config_data['pywren']['compression'] = COMPRESSION_DEFAULT
+    if 'tracing' not in config_data['pywren']:
+        config_data['pywren']['tracing'] = TRACING_DEFAULT
+    if 'resource_sampling_interval' not in config_data['pywren']:
+        config_data['pywren']['resource_sampling_interval'] = RESOURCE_SAMPLING_INTERVAL_DEFAULT
     if 'compute_backend' not in config_data['pywren']:
         config_data['pywren']['compute_backend'] = COMPUTE_BACKEND_DEFAULT
 
@@ -127,7 +138,7 @@ def extract_storage_config(config):
     return storage_config
 
 
-def extract_compute_config(config):
+def extract_compute_config(config, region=None):
     compute_config = dict()
     cb = config['pywren']['compute_backend']
     compute_config['backend'] = cb
@@ -136,12 +147,25 @@ def extract_compute_config(config):
     compute_config['retries'] = config['pywren']['retries']
     compute_config[cb] = config[cb].copy()
     compute_config[cb]['user_agent'] = 'pywren-ibm-cloud/{}'.format(__version__)
-    if 'compute_backend_region' in config['pywren']:
+    if region is not None:
+        compute_config[cb]['region'] = region
+    elif 'compute_backend_region' in config['pywren']:
         compute_config[cb]['region'] = config['pywren']['compute_backend_region']
 
     return compute_config
 
 
+def extract_compute_regions(config):
+    """
+    Returns the compute backend regions where the calls of a job can be invoked.
+    The first one is the default region.
+    """
+    regions = config['pywren'].get('compute_backend_regions')
+    if regions:
+        return list(regions)
+    return [config['pywren'].get('compute_backend_region')]
+
+
 def default_logging_config(log_level='INFO'):
     if log_level == 'DEBUG_BOTO3':
         log_level = 'DEBUG'
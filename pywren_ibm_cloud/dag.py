@@ -0,0 +1,241 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+from pywren_ibm_cloud.future import ResponseFuture
+from pywren_ibm_cloud.wait import wait, ANY_COMPLETED
+from pywren_ibm_cloud.config import EXECUTION_TIMEOUT
+from pywren_ibm_cloud.job import create_map_job, create_dag_job
+from pywren_ibm_cloud.executor import ExecutorState, JobState
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    A stage of a DAG. A map stage runs one call per input, a reduce stage
+    runs a single call with all the inputs.
+    """
+
+    def __init__(self, func, inputs=(), reduce=False, iterdata=None, futures=None,
+                 extra_env=None, extra_meta=None, runtime_memory=None, timeout=EXECUTION_TIMEOUT):
+        self.func = func
+        self.inputs = list(inputs)
+        self.reduce = reduce
+        self.iterdata = iterdata
+        self.extra_env = extra_env
+        self.extra_meta = extra_meta
+        self.runtime_memory = runtime_memory
+        self.timeout = timeout
+        # Future of each call, None until the call is launched
+        self.futures = futures
+        # First job of the stage, its function is reused by the next jobs
+        self.job = None
+        self.job_id = None
+        self.rounds = 0
+
+    @property
+    def launched(self):
+        return self.futures is not None and None not in self.futures
+
+
+def _completed(future):
+    return future is not None and (future.ready or future.done)
+
+
+def _is_futures(inputs):
+    """
+    True if `inputs` is a list of futures. Empty lists are taken as futures, as
+    they cannot be the data of a stage either.
+    """
+    return isinstance(inputs, (list, tuple)) and all(isinstance(f, ResponseFuture) for f in inputs)
+
+
+class DAG:
+    """
+    A DAG of stages run by a FunctionExecutor. Each call of a stage is launched
+    as soon as the calls it depends on are complete, and it downloads their
+    results from the storage.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.stages = []
+
+    def _as_stage(self, inputs):
+        if isinstance(inputs, Stage):
+            return inputs
+        if isinstance(inputs, ResponseFuture):
+            inputs = [inputs]
+        if not _is_futures(inputs):
+            raise Exception('The inputs of a stage must be a stage or a list of futures')
+        if not inputs:
+            raise Exception('The inputs of a stage cannot be an empty list of futures')
+        # Futures of a previous call_async(), map() or map_reduce()
+        stage = Stage(None, futures=list(inputs))
+        self.stages.append(stage)
+        return stage
+
+    def map(self, map_function, inputs, extra_env=None, extra_meta=None, runtime_memory=None,
+            timeout=EXECUTION_TIMEOUT):
+        """
+        Add a map stage.
+        :param map_function: the function to map over the inputs
+        :param inputs: a stage or a list of futures, whose results are passed one by one to map_function.
+        Any other iterable is used as input data, as in FunctionExecutor.map()
+        :param extra_env: Additional environment variables for action environment. Default None.
+        :param extra_meta: Additional metadata to pass to action. Default None.
+        :param runtime_memory: memory to use in the runtime
+        :param timeout: Time that the functions have to complete their execution before raising a timeout.
+        :return: the new stage
+        """
+        if isinstance(inputs, (Stage, ResponseFuture)) or _is_futures(inputs):
+            stage = Stage(map_function, [self._as_stage(inputs)], extra_env=extra_env, extra_meta=extra_meta,
+                          runtime_memory=runtime_memory, timeout=timeout)
+        else:
+            stage = Stage(map_function, iterdata=inputs, extra_env=extra_env, extra_meta=extra_meta,
+                          runtime_memory=runtime_memory, timeout=timeout)
+        self.stages.append(stage)
+        return stage
+
+    def reduce(self, reduce_function, *inputs, extra_env=None, extra_meta=None, runtime_memory=None,
+               timeout=EXECUTION_TIMEOUT):
+        """
+        Add a reduce stage that runs once all its inputs are complete.
+        :param reduce_function: the function to reduce the results, as a list passed in `results`
+        :param inputs: stages or lists of futures
+        :return: the new stage
+        """
+        upstreams = [self._as_stage(stage_inputs) for stage_inputs in inputs]
+        stage = Stage(reduce_function, upstreams, reduce=True, extra_env=extra_env, extra_meta=extra_meta,
+                      runtime_memory=runtime_memory, timeout=timeout)
+        self.stages.append(stage)
+        return stage
+
+    def _launch(self, stage, indexes, input_futures):
+        """
+        Launches the calls `indexes` of the stage in a job. The function of the
+        stage is uploaded with its first job, the next ones only upload their data.
+        """
+        executor = self.executor
+        if stage.job is None:
+            job_id = str(len(executor.jobs)).zfill(3)
+            job = create_dag_job(executor.config, executor.internal_storage, executor.executor_id, job_id,
+                                 stage.func, input_futures, reduce=stage.reduce, extra_env=stage.extra_env,
+                                 extra_meta=stage.extra_meta, runtime_memory=stage.runtime_memory,
+                                 execution_timeout=stage.timeout)
+            stage.job = job
+            stage.job_id = job_id
+            # The futures of all the jobs of the stage are got as a single job
+            executor.jobs[job['job_id']] = {'futures': stage.futures, 'total': len(stage.futures),
+                                            'state': JobState.running}
+        else:
+            stage.rounds += 1
+            job_id = '{}-{}'.format(stage.job_id, stage.rounds)
+            job = create_dag_job(executor.config, executor.internal_storage, executor.executor_id, job_id,
+                                 stage.func, input_futures, reduce=stage.reduce, stage_job=stage.job)
+
+        futures = executor.invoker.run(job)
+        for i, future in zip(indexes, futures):
+            stage.futures[i] = future
+        executor._state = ExecutorState.running
+
+    def _launch_source(self, stage):
+        executor = self.executor
+        job_id = str(len(executor.jobs)).zfill(3)
+        job, unused_parts_per_object = create_map_job(executor.config, executor.internal_storage,
+                                                      executor.executor_id, job_id,
+                                                      map_function=stage.func, iterdata=stage.iterdata,
+                                                      extra_env=stage.extra_env, extra_meta=stage.extra_meta,
+                                                      runtime_memory=stage.runtime_memory,
+                                                      is_cf_cluster=executor.is_cf_cluster,
+                                                      execution_timeout=stage.timeout)
+        stage.futures = executor.invoker.run(job)
+        executor.jobs[job['job_id']] = {'futures': stage.futures, 'total': job['total_calls'],
+                                        'state': JobState.running}
+        executor._state = ExecutorState.running
+
+    def _launch_ready_calls(self, stage):
+        """
+        Launches, in a single job, the calls of the stage whose inputs are complete.
+        """
+        if stage.launched or any(upstream.futures is None for upstream in stage.inputs):
+            return
+
+        if stage.reduce:
+            input_futures = [f for upstream in stage.inputs for f in upstream.futures]
+            if all(_completed(f) for f in input_futures):
+                stage.futures = [None]
+                self._launch(stage, [0], [input_futures])
+            return
+
+        upstream_futures = stage.inputs[0].futures
+        if stage.futures is None:
+            stage.futures = [None] * len(upstream_futures)
+        ready = [i for i, f in enumerate(stage.futures) if f is None and _completed(upstream_futures[i])]
+        if ready:
+            self._launch(stage, ready, [[upstream_futures[i]] for i in ready])
+
+    def _pending_inputs(self):
+        """
+        Futures not yet complete that unlaunched calls depend on.
+        """
+        pending = {}
+        for stage in self.stages:
+            if stage.launched:
+                continue
+            for upstream in stage.inputs:
+                for f in upstream.futures or []:
+                    if f is not None and not _completed(f):
+                        pending[id(f)] = f
+        return list(pending.values())
+
+    def run(self):
+        """
+        Runs the DAG. Returns once all the calls are launched, so the results
+        can be got with FunctionExecutor.get_result(). Only the results of the
+        stages that no other stage depends on are returned.
+        :return: the futures of all the stages
+        """
+        executor = self.executor
+        if executor._state == ExecutorState.finished:
+            raise Exception('You cannot run a DAG in the current state.'
+                            ' Create a new FunctionExecutor() instance.')
+
+        for stage in self.stages:
+            if stage.iterdata is not None:
+                self._launch_source(stage)
+
+        while True:
+            for stage in self.stages:
+                self._launch_ready_calls(stage)
+            pending = self._pending_inputs()
+            if not pending:
+                break
+            wait(pending, executor.executor_id, executor.internal_storage, return_when=ANY_COMPLETED)
+
+        if not all(stage.launched for stage in self.stages):
+            raise Exception('Unable to launch all the stages of the DAG')
+
+        # The outputs of the inner stages are only downloaded by their downstream calls
+        for stage in self.stages:
+            for upstream in stage.inputs:
+                for f in upstream.futures:
+                    f.produce_output = False
+
+        logger.debug('ExecutorID {} - DAG of {} stages launched'.format(executor.executor_id, len(self.stages)))
+
+        return [f for stage in self.stages if stage.func for f in stage.futures]
@@ -3,17 +3,22 @@ import sys
 import time
 import enum
 import json
-import signal
 import logging
+import threading
 import traceback
+from pywren_ibm_cloud import tracing
 from pywren_ibm_cloud.invoker import Invoker
+from pywren_ibm_cloud.runtime import memory
+from pywren_ibm_cloud.runtime import select_runtime
+from pywren_ibm_cloud.broadcast import create_broadcast
+from pywren_ibm_cloud.profiler import create_profile, export_json, export_csv
 from pywren_ibm_cloud.storage import InternalStorage
 from pywren_ibm_cloud.future import FunctionException, JobState
-from pywren_ibm_cloud.wait import wait, ALL_COMPLETED
+from pywren_ibm_cloud.wait import wait, ALL_COMPLETED, CancelledError
 from pywren_ibm_cloud.storage.utils import clean_os_bucket
-from pywren_ibm_cloud.job import create_call_async_job, create_map_job, create_reduce_job
+from pywren_ibm_cloud.job import create_call_async_job, create_map_job, create_reduce_job, plan_reduce_levels
 from pywren_ibm_cloud.config import default_config, extract_storage_config, EXECUTION_TIMEOUT, default_logging_config
-from pywren_ibm_cloud.utils import timeout_handler, is_notebook, is_unix_system, is_cf_cluster, create_executor_id
+from pywren_ibm_cloud.utils import is_notebook, is_cf_cluster, create_executor_id
 
 logger = logging.getLogger(__name__)
 
@@ -58,7 +63,7 @@ class FunctionExecutor:
         if runtime:
             self.config['pywren']['runtime'] = runtime
         if runtime_memory:
-            self.config['pywren']['runtime_memory'] = int(runtime_memory)
+            self.config['pywren']['runtime_memory'] = runtime_memory if runtime_memory == memory.AUTO else int(runtime_memory)
         if compute_backend:
             self.config['pywren']['compute_backend'] = compute_backend
         if compute_backend_region:
@@ -90,10 +95,16 @@ class FunctionExecutor:
         else:
             self.config['rabbitmq']['amqp_url'] = None
 
+        if self.config['pywren']['tracing'] and tracing.get_exporter() is None:
+            tracing.set_exporter(tracing.FileExporter())
+
         storage_config = extract_storage_config(self.config)
         self.internal_storage = InternalStorage(storage_config)
         self.invoker = Invoker(self.config, self.executor_id)
         self.jobs = {}
+        self._profiled_calls = set()
+        # Cancel events of the waits in progress
+        self._cancel_events = set()
 
     def call_async(self, func, data, extra_env=None, extra_meta=None, runtime_memory=None, timeout=EXECUTION_TIMEOUT):
         """
@@ -117,6 +128,19 @@ class FunctionExecutor:
 
         return future[0]
 
+    def broadcast(self, obj):
+        """
+        Uploads a read-only object shared by all the calls, such as a model or
+        a lookup table, instead of capturing it in the function closure. Pass the
+        returned reference to the functions and use its `value` attribute there.
+        The object is downloaded once per container and mapped into memory, so
+        its numpy arrays are read-only.
+
+        :param obj: object to share
+        :return: `Broadcast` reference
+        """
+        return create_broadcast(self.internal_storage, obj)
+
     def map(self, map_function, map_iterdata, extra_env=None, extra_meta=None, runtime_memory=None,
             chunk_size=None, remote_invocation=False, timeout=EXECUTION_TIMEOUT,
             remote_invocation_groups=None, invoke_pool_threads=500, overwrite_invoke_args=None, exclude_modules=None):
@@ -127,6 +151,7 @@ class FunctionExecutor:
         :param extra_meta: Additional metadata to pass to action. Default None.
         :param chunk_size: the size of the data chunks. 'None' for processing the whole file in one map
         :param remote_invocation: Enable or disable remote_invocayion mechanism. Default 'False'
+        :param remote_invocation_groups: Fan-out of the remote invocation tree: calls started by each remote invoker. Default 100
         :param timeout: Time that the functions have to complete their execution before raising a timeout.
         :param data_type: the type of the data. Now allowed: None (files with newline) and csv.
         :param invoke_pool_threads: Number of threads to use to invoke.
@@ -166,8 +191,8 @@ class FunctionExecutor:
                    extra_meta=None, chunk_size=None, remote_invocation=False,
                    remote_invocation_groups=None, timeout=EXECUTION_TIMEOUT,
                    reducer_one_per_object=False, reducer_wait_local=False,
-                   invoke_pool_threads=500, overwrite_invoke_args=None,
-                   exclude_modules=None):
+                   reducer_fanin=None, reducer_incremental=False, shuffle_partitions=None,
+                   invoke_pool_threads=500, overwrite_invoke_args=None, exclude_modules=None):
         """
         Map the map_function over the data and apply the reduce_function across all futures.
         This method is executed all within CF.
@@ -178,10 +203,21 @@ class FunctionExecutor:
         :param extra_meta: Additional metadata to pass to action. Default None.
         :param chunk_size: the size of the data chunks. 'None' for processing the whole file in one map
         :param remote_invocation: Enable or disable remote_invocayion mechanism. Default 'False'
+        :param remote_invocation_groups: Fan-out of the remote invocation tree: calls started by each remote invoker. Default 100
         :param timeout: Time that the functions have to complete their execution before raising a timeout.
         :param data_type: the type of the data. Now allowed: None (files with newline) and csv.
         :param reducer_one_per_object: Set one reducer per object after running the partitioner
         :param reducer_wait_local: Wait for results locally
+        :param reducer_fanin: Build a reduction tree where each reducer combines at most this number of
+        futures. Intermediate reducers apply reduce_function to groups of results, so it must be associative.
+        Default None (a single reducer)
+        :param reducer_incremental: Pass the map results to reduce_function as a generator that yields
+        them in completion order. Each result is downloaded when the reducer asks for it, so the reduction
+        overlaps the map phase and only one result is kept in memory. Default False (list of all the results)
+        :param shuffle_partitions: Shuffle the map output into this number of partitions. map_function returns
+        (key, value) records, or a dict, which are hash-partitioned by key, and one reducer is started per
+        partition. reduce_function gets the records of its partition as results, and get_result() returns
+        a list with the result of each partition, whatever the number of partitions. Default None (no shuffle)
         :param invoke_pool_threads: Number of threads to use to invoke.
         :param data_all_as_one: upload the data as a single object. Default True
         :param overwrite_invoke_args: Overwrite other args. Mainly used for testing.
@@ -193,7 +229,25 @@ class FunctionExecutor:
             raise Exception('You cannot run map_reduce() in the current state.'
                             ' Create a new FunctionExecutor() instance.')
 
+        if shuffle_partitions and (reducer_fanin or reducer_one_per_object):
+            raise Exception('shuffle_partitions can not be combined with reducer_fanin '
+                            'or reducer_one_per_object')
+        if reducer_fanin is not None and reducer_fanin < 2:
+            raise Exception('reducer_fanin must be at least 2')
+
         job_id = str(len(self.jobs)).zfill(3)
+
+        # Deploy the runtimes of both phases in parallel, before the map phase starts.
+        # With automatic memory the runtime is only known, and deployed, when the job is created
+        memories = []
+        for runtime_memory in (map_runtime_memory, reduce_runtime_memory):
+            runtime_memory = runtime_memory or self.config['pywren']['runtime_memory']
+            if runtime_memory != memory.AUTO and int(runtime_memory) not in memories:
+                memories.append(int(runtime_memory))
+        if len(memories) > 1:
+            select_runtime(self.config, self.internal_storage, self.executor_id, job_id,
+                           self.config['pywren']['runtime'], memories)
+
         job, parts_per_object = create_map_job(self.config, self.internal_storage,
                                                self.executor_id, job_id,
                                                map_function=map_function, iterdata=map_iterdata,
@@ -205,7 +259,8 @@ class FunctionExecutor:
                                                exclude_modules=exclude_modules,
                                                is_cf_cluster=self.is_cf_cluster,
                                                overwrite_invoke_args=overwrite_invoke_args,
-                                               execution_timeout=timeout)
+                                               execution_timeout=timeout,
+                                               shuffle_partitions=shuffle_partitions)
         map_futures = self.invoker.run(job)
         self.jobs[job['job_id']] = {'futures': map_futures, 'total': job['total_calls'], 'state': JobState.running}
         self._state = ExecutorState.running
@@ -213,26 +268,59 @@ class FunctionExecutor:
         if reducer_wait_local:
             self.monitor(futures=map_futures)
 
+        # Intermediate levels of the reduction tree
+        futures = map_futures
+        intermediate_futures = []
+        levels = [] if reducer_one_per_object else plan_reduce_levels(len(map_futures), reducer_fanin)
+        for level in range(len(levels)):
+            job = create_reduce_job(self.config, self.internal_storage, self.executor_id,
+                                    job_id, reduce_function, reduce_runtime_memory,
+                                    futures, None, False, extra_env, extra_meta,
+                                    reducer_fanin=reducer_fanin, level=level,
+                                    reducer_incremental=reducer_incremental)
+            level_futures = self.invoker.run(job)
+            self.jobs[job['job_id']] = {'futures': level_futures, 'total': job['total_calls'], 'state': JobState.running}
+            for f in futures:
+                f.produce_output = False
+            intermediate_futures.extend(level_futures)
+            futures = level_futures
+
         job = create_reduce_job(self.config, self.internal_storage, self.executor_id,
                                 job_id, reduce_function, reduce_runtime_memory,
-                                map_futures, parts_per_object, reducer_one_per_object,
-                                extra_env, extra_meta)
+                                futures, parts_per_object, reducer_one_per_object,
+                                extra_env, extra_meta, reducer_incremental=reducer_incremental,
+                                shuffle_partitions=shuffle_partitions)
         reduce_futures = self.invoker.run(job)
         self.jobs[job['job_id']] = {'futures': reduce_futures, 'total': job['total_calls'], 'state': JobState.running}
+        if shuffle_partitions:
+            # get_result() returns the result of each partition in a list, even with a single one
+            self.jobs[job['job_id']]['partitioned'] = True
 
-        for f in map_futures:
+        for f in futures:
             f.produce_output = False
 
-        return map_futures + reduce_futures
+        return map_futures + intermediate_futures + reduce_futures
+
+    def dag(self):
+        """
+        Creates a DAG of stages that run in this executor. Add the stages with
+        map() and reduce() and launch them with run().
+
+        :return: `DAG` object
+        """
+        from pywren_ibm_cloud.dag import DAG
+        return DAG(self)
 
     def monitor(self, futures=None, throw_except=True, return_when=ALL_COMPLETED,
                 download_results=False, timeout=EXECUTION_TIMEOUT,
-                THREADPOOL_SIZE=128, WAIT_DUR_SEC=1):
+                THREADPOOL_SIZE=128, WAIT_DUR_SEC=1, cancel_event=None):
         """
         Wait for the Future instances `fs` to complete. Returns a 2-tuple of
         lists. The first list contains the futures that completed
         (finished or cancelled) before the wait completed. The second
         contains uncompleted futures.
+        It does not use signals, so it can be called from any thread, and
+        several executors can be monitored at the same time.
         :param futures: Futures list. Default None
         :param throw_except: Re-raise exception if call raised. Default True.
         :param return_when: One of `ALL_COMPLETED`, `ANY_COMPLETED`, `ALWAYS`
@@ -240,6 +328,8 @@ class FunctionExecutor:
         :param timeout: Timeout of waiting for results.
         :param THREADPOOL_SIZE: Number of threads to use. Default 64
         :param WAIT_DUR_SEC: Time interval between each check.
+        :param cancel_event: threading.Event that cancels the wait when set. cancel() also
+        cancels it. Default None
         :return: `(fs_done, fs_notdone)`
             where `fs_done` is a list of futures that have completed
             and `fs_notdone` is a list of futures that have not completed.
@@ -275,9 +365,8 @@ class FunctionExecutor:
         if not self.log_level and self._state == ExecutorState.running:
             print(msg)
 
-        if is_unix_system():
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(timeout)
+        cancel_event = cancel_event or threading.Event()
+        self._cancel_events.add(cancel_event)
 
         pbar = None
         if not self.is_cf_cluster and self._state == ExecutorState.running \
@@ -292,13 +381,13 @@ class FunctionExecutor:
         try:
             wait(ftrs, self.executor_id, self.internal_storage, download_results=download_results,
                  throw_except=throw_except, return_when=return_when, rabbit_amqp_url=rabbit_amqp_url,
-                 pbar=pbar, THREADPOOL_SIZE=THREADPOOL_SIZE, WAIT_DUR_SEC=WAIT_DUR_SEC)
+                 pbar=pbar, THREADPOOL_SIZE=THREADPOOL_SIZE, WAIT_DUR_SEC=WAIT_DUR_SEC,
+                 timeout=timeout, cancel_event=cancel_event)
 
         except FunctionException as e:
-            if is_unix_system():
-                signal.alarm(0)
             if pbar:
                 pbar.close()
+                pbar = None
             logger.info(e.msg)
             if not is_notebook():
                 print()
@@ -309,7 +398,7 @@ class FunctionExecutor:
             else:
                 print()
                 traceback.print_exception(*e.exception)
-            sys.exit()
+            raise
 
         except TimeoutError:
             if download_results:
@@ -320,7 +409,7 @@ class FunctionExecutor:
                    '\nActivations not done: {}'.format(self.executor_id, timeout, not_dones_activation_ids))
             self._state = ExecutorState.error
 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, CancelledError):
             if download_results:
                 not_dones_activation_ids = [f.activation_id for f in ftrs if not f.done and not (f.ready and not f.produce_output)]
             else:
@@ -329,8 +418,7 @@ class FunctionExecutor:
             self._state = ExecutorState.error
 
         finally:
-            if is_unix_system():
-                signal.alarm(0)
+            self._cancel_events.discard(cancel_event)
             if pbar:
                 pbar.close()
                 if not is_notebook():
@@ -339,6 +427,8 @@ class FunctionExecutor:
                 logger.info(msg)
                 if not self.log_level:
                     print(msg)
+            if not self.is_cf_cluster:
+                self._record_memory_profiles(ftrs)
             if download_results and self.data_cleaner and not self.is_cf_cluster:
                 self.clean()
 
@@ -353,6 +443,62 @@ class FunctionExecutor:
 
         return fs_dones, fs_notdones
 
+    def cancel(self):
+        """
+        Cancels the waits of this executor in progress, like monitor() and get_result(),
+        from any thread. They return the futures completed so far. The calls are not stopped.
+        """
+        for cancel_event in list(self._cancel_events):
+            cancel_event.set()
+
+    async def wait_async(self, futures=None, throw_except=True, return_when=ALL_COMPLETED,
+                         download_results=False, timeout=EXECUTION_TIMEOUT,
+                         THREADPOOL_SIZE=128, WAIT_DUR_SEC=1):
+        """
+        Coroutine version of monitor(), for asyncio applications. The wait runs in
+        the default executor of the event loop, so the event loop is not blocked.
+        Cancelling the coroutine cancels the wait.
+        :return: `(fs_done, fs_notdone)`
+        """
+        import asyncio
+        from functools import partial
+
+        cancel_event = threading.Event()
+        loop = asyncio.get_running_loop()
+        monitor = partial(self.monitor, futures=futures, throw_except=throw_except,
+                          return_when=return_when, download_results=download_results,
+                          timeout=timeout, THREADPOOL_SIZE=THREADPOOL_SIZE,
+                          WAIT_DUR_SEC=WAIT_DUR_SEC, cancel_event=cancel_event)
+        try:
+            return await loop.run_in_executor(None, monitor)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+    def _record_memory_profiles(self, futures):
+        """
+        Records the peak memory and the duration of the completed calls, used
+        to select the runtime memory of the next jobs with runtime_memory='auto'
+        """
+        records = {}
+        for f in futures:
+            key = f.invoke_status.get('memory_profile_key')
+            if key is None or not f.run_status or (f.job_id, f.call_id) in self._profiled_calls:
+                continue
+            self._profiled_calls.add((f.job_id, f.call_id))
+            record = memory.call_record(f)
+            if record is not None:
+                records.setdefault(key, []).append(record)
+
+        if records:
+            profiles = memory.MemoryProfiles()
+            for key, key_records in records.items():
+                profiles.record(key, key_records)
+            try:
+                profiles.save()
+            except OSError as e:
+                logger.debug('ExecutorID {} - Unable to save the memory profiles: {}'.format(self.executor_id, e))
+
     def get_result(self, futures=None, throw_except=True, timeout=EXECUTION_TIMEOUT, THREADPOOL_SIZE=64, WAIT_DUR_SEC=1):
         """
         For getting results
@@ -375,11 +521,14 @@ class FunctionExecutor:
                                                     timeout=timeout, download_results=True,
                                                     THREADPOOL_SIZE=THREADPOOL_SIZE,
                                                     WAIT_DUR_SEC=WAIT_DUR_SEC)
-        result = [f.result(internal_storage=self.internal_storage) for f in fs_dones if not f.futures and f.produce_output]
+        output_fs = [f for f in fs_dones if not f.futures and f.produce_output]
+        result = [f.result(internal_storage=self.internal_storage) for f in output_fs]
         self._state = ExecutorState.success
         msg = "ExecutorID {} Finished getting results".format(self.executor_id)
         logger.debug(msg)
-        if result and len(result) == 1:
+        partitioned = any(self.jobs.get(f.job_id, {}).get('partitioned') for f in output_fs
+                          if f.executor_id == self.executor_id)
+        if result and len(result) == 1 and not partitioned:
             return result[0]
         return result
 
@@ -423,11 +572,35 @@ class FunctionExecutor:
             print(msg)
 
         run_statuses = [f.run_status for f in ftrs_to_plot]
-        invoke_statuses = [f.invoke_status for f in ftrs_to_plot]
+        invoke_statuses = [f.invoke_status.copy() for f in ftrs_to_plot]
 
         create_timeline(dst_dir, dst_file_name, self.start_time, run_statuses, invoke_statuses, self.config['ibm_cos'])
         create_histogram(dst_dir, dst_file_name, self.start_time, run_statuses, self.config['ibm_cos'])
 
+    def profile(self, futures=None, dst_json=None, dst_csv=None):
+        """
+        Creates the phase breakdown of the completed calls: submit, queue, cold start,
+        setup, download, exec, upload and detect. Each job gets the percentiles of
+        each phase, its critical path, its dominant phase and its GB-seconds.
+
+        :param futures: list of futures. Default all the futures of the executor
+        :param dst_json: file to export the whole profile as JSON. Default None
+        :param dst_csv: file to export the profile of each call as CSV. Default None
+        :return: dict with the profile of each call in 'calls' and the summary of each job in 'jobs'
+        """
+        if futures is None:
+            futures = [f for job in self.jobs.values() for f in job['futures']]
+        elif type(futures) != list:
+            futures = [futures]
+
+        profile = create_profile([f for f in futures if f.ready or f.done])
+        if dst_json:
+            export_json(profile, dst_json)
+        if dst_csv:
+            export_csv(profile, dst_csv)
+
+        return profile
+
     def clean(self, local_execution=True, delete_all=False):
         """
         Deletes all the files from COS. These files include the function,
@@ -18,11 +18,14 @@ import time
 import enum
 import pickle
 import logging
+from array import array
+from collections.abc import MutableMapping
+from pywren_ibm_cloud import tracing
+from pywren_ibm_cloud import serializers
 from pywren_ibm_cloud.storage import InternalStorage
 from pywren_ibm_cloud.storage.utils import check_storage_path, get_storage_path
-from pywren_ibm_cloud.libs.tblib import pickling_support
+from pywren_ibm_cloud.storage.utils import create_output_key, create_status_key
 
-pickling_support.install()
 logger = logging.getLogger(__name__)
 
 
@@ -36,6 +39,12 @@ class JobState(enum.Enum):
     error = 7
 
 
+_JOB_STATES = {state.value: state for state in JobState}
+_DONE_STATES = frozenset(state.value for state in (JobState.success, JobState.futures, JobState.error))
+_READY_STATES = frozenset(state.value for state in (JobState.ready, JobState.futures, JobState.error))
+NAN = float('nan')
+
+
 class FunctionException(Exception):
     def __init__(self, executor_id, activation_id, exc, exc_msg):
         self.exception = exc
@@ -44,37 +53,277 @@ class FunctionException(Exception):
         super().__init__(self.msg)
 
 
+class JobStore:
+    """
+    State and timings of the calls of a job, stored by column and indexed by
+    call number, so that a job of many calls does not keep a dict per call.
+    The metadata shared by all the calls of the job is kept only once.
+    """
+    # Timestamps and durations of each call, in seconds. NaN means not set.
+    TIMES = ('host_submit_time', 'invoke_time', 'status_done_timestamp',
+             'download_output_time', 'download_output_timestamp')
+    COUNTS = ('status_query_count', 'output_query_count')
+
+    def __init__(self, executor_id, job_id, storage_config, job_meta, total_calls, data_ranges=None, first_call=0):
+        """
+        :param job_meta: invoke metadata shared by all the calls of the job
+        :param data_ranges: data byte range of each call. Default None
+        :param first_call: call number of the first call of the store. Default 0
+        """
+        self.executor_id = executor_id
+        self.job_id = job_id
+        self.storage_config = storage_config
+        self.storage_path = get_storage_path(storage_config)
+        self.job_meta = job_meta
+        self.total_calls = total_calls
+        self.first_call = first_call
+        self.data_ranges = data_ranges
+
+        self.states = bytearray([JobState.new.value]) * total_calls
+        self.produce_output = bytearray([True]) * total_calls
+        self.activation_ids = [None] * total_calls
+        self.times = {key: array('d', [NAN]) * total_calls for key in self.TIMES}
+        self.counts = {key: array('l', [0]) * total_calls for key in self.COUNTS}
+        # Compute region of each call, as an index of `regions`
+        self.regions = []
+        self.call_regions = array('b', [-1]) * total_calls
+        # Other invoke metadata of some calls: call number -> dict
+        self.extra = {}
+
+    def call_id(self, index):
+        return '{:05d}'.format(self.first_call + index)
+
+    def get_region(self, index):
+        region = self.call_regions[index]
+        return self.regions[region] if region >= 0 else None
+
+    def set_region(self, index, region):
+        if region not in self.regions:
+            self.regions.append(region)
+        self.call_regions[index] = self.regions.index(region)
+
+    def futures(self):
+        """
+        Futures of all the calls of the store
+        """
+        return [ResponseFuture(self, index) for index in range(self.total_calls)]
+
+
+class CallStatus(MutableMapping):
+    """
+    Invoke status of a call: a dict-like view of its row in the JobStore.
+    """
+    __slots__ = ('_store', '_index')
+
+    # Keys computed from the store, in the order they are listed
+    CALL_KEYS = ('call_id', 'activation_id', 'compute_region', 'data_byte_range',
+                 'output_key', 'status_key', 'trace_context')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def _call_value(self, key):
+        store, index = self._store, self._index
+        if key == 'call_id':
+            return store.call_id(index)
+        if key == 'activation_id':
+            return store.activation_ids[index]
+        if key == 'compute_region':
+            return store.get_region(index)
+        if key == 'data_byte_range':
+            return store.data_ranges[index] if store.data_ranges else None
+        if key == 'trace_context':
+            # The span of each call is a child of the span of the job, remotely invoked calls share it
+            trace_context = store.job_meta.get('trace_context')
+            if store.job_meta.get('remote_invocation'):
+                return trace_context
+            return tracing.child_context(trace_context, store.first_call + index)
+        prefix = store.storage_config['prefix']
+        if key == 'output_key':
+            return create_output_key(prefix, store.executor_id, store.job_id, store.call_id(index))
+        return create_status_key(prefix, store.executor_id, store.job_id, store.call_id(index))
+
+    def __getitem__(self, key):
+        store, index = self._store, self._index
+        if key in store.times:
+            value = store.times[key][index]
+            if value != value:
+                raise KeyError(key)
+            return value
+        if key in store.counts:
+            return store.counts[key][index]
+        extra = store.extra.get(index)
+        if extra is not None and key in extra:
+            return extra[key]
+        if key in self.CALL_KEYS:
+            return self._call_value(key)
+        return store.job_meta[key]
+
+    def __setitem__(self, key, value):
+        store, index = self._store, self._index
+        if key in store.times and value is not None:
+            store.times[key][index] = value
+        elif key in store.counts:
+            store.counts[key][index] = value
+        elif key == 'activation_id':
+            store.activation_ids[index] = value
+        elif key == 'compute_region':
+            store.set_region(index, value)
+        else:
+            store.extra.setdefault(index, {})[key] = value
+
+    def __delitem__(self, key):
+        store, index = self._store, self._index
+        extra = store.extra.get(index)
+        if extra is not None and key in extra:
+            del extra[key]
+        elif key in store.times and key in self:
+            store.times[key][index] = NAN
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        store, index = self._store, self._index
+        extra = store.extra.get(index, {})
+        for key in store.job_meta:
+            if key not in extra and key not in self.CALL_KEYS:
+                yield key
+        yield from self.CALL_KEYS
+        for key in store.times:
+            if store.times[key][index] == store.times[key][index]:
+                yield key
+        yield from store.counts
+        for key in extra:
+            if key not in self.CALL_KEYS:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        return dict(self)
+
+
 class ResponseFuture:
 
     """
     Object representing the result of a PyWren invocation. Returns the status of the
-    execution and the result when available.
+    execution and the result when available. The invoke status of the call is kept
+    in the JobStore of its job.
     """
+    __slots__ = ('_store', '_index', 'run_status', '_exception', '_return_val',
+                 '_new_futures', '_call_invoker_result')
+
     GET_RESULT_SLEEP_SECS = 1
     GET_RESULT_MAX_RETRIES = 10
 
-    def __init__(self, call_id, job_id, executor_id, activation_id, storage_config, invoke_metadata):
-        self.call_id = call_id
-        self.job_id = job_id
-        self.executor_id = executor_id
-        self.activation_id = activation_id
-        self.storage_config = storage_config
-        self.produce_output = True
+    def __init__(self, store, index):
+        """
+        :param store: JobStore of the job of the call
+        :param index: index of the call in the store
+        """
+        self._store = store
+        self._index = index
 
-        self._state = JobState.new
-        self._exception = Exception()
+        self._exception = None
         self._return_val = None
         self._new_futures = None
-        self._traceback = None
         self._call_invoker_result = None
 
         self.run_status = None
-        self.invoke_status = invoke_metadata.copy()
 
-        self.status_query_count = 0
-        self.output_query_count = 0
+    def __getstate__(self):
+        # Futures are sent to the functions and returned by them. Only the
+        # row of the call is sent, along with the job metadata.
+        store = self._store
+        call_status = {key: value for key, value in self.invoke_status.items()
+                       if key not in store.job_meta or store.job_meta[key] is not value}
+        return {'executor_id': store.executor_id, 'job_id': store.job_id, 'call_id': self.call_id,
+                'storage_config': store.storage_config, 'job_meta': store.job_meta,
+                'call_status': call_status, 'state': self._state, 'produce_output': self.produce_output,
+                'run_status': self.run_status, '_exception': self._exception, '_return_val': self._return_val,
+                '_new_futures': self._new_futures, '_call_invoker_result': self._call_invoker_result}
+
+    def __setstate__(self, state):
+        call_status = state['call_status']
+        store = JobStore(state['executor_id'], state['job_id'], state['storage_config'], state['job_meta'], 1,
+                         data_ranges=[call_status.pop('data_byte_range', None)],
+                         first_call=int(state['call_id']))
+        self._store = store
+        self._index = 0
+        for key in CallStatus.CALL_KEYS:
+            if key not in ('activation_id', 'compute_region'):
+                call_status.pop(key, None)
+        self.invoke_status.update(call_status)
+        self._state = state['state']
+        self.produce_output = state['produce_output']
+        for key in ('run_status', '_exception', '_return_val', '_new_futures', '_call_invoker_result'):
+            setattr(self, key, state[key])
+
+    @property
+    def call_id(self):
+        return self._store.call_id(self._index)
+
+    @property
+    def job_id(self):
+        return self._store.job_id
+
+    @property
+    def executor_id(self):
+        return self._store.executor_id
+
+    @property
+    def storage_config(self):
+        return self._store.storage_config
+
+    @property
+    def storage_path(self):
+        return self._store.storage_path
+
+    @property
+    def invoke_status(self):
+        return CallStatus(self._store, self._index)
+
+    @property
+    def activation_id(self):
+        return self._store.activation_ids[self._index]
+
+    @activation_id.setter
+    def activation_id(self, activation_id):
+        self._store.activation_ids[self._index] = activation_id
+
+    @property
+    def produce_output(self):
+        return bool(self._store.produce_output[self._index])
+
+    @produce_output.setter
+    def produce_output(self, produce_output):
+        self._store.produce_output[self._index] = bool(produce_output)
+
+    @property
+    def status_query_count(self):
+        return self._store.counts['status_query_count'][self._index]
+
+    @status_query_count.setter
+    def status_query_count(self, count):
+        self._store.counts['status_query_count'][self._index] = count
+
+    @property
+    def output_query_count(self):
+        return self._store.counts['output_query_count'][self._index]
+
+    @output_query_count.setter
+    def output_query_count(self, count):
+        self._store.counts['output_query_count'][self._index] = count
+
+    @property
+    def _state(self):
+        return _JOB_STATES[self._store.states[self._index]]
 
-        self.storage_path = get_storage_path(self.storage_config)
+    @_state.setter
+    def _state(self, state):
+        self._store.states[self._index] = state.value
 
     def _set_state(self, new_state):
         self._state = new_state
@@ -98,15 +347,11 @@ class ResponseFuture:
 
     @property
     def done(self):
-        if self._state in [JobState.success, JobState.futures, JobState.error]:
-            return True
-        return False
+        return self._store.states[self._index] in _DONE_STATES
 
     @property
     def ready(self):
-        if self._state in [JobState.ready, JobState.futures, JobState.error]:
-            return True
-        return False
+        return self._store.states[self._index] in _READY_STATES
 
     def status(self, check_only=False, throw_except=True, internal_storage=None):
         """
@@ -144,15 +389,21 @@ class ResponseFuture:
             self.status_query_count += 1
 
         self.invoke_status['status_done_timestamp'] = time.time()
-        self.invoke_status['status_query_count'] = self.status_query_count
 
+        tracing.export_spans(call_status.pop('trace_spans', []))
         self.run_status = call_status  # this is the remote status information
+        if self.activation_id is None:
+            # Remotely invoked call
+            self.activation_id = call_status.get('ibm_cf_request_id')
 
         total_time = format(round(call_status['end_time'] - call_status['start_time'], 2), '.2f')
 
         if call_status['exception']:
             # the action handler/jobrunner/function had an exception
             self._set_state(JobState.error)
+            # Tracebacks are only unpickled here, so tblib is not loaded otherwise
+            from pywren_ibm_cloud.libs.tblib import pickling_support
+            pickling_support.install()
             self._exception = pickle.loads(eval(call_status['exc_info']))
             msg = None
 
@@ -240,12 +491,16 @@ class ResponseFuture:
                 return None
 
         call_output_time = time.time()
-        call_invoker_result = internal_storage.get_call_output(self.executor_id, self.job_id, self.call_id)
+        download_span = tracing.start_span('download_output', parent=self.run_status.get('trace_context'),
+                                           call_id=self.call_id)
+        call_invoker_result = internal_storage.get_call_output(self.executor_id, self.job_id,
+                                                               self.call_id, stream=True)
         self.output_query_count += 1
 
         while call_invoker_result is None and self.output_query_count < self.GET_RESULT_MAX_RETRIES:
             time.sleep(self.GET_RESULT_SLEEP_SECS)
-            call_invoker_result = internal_storage.get_call_output(self.executor_id, self.job_id, self.call_id)
+            call_invoker_result = internal_storage.get_call_output(self.executor_id, self.job_id,
+                                                                   self.call_id, stream=True)
             self.output_query_count += 1
 
         if call_invoker_result is None:
@@ -256,12 +511,12 @@ class ResponseFuture:
                 self._set_state(JobState.error)
                 return None
 
-        call_invoker_result = pickle.loads(call_invoker_result)
+        call_invoker_result = serializers.loads_stream(call_invoker_result)
         call_output_time_done = time.time()
+        download_span.end()
         self._call_invoker_result = call_invoker_result
 
         self.invoke_status['download_output_time'] = call_output_time_done - call_output_time
-        self.invoke_status['output_query_count'] = self.output_query_count
         self.invoke_status['download_output_timestamp'] = call_output_time_done
 
         log_msg = ('ExecutorID {} | JobID {} - Got output from Function {} - Activation '
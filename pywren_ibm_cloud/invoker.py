@@ -15,19 +15,69 @@
 #
 
 import os
+import sys
+import json
+import pickle
 import logging
 import time
 from types import SimpleNamespace
+from collections import OrderedDict
+from pywren_ibm_cloud import tracing
 from pywren_ibm_cloud.version import __version__
 from concurrent.futures import ThreadPoolExecutor
 from pywren_ibm_cloud.compute import Compute
-from pywren_ibm_cloud.future import ResponseFuture, JobState
-from pywren_ibm_cloud.config import extract_storage_config, extract_compute_config
+from pywren_ibm_cloud.future import ResponseFuture, JobStore, JobState
+from pywren_ibm_cloud.config import extract_storage_config, extract_compute_config, extract_compute_regions
 from pywren_ibm_cloud.storage.utils import create_output_key, create_status_key
 
 logger = logging.getLogger(__name__)
 
 
+def shard_calls(total_calls, capacities, local_region=None):
+    """
+    Splits the calls of a job across compute regions. The region local to the
+    storage is filled first, up to its capacity. The rest of the calls are
+    spread across the regions proportionally to their capacity.
+    :param total_calls: number of calls of the job
+    :param capacities: OrderedDict region -> maximum concurrent activations (None if unknown)
+    :param local_region: region next to the storage. Default None
+    :return: OrderedDict region -> number of calls
+    """
+    regions = list(capacities)
+    if local_region in capacities:
+        regions.remove(local_region)
+        regions.insert(0, local_region)
+    known = [c for c in capacities.values() if c]
+    default_capacity = max(known) if known else 1
+    capacities = {region: capacities[region] or default_capacity for region in regions}
+
+    shards = OrderedDict((region, 0) for region in regions)
+    first = regions[0]
+    if len(regions) == 1 or (first == local_region and total_calls <= capacities[first]):
+        shards[first] = total_calls
+        return shards
+
+    remaining = total_calls
+    weighted = regions
+    if first == local_region and total_calls <= sum(capacities.values()):
+        # Fill the local region, spill over the rest
+        shards[first] = capacities[first]
+        remaining -= capacities[first]
+        weighted = regions[1:]
+
+    # Largest remainder method
+    total_capacity = sum(capacities[region] for region in weighted)
+    quotas = {region: remaining * capacities[region] / total_capacity for region in weighted}
+    assigned = {region: int(quotas[region]) for region in weighted}
+    left = remaining - sum(assigned.values())
+    for region in sorted(weighted, key=lambda r: quotas[r] - assigned[r], reverse=True)[:left]:
+        assigned[region] += 1
+    for region in weighted:
+        shards[region] += assigned[region]
+
+    return shards
+
+
 class Invoker:
 
     def __init__(self, config, executor_id):
@@ -35,16 +85,64 @@ class Invoker:
         self.config = config
         self.executor_id = executor_id
         self.storage_config = extract_storage_config(self.config)
-        compute_config = extract_compute_config(config)
-        self.internal_compute = Compute(compute_config)
+        # One compute client, with its own connection pool, per region
+        self.internal_computes = OrderedDict()
+        for region in extract_compute_regions(config):
+            compute_config = extract_compute_config(config, region)
+            self.internal_computes[region] = Compute(compute_config)
+        self.local_region = self._get_storage_region()
+
+    def _get_storage_region(self):
+        """
+        Returns the compute region where the storage is, if any
+        """
+        sb = self.storage_config['backend']
+        sb_config = self.storage_config[sb]
+        location = '{} {}'.format(sb_config.get('region', ''), sb_config.get('endpoint', '')).lower()
+        for region in self.internal_computes:
+            if region and region.lower().replace('_', '-') in location.replace('_', '-'):
+                return region
+        return None
+
+    def _create_template_payload(self, job):
+        """
+        Creates the payload shared by all the calls of a job
+        """
+        payload = {
+            'config': self.config,
+            'log_level': self.log_level,
+            'func_key': job.func_key,
+            'data_key': job.data_key,
+            'task_execution_timeout': job.task_execution_timeout,
+            'executor_id': self.executor_id,
+            'job_id': job.job_id,
+            'compression_codecs': job.compression_codecs,
+            'pywren_version': __version__}
+
+        if job.extra_env is not None:
+            logger.debug("Extra environment vars {}".format(job.extra_env))
+            payload['extra_env'] = job.extra_env
+
+        if job.extra_meta is not None:
+            # sanity
+            for k, v in job.extra_meta.items():
+                if k in payload:
+                    raise ValueError("Key {} already in dict".format(k))
+                payload[k] = v
+
+        # overwrite explicit args, mostly used for testing via injection
+        if job.overwrite_invoke_args is not None:
+            payload.update(job.overwrite_invoke_args)
+
+        return payload
 
     def run(self, job_description):
         job = SimpleNamespace(**job_description)
 
         if job.remote_invocation:
-            log_msg = ('ExecutorID {} | JobID {} - Starting {} remote invocation function: Spawning {}() '
-                       '- Total: {} activations'.format(self.executor_id, job.job_id, job.total_calls,
-                                                        job.func_name, job.original_total_calls))
+            log_msg = ('ExecutorID {} | JobID {} - Starting remote invocation: {}() - Total: {} '
+                       'activations - Fan-out: {}'.format(self.executor_id, job.job_id, job.func_name,
+                                                          job.total_calls, job.remote_invocation_fanout))
         else:
             log_msg = ('ExecutorID {} | JobID {} - Starting function invocation: {}()  - Total: {} '
                        'activations'.format(self.executor_id, job.job_id, job.func_name, job.total_calls))
@@ -52,74 +150,248 @@ class Invoker:
         if not self.log_level:
             print(log_msg)
 
+        job_span = tracing.start_span('invoke_job', parent=job.trace_context,
+                                      executor_id=self.executor_id, job_id=job.job_id,
+                                      total_calls=job.total_calls)
+        template_payload = self._create_template_payload(job)
+        template_payload['trace_context'] = job_span.context
+
+        # Invoke metadata shared by all the calls, the rest is kept by call in the store
+        job_meta = job.host_job_meta.copy()
+        job_meta.update(template_payload)
+        del job_meta['config']
+        if job.remote_invocation:
+            job_meta['remote_invocation'] = True
+        store = JobStore(self.executor_id, job.job_id, self.storage_config, job_meta,
+                         job.total_calls, job.data_ranges)
+
         ########################
 
-        def invoke(executor_id, job_id, call_id, func_key, invoke_metadata, data_key, data_byte_range):
-
-            output_key = create_output_key(self.storage_config['prefix'], executor_id, job_id, call_id)
-            status_key = create_status_key(self.storage_config['prefix'], executor_id, job_id, call_id)
-
-            payload = {
-                'config': self.config,
-                'log_level': self.log_level,
-                'func_key': func_key,
-                'data_key': data_key,
-                'output_key': output_key,
-                'status_key': status_key,
-                'task_execution_timeout': job.task_execution_timeout,
-                'data_byte_range': data_byte_range,
-                'executor_id': executor_id,
-                'job_id': job_id,
-                'call_id': call_id,
-                'pywren_version': __version__}
-
-            if job.extra_env is not None:
-                logger.debug("Extra environment vars {}".format(job.extra_env))
-                payload['extra_env'] = job.extra_env
-
-            if job.extra_meta is not None:
-                # sanity
-                for k, v in job.extra_meta.items():
-                    if k in payload:
-                        raise ValueError("Key {} already in dict".format(k))
-                    payload[k] = v
-
-            # overwrite explicit args, mostly used for testing via injection
-            if job.overwrite_invoke_args is not None:
-                payload.update(job.overwrite_invoke_args)
+        def invoke(internal_compute, i):
+            call_id = "{:05d}".format(i)
+            data_byte_range = job.data_ranges[i]
+            invoke_span = tracing.start_span('invoke', parent=job_span, child_index=i, call_id=call_id)
+            payload = create_call_payload(template_payload, self.storage_config['prefix'],
+                                          call_id, data_byte_range)
+            payload['trace_context'] = invoke_span.context or template_payload['trace_context']
 
             host_submit_time = time.time()
             payload['host_submit_time'] = host_submit_time
             # do the invocation
-            activation_id = self.internal_compute.invoke(job.runtime_name, job.runtime_memory, payload)
+            activation_id = internal_compute.invoke(job.runtime_name, job.runtime_memory, payload)
 
             if not activation_id:
-                raise Exception("ExecutorID {} - Activation {} failed, therefore job is failed".format(executor_id, call_id))
-
-            invoke_metadata['activation_id'] = activation_id
-            invoke_metadata['invoke_time'] = time.time() - host_submit_time
-
-            invoke_metadata.update(payload)
-            del invoke_metadata['config']
+                raise Exception("ExecutorID {} - Activation {} failed, therefore job is failed".format(self.executor_id, call_id))
 
-            fut = ResponseFuture(call_id, job_id, executor_id, activation_id, self.storage_config, invoke_metadata)
+            fut = ResponseFuture(store, i)
+            fut.activation_id = activation_id
+            invoke_status = fut.invoke_status
+            invoke_status['host_submit_time'] = host_submit_time
+            invoke_status['invoke_time'] = time.time() - host_submit_time
+            invoke_status['compute_region'] = internal_compute.region
+            invoke_span.set_attribute('activation_id', activation_id)
+            invoke_span.end()
             fut._set_state(JobState.invoked)
 
             return fut
 
+        def remote_invoke(internal_compute, first_call, last_call):
+            host_submit_time = time.time()
+            invoke_range(internal_compute, job.runtime_name, job.runtime_memory, template_payload,
+                         (first_call, last_call), job.data_ranges[first_call:last_call],
+                         job.remote_invocation_fanout, job.invoke_pool_threads, root=True)
+
+            # Futures are pre-computed, the activation IDs are known once the calls finish
+            futures = []
+            for i in range(first_call, last_call):
+                fut = ResponseFuture(store, i)
+                invoke_status = fut.invoke_status
+                invoke_status['host_submit_time'] = host_submit_time
+                invoke_status['compute_region'] = internal_compute.region
+                fut._set_state(JobState.invoked)
+                futures.append(fut)
+
+            return futures
+
         ########################
 
+        capacities = OrderedDict((region, compute.concurrency) for region, compute in self.internal_computes.items())
+        shards = shard_calls(job.total_calls, capacities, self.local_region)
+        if len(shards) > 1:
+            logger.info('ExecutorID {} | JobID {} - Calls per compute region: {}'
+                        .format(self.executor_id, job.job_id, dict(shards)))
+
+        if job.remote_invocation:
+            res = []
+            first_call = 0
+            for region, region_calls in shards.items():
+                if region_calls:
+                    res.extend(remote_invoke(self.internal_computes[region], first_call, first_call + region_calls))
+                first_call += region_calls
+            job_span.end()
+            return res
+
         call_futures = []
-        with ThreadPoolExecutor(max_workers=job.invoke_pool_threads) as executor:
-            for i in range(job.total_calls):
-                call_id = "{:05d}".format(i)
-                data_byte_range = job.data_ranges[i]
-                future = executor.submit(invoke, self.executor_id,
-                                         job.job_id, call_id, job.func_key,
-                                         job.host_job_meta.copy(),
-                                         job.data_key, data_byte_range)
-                call_futures.append(future)
+        executors = []
+        try:
+            first_call = 0
+            for region, region_calls in shards.items():
+                if not region_calls:
+                    continue
+                internal_compute = self.internal_computes[region]
+                executor = ThreadPoolExecutor(max_workers=min(job.invoke_pool_threads, region_calls))
+                executors.append(executor)
+                for i in range(first_call, first_call + region_calls):
+                    future = executor.submit(invoke, internal_compute, i)
+                    call_futures.append(future)
+                first_call += region_calls
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
 
         res = [ft.result() for ft in call_futures]
+        job_span.end()
 
         return res
+
+
+def create_call_payload(template_payload, prefix, call_id, data_byte_range):
+    """
+    Creates the payload of a call from the payload shared by all the calls of the job
+    """
+    payload = template_payload.copy()
+    executor_id = payload['executor_id']
+    job_id = payload['job_id']
+    payload['call_id'] = call_id
+    payload['output_key'] = create_output_key(prefix, executor_id, job_id, call_id)
+    payload['status_key'] = create_status_key(prefix, executor_id, job_id, call_id)
+    payload['data_byte_range'] = data_byte_range
+    return payload
+
+
+def split_call_range(call_range, fanout):
+    """
+    Splits a range of calls in at most `fanout` contiguous sub-ranges of similar
+    size, so that a tree of invokers with `fanout` children starts all the calls.
+    """
+    first_call, last_call = call_range
+    total_calls = last_call - first_call
+    parts = min(fanout, -(-total_calls // fanout))
+    part_size = -(-total_calls // parts)
+    return [(i, min(i + part_size, last_call)) for i in range(first_call, last_call, part_size)]
+
+
+def invoke_range(internal_compute, runtime_name, runtime_memory, template_payload, call_range,
+                 data_ranges, fanout, invoke_pool_threads, root=False):
+    """
+    Starts the calls of `call_range`. Ranges up to `fanout` calls are invoked
+    directly, larger ones through child invoker activations that receive the
+    template payload and a call range, so nothing is serialized or uploaded again.
+    :param call_range: (first call, last call), last call excluded
+    :param data_ranges: data byte ranges of the calls in `call_range`
+    :param root: the range is invoked from the client. Even small ranges are
+    delegated to an invoker activation.
+    """
+    first_call, last_call = call_range
+    executor_id = template_payload['executor_id']
+    job_id = template_payload['job_id']
+    prefix = extract_storage_config(template_payload['config'])['prefix']
+
+    def invoke_call(i):
+        call_id = "{:05d}".format(i)
+        payload = create_call_payload(template_payload, prefix, call_id, data_ranges[i - first_call])
+        payload['host_submit_time'] = time.time()
+        return internal_compute.invoke(runtime_name, runtime_memory, payload)
+
+    def invoke_invoker(sub_range):
+        sub_first, sub_last = sub_range
+        payload = {
+            'remote_invoker': True,
+            'log_level': template_payload['log_level'],
+            'executor_id': executor_id,
+            'job_id': job_id,
+            'call_id': 'I{:05d}-{:05d}'.format(sub_first, sub_last - 1),
+            'compute_region': internal_compute.region,
+            'runtime_name': runtime_name,
+            'runtime_memory': runtime_memory,
+            'template_payload': template_payload,
+            'call_range': sub_range,
+            'data_ranges': data_ranges[sub_first - first_call:sub_last - first_call],
+            'fanout': fanout,
+            'invoke_pool_threads': invoke_pool_threads,
+            'pywren_version': __version__}
+        return internal_compute.invoke(runtime_name, runtime_memory, payload)
+
+    if root:
+        tasks = [(invoke_invoker, sub_range) for sub_range in split_call_range(call_range, fanout)]
+    elif last_call - first_call <= fanout:
+        tasks = [(invoke_call, i) for i in range(first_call, last_call)]
+    else:
+        tasks = [(invoke_invoker, sub_range) for sub_range in split_call_range(call_range, fanout)]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(invoke_pool_threads, len(tasks)))) as executor:
+        futures = [executor.submit(func, arg) for func, arg in tasks]
+
+    failed = []
+    for (func, arg), ft in zip(tasks, futures):
+        if ft.exception() is None and ft.result():
+            continue
+        sub_range = (arg, arg + 1) if func is invoke_call else tuple(arg)
+        exc = ft.exception() or Exception('ExecutorID {} | JobID {} - Unable to invoke calls {}-{}'
+                                          .format(executor_id, job_id, sub_range[0], sub_range[1] - 1))
+        # Nobody waits for the invokers, the calls that will never run are reported in their status
+        set_calls_failed(template_payload, sub_range, (type(exc), exc, exc.__traceback__))
+        failed.append(sub_range)
+
+    if failed:
+        raise Exception('ExecutorID {} | JobID {} - Unable to invoke {}'.format(executor_id, job_id, failed))
+
+
+def set_calls_failed(template_payload, call_range, exc_info):
+    """
+    Stores an error status for each call of `call_range`, as the handler does when
+    a call fails, so that wait() and get_result() raise the exception of the invocation.
+    :param call_range: (first call, last call), last call excluded
+    :param exc_info: (type, value, traceback) of the exception
+    """
+    from pywren_ibm_cloud.storage import InternalStorage
+    from pywren_ibm_cloud.libs.tblib import pickling_support
+    pickling_support.install()
+
+    executor_id = template_payload['executor_id']
+    job_id = template_payload['job_id']
+    storage_config = extract_storage_config(template_payload['config'])
+    internal_storage = InternalStorage(storage_config)
+    pickled_exc = str(pickle.dumps(exc_info))
+    logger.error('ExecutorID {} | JobID {} - Calls {}-{} failed: {}'.format(executor_id, job_id, call_range[0],
+                                                                          call_range[1] - 1, exc_info[1]))
+
+    def put_status(i):
+        call_id = "{:05d}".format(i)
+        now = time.time()
+        call_status = {'exception': True, 'exc_info': pickled_exc, 'call_id': call_id, 'job_id': job_id,
+                       'executor_id': executor_id, 'start_time': now, 'end_time': now}
+        status_key = create_status_key(storage_config['prefix'], executor_id, job_id, call_id)
+        internal_storage.put_data(status_key, json.dumps(call_status))
+
+    with ThreadPoolExecutor(max_workers=min(64, call_range[1] - call_range[0])) as executor:
+        list(executor.map(put_status, range(*call_range)))
+
+
+def remote_invoker(event):
+    """
+    Entry point of the invoker activations of a remote invocation tree
+    """
+    config = event['template_payload']['config']
+    try:
+        compute_config = extract_compute_config(config, event['compute_region'])
+        internal_compute = Compute(compute_config)
+    except Exception:
+        set_calls_failed(event['template_payload'], tuple(event['call_range']), sys.exc_info())
+        raise
+    logger.info('ExecutorID {} | JobID {} - Remote invoker of calls {}-{}'.format(event['executor_id'],
+                                                                               event['job_id'],
+                                                                               *event['call_range']))
+    invoke_range(internal_compute, event['runtime_name'], event['runtime_memory'],
+                 event['template_payload'], tuple(event['call_range']), event['data_ranges'],
+                 event['fanout'], event['invoke_pool_threads'])
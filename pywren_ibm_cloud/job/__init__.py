@@ -1,3 +1,5 @@
 from pywren_ibm_cloud.job.job import create_call_async_job
 from pywren_ibm_cloud.job.job import create_map_job
 from pywren_ibm_cloud.job.job import create_reduce_job
+from pywren_ibm_cloud.job.job import create_dag_job
+from pywren_ibm_cloud.job.job import plan_reduce_levels
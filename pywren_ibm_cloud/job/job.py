@@ -3,14 +3,18 @@ import time
 import pickle
 import logging
 import inspect
-import pywren_ibm_cloud as pywren
-from .serialize import SerializeIndependent, create_module_data
+from .serialize import SerializeIndependent, read_module_files, module_archive_hash, create_module_archive
 from .partitioner import create_partitions, partition_processor
+from .shuffle import shuffle_map_function, fetch_partition
 from pywren_ibm_cloud import utils
-from pywren_ibm_cloud.wait import wait
-from pywren_ibm_cloud.runtime import select_runtime
-from pywren_ibm_cloud.storage.utils import create_func_key, create_agg_data_key
-from pywren_ibm_cloud.config import EXECUTION_TIMEOUT, MAX_AGG_DATA_SIZE
+from pywren_ibm_cloud import serializers
+from pywren_ibm_cloud import tracing
+from pywren_ibm_cloud.wait import wait, ANY_COMPLETED
+from pywren_ibm_cloud.runtime import select_runtime, get_runtime_preinstalls
+from pywren_ibm_cloud.runtime import memory
+from pywren_ibm_cloud.storage.compression import negotiate_codecs, compress
+from pywren_ibm_cloud.storage.utils import create_func_key, create_agg_data_key, create_module_archive_key
+from pywren_ibm_cloud.config import EXECUTION_TIMEOUT, MAX_AGG_DATA_SIZE, REMOTE_INVOCATION_FANOUT
 
 logger = logging.getLogger(__name__)
 
@@ -28,16 +32,15 @@ def create_call_async_job(config, internal_storage, executor_id, job_id, func, d
 def create_map_job(config, internal_storage, executor_id, job_id, map_function, iterdata, obj_chunk_size=None,
                    extra_env=None, extra_meta=None, runtime_memory=None, remote_invocation=False,
                    remote_invocation_groups=None, invoke_pool_threads=128, exclude_modules=None, is_cf_cluster=False,
-                   execution_timeout=EXECUTION_TIMEOUT, overwrite_invoke_args=None):
+                   execution_timeout=EXECUTION_TIMEOUT, overwrite_invoke_args=None, shuffle_partitions=None):
     """
     Wrapper to create a map job.  It integrates COS logic to process objects.
+    :param shuffle_partitions: hash-partition the output of each call into this number of partitions. Default None
     """
     map_job_id = f'M{job_id}'
     data = utils.iterdata_as_list(iterdata)
     map_func = map_function
     map_iterdata = data
-    new_invoke_pool_threads = invoke_pool_threads
-    new_runtime_memory = runtime_memory
 
     # Object processing functionality
     parts_per_object = None
@@ -51,72 +54,76 @@ def create_map_job(config, internal_storage, executor_id, job_id, map_function,
         map_func = partition_processor(map_function)
     # ########
 
+    # Shuffle functionality
+    if shuffle_partitions:
+        map_func = shuffle_map_function(map_func, shuffle_partitions)
+    # ########
+
     # Remote invocation functionality
-    original_total_tasks = len(map_iterdata)
-    if original_total_tasks == 1 or is_cf_cluster:
+    if len(map_iterdata) == 1 or is_cf_cluster:
         remote_invocation = False
-    if remote_invocation:
-        rabbitmq_monitor = "CB_RABBITMQ_MONITOR" in os.environ
-
-        def remote_invoker(input_data):
-            pw = pywren.ibm_cf_executor(rabbitmq_monitor=rabbitmq_monitor)
-            return pw.map(map_function, input_data,
-                          runtime_memory=runtime_memory,
-                          invoke_pool_threads=invoke_pool_threads,
-                          extra_env=extra_env,
-                          extra_meta=extra_meta)
-
-        map_func = remote_invoker
-        if remote_invocation_groups:
-            map_iterdata = [[iterdata[x:x+remote_invocation_groups]]
-                            for x in range(0, original_total_tasks, remote_invocation_groups)]
-        else:
-            map_iterdata = [iterdata]
-        new_invoke_pool_threads = 1
-        new_runtime_memory = runtime_memory
     # ########
 
     job_description = _create_job(config, internal_storage, executor_id,
                                   map_job_id, map_func, map_iterdata,
                                   extra_env=extra_env,
                                   extra_meta=extra_meta,
-                                  runtime_memory=new_runtime_memory,
-                                  invoke_pool_threads=new_invoke_pool_threads,
+                                  runtime_memory=runtime_memory,
+                                  invoke_pool_threads=invoke_pool_threads,
                                   overwrite_invoke_args=overwrite_invoke_args,
                                   exclude_modules=exclude_modules,
                                   original_func_name=map_function.__name__,
                                   remote_invocation=remote_invocation,
-                                  original_total_tasks=original_total_tasks,
+                                  remote_invocation_fanout=remote_invocation_groups,
                                   execution_timeout=execution_timeout)
 
     return job_description, parts_per_object
 
 
 def create_reduce_job(config, internal_storage, executor_id, job_id, reduce_function, reduce_runtime_memory,
-                      map_futures, parts_per_object, reducer_one_per_object, extra_env, extra_meta):
+                      map_futures, parts_per_object, reducer_one_per_object, extra_env, extra_meta,
+                      reducer_fanin=None, level=None, reducer_incremental=False, shuffle_partitions=None):
     """
     Wrapper to create a reduce job. Apply a function across all map futures.
+    :param reducer_fanin: futures reduced by each reducer of an intermediate level. Default None
+    :param level: level of the reduction tree of an intermediate reduce job. Default None (final reduce job)
+    :param reducer_incremental: pass the results as a generator in completion order. Default False
+    :param shuffle_partitions: number of partitions written by each map call. Starts one reducer per
+    partition, which gets the records of its partition instead of the map results. Default None
     """
     reduce_job_id = f'R{job_id}'
     map_iterdata = [[map_futures, ]]
 
-    if parts_per_object and reducer_one_per_object:
+    if level is not None:
+        # Intermediate level of the reduction tree: each reducer combines a group of futures
+        reduce_job_id = f'R{job_id}L{level}'
+        map_iterdata = [[group] for group in split_reduce_groups(map_futures, reducer_fanin)]
+
+    elif parts_per_object and reducer_one_per_object:
         prev_total_partitons = 0
         map_iterdata = []
         for total_partitions in parts_per_object:
             map_iterdata.append([map_futures[prev_total_partitons:prev_total_partitons+total_partitions]])
             prev_total_partitons = prev_total_partitons + total_partitions
 
+    if shuffle_partitions:
+        return _create_shuffle_reduce_job(config, internal_storage, executor_id, reduce_job_id, reduce_function,
+                                          reduce_runtime_memory, map_futures, shuffle_partitions, extra_env,
+                                          extra_meta, reducer_incremental)
+
     def reduce_function_wrapper(fut_list, internal_storage, ibm_cos):
         logger.info('Waiting for results')
         if 'SHOW_MEMORY_USAGE' in os.environ:
             show_memory = eval(os.environ['SHOW_MEMORY_USAGE'])
         else:
             show_memory = False
-        # Wait for all results
-        wait(fut_list, executor_id, internal_storage, download_results=True)
-        results = [f.result() for f in fut_list if f.done and not f.futures]
-        fut_list.clear()
+        if reducer_incremental:
+            results = _results_as_completed(fut_list, executor_id, internal_storage)
+        else:
+            # Wait for all results
+            wait(fut_list, executor_id, internal_storage, download_results=True)
+            results = [f.result() for f in fut_list if f.done and not f.futures]
+            fut_list.clear()
         reduce_func_args = {'results': results}
 
         if show_memory:
@@ -136,6 +143,124 @@ def create_reduce_job(config, internal_storage, executor_id, job_id, reduce_func
                        original_func_name=reduce_function.__name__)
 
 
+def plan_reduce_levels(total_futures, reducer_fanin):
+    """
+    Plans the intermediate levels of a reduction tree.
+    :param total_futures: number of map futures
+    :param reducer_fanin: futures combined by each reducer. None for a single reducer
+    :return: list with the number of reducers of each intermediate level. Empty when the
+    final reducer can combine all the map futures
+    """
+    if reducer_fanin is not None and reducer_fanin < 2:
+        raise Exception('reducer_fanin must be at least 2')
+
+    levels = []
+    while reducer_fanin and total_futures > reducer_fanin:
+        total_futures = -(-total_futures // reducer_fanin)
+        levels.append(total_futures)
+    return levels
+
+
+def split_reduce_groups(futures, reducer_fanin):
+    """
+    Splits the futures of an intermediate level in groups of at most reducer_fanin futures,
+    one per reducer. The last group gets the remainder.
+    """
+    return [futures[i:i+reducer_fanin] for i in range(0, len(futures), reducer_fanin)]
+
+
+def create_dag_job(config, internal_storage, executor_id, job_id, func, input_futures, reduce=False,
+                   extra_env=None, extra_meta=None, runtime_memory=None, execution_timeout=EXECUTION_TIMEOUT,
+                   stage_job=None):
+    """
+    Wrapper to create a job of a DAG stage. The calls get the futures they depend on
+    and download their results from the storage.
+    :param input_futures: list with the futures each call depends on
+    :param reduce: pass all the results as `results` instead of one result as first argument. Default False
+    :param stage_job: first job of the stage. Its function, already in the storage, is reused
+    and only the data of the new calls is uploaded. Default None
+    """
+    dag_job_id = f'D{job_id}'
+    dag_iterdata = [[futures, ] for futures in input_futures]
+
+    def dag_function_wrapper(fut_list, internal_storage, ibm_cos):
+        wait(fut_list, executor_id, internal_storage, download_results=True)
+        results = [f.result(internal_storage=internal_storage) for f in fut_list]
+        fut_list.clear()
+
+        func_args = {}
+        func_sig = inspect.signature(func)
+        if 'ibm_cos' in func_sig.parameters:
+            func_args['ibm_cos'] = ibm_cos
+        if 'internal_storage' in func_sig.parameters:
+            func_args['internal_storage'] = internal_storage
+
+        if reduce:
+            return func(results=results, **func_args)
+        return func(results[0], **func_args)
+
+    if stage_job is not None:
+        return _create_data_job(internal_storage, executor_id, dag_job_id, stage_job,
+                                dag_function_wrapper, dag_iterdata)
+
+    return _create_job(config, internal_storage, executor_id, dag_job_id, dag_function_wrapper, dag_iterdata,
+                       runtime_memory=runtime_memory, extra_env=extra_env, extra_meta=extra_meta,
+                       original_func_name=func.__name__, execution_timeout=execution_timeout)
+
+
+def _create_shuffle_reduce_job(config, internal_storage, executor_id, reduce_job_id, reduce_function,
+                               reduce_runtime_memory, map_futures, shuffle_partitions, extra_env,
+                               extra_meta, reducer_incremental):
+    """
+    Creates the reduce job of a shuffle: one reducer per partition.
+    """
+    map_iterdata = [[map_futures, partition] for partition in range(shuffle_partitions)]
+
+    def reduce_partition_wrapper(fut_list, partition, internal_storage, ibm_cos):
+        logger.info('Fetching partition {}'.format(partition))
+        if reducer_incremental:
+            shuffle_indexes = _results_as_completed(fut_list, executor_id, internal_storage)
+            results = fetch_partition(shuffle_indexes, partition, internal_storage)
+        else:
+            wait(fut_list, executor_id, internal_storage, download_results=True)
+            shuffle_indexes = [f.result() for f in fut_list if f.done and not f.futures]
+            fut_list.clear()
+            results = list(fetch_partition(shuffle_indexes, partition, internal_storage))
+        reduce_func_args = {'results': results}
+
+        func_sig = inspect.signature(reduce_function)
+        if 'ibm_cos' in func_sig.parameters:
+            reduce_func_args['ibm_cos'] = ibm_cos
+        if 'internal_storage' in func_sig.parameters:
+            reduce_func_args['internal_storage'] = internal_storage
+
+        return reduce_function(**reduce_func_args)
+
+    return _create_job(config, internal_storage, executor_id, reduce_job_id, reduce_partition_wrapper, map_iterdata,
+                       runtime_memory=reduce_runtime_memory, extra_env=extra_env, extra_meta=extra_meta,
+                       original_func_name=reduce_function.__name__)
+
+
+def _results_as_completed(fut_list, executor_id, internal_storage):
+    """
+    Generator of the results of the futures in completion order. Each output
+    is downloaded when it is needed and released once it is consumed, so only
+    one result is kept in memory.
+    """
+    pending = list(fut_list)
+    fut_list.clear()
+    while pending:
+        fs_dones, pending = wait(pending, executor_id, internal_storage, return_when=ANY_COMPLETED)
+        for f in fs_dones:
+            result = f.result(internal_storage=internal_storage)
+            if f.futures:
+                pending.extend(result)
+                continue
+            f._return_val = None
+            f._call_invoker_result = None
+            yield result
+
+
 def _agg_data(data_strs):
     """
     Auxiliary function that aggregates data of a job to a single byte string
@@ -149,9 +274,70 @@ def _agg_data(data_strs):
     return b"".join(data_strs), ranges
 
 
+def _upload_data(internal_storage, executor_id, job_id, data_strs, compression_codecs,
+                 job_description, host_job_meta):
+    """
+    Uploads the serialized data of the calls of a job as a single object
+    """
+    data_size_bytes = sum(len(x) for x in data_strs)
+    if data_size_bytes >= MAX_AGG_DATA_SIZE:
+        log_msg = ('ExecutorID {} | JobID {} - Total data exceeded '
+                   'maximum size of {} bytes'.format(executor_id, job_id, MAX_AGG_DATA_SIZE))
+        raise Exception(log_msg)
+
+    agg_data_key = create_agg_data_key(internal_storage.prefix, executor_id, job_id)
+    job_description['data_key'] = agg_data_key
+    # Each datum is compressed on its own, so the workers keep reading their byte range
+    if compression_codecs:
+        data_strs = [compress(data_str, compression_codecs) for data_str in data_strs]
+    agg_data_bytes, agg_data_ranges = _agg_data(data_strs)
+    job_description['data_ranges'] = agg_data_ranges
+    agg_upload_time = time.time()
+    internal_storage.put_data(agg_data_key, agg_data_bytes)
+    host_job_meta['agg_data'] = True
+    host_job_meta['data_size_bytes'] = data_size_bytes
+    host_job_meta['data_upload_bytes'] = len(agg_data_bytes)
+    host_job_meta['data_upload_time'] = time.time() - agg_upload_time
+    host_job_meta['data_upload_timestamp'] = time.time()
+
+
+def _create_data_job(internal_storage, executor_id, job_id, stage_job, func, iterdata):
+    """
+    Creates a job that runs the function of `stage_job`, already in the storage,
+    over new data. Only the data is serialized and uploaded.
+    :param func: the function of the stage, to check the arguments of the data
+    """
+    data = utils.verify_args(func, utils.iterdata_as_list(iterdata))
+
+    job_description = stage_job.copy()
+    job_description['job_id'] = job_id
+    job_description['total_calls'] = len(data)
+    host_job_meta = stage_job['host_job_meta'].copy()
+    host_job_meta['runtime_select_time'] = 0
+    host_job_meta['module_archive_bytes'] = 0
+    host_job_meta['func_upload_bytes'] = 0
+    host_job_meta['func_upload_time'] = 0
+    job_span = tracing.start_span('create_job', executor_id=executor_id, job_id=job_id,
+                                  func_name=job_description['func_name'], total_calls=len(data))
+
+    logger.debug('ExecutorID {} | JobID {} - Uploading data, function '
+                 'from {}'.format(executor_id, job_id, stage_job['job_id']))
+    with tracing.start_span('upload', parent=job_span) as upload_span:
+        data_strs = [serializers.dumps(datum) for datum in data]
+        _upload_data(internal_storage, executor_id, job_id, data_strs, job_description['compression_codecs'],
+                     job_description, host_job_meta)
+        upload_span.set_attribute('data_upload_bytes', host_job_meta['data_upload_bytes'])
+    job_span.end()
+
+    job_description['host_job_meta'] = host_job_meta
+    job_description['trace_context'] = job_span.context
+
+    return job_description
+
+
 def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, extra_env=None, extra_meta=None,
                 runtime_memory=None, invoke_pool_threads=128, overwrite_invoke_args=None,
-                exclude_modules=None, original_func_name=None, remote_invocation=False, original_total_tasks=None,
+                exclude_modules=None, original_func_name=None, remote_invocation=False, remote_invocation_fanout=None,
                 execution_timeout=EXECUTION_TIMEOUT):
     """
     :param func: the function to map over the data
@@ -159,6 +345,7 @@ def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, e
     :param extra_env: Additional environment variables for CF environment. Default None.
     :param extra_meta: Additional metadata to pass to CF. Default None.
     :param remote_invocation: Enable remote invocation. Default False.
+    :param remote_invocation_fanout: Calls started by each remote invoker. Default REMOTE_INVOCATION_FANOUT
     :param invoke_pool_threads: Number of threads to use to invoke.
     :param data_all_as_one: upload the data as a single object. Default True
     :param overwrite_invoke_args: Overwrite other args. Mainly used for testing.
@@ -172,10 +359,22 @@ def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, e
     runtime_name = config['pywren']['runtime']
     if runtime_memory is None:
         runtime_memory = config['pywren']['runtime_memory']
-    runtime_memory = int(runtime_memory)
-    runtime_preinstalls = select_runtime(config, internal_storage, executor_id,
-                                         job_id, runtime_name, runtime_memory)
+    auto_memory = runtime_memory == memory.AUTO
+    runtime_select_time = time.time()
+    if auto_memory:
+        # The memory is selected once the function is serialized, only that runtime is deployed
+        runtime_memory = memory.AUTO_MEMORY_DEFAULT
+        runtime_preinstalls = get_runtime_preinstalls(config, internal_storage, runtime_name)
+    else:
+        runtime_memory = int(runtime_memory)
+        runtime_preinstalls = select_runtime(config, internal_storage, executor_id,
+                                             job_id, runtime_name, runtime_memory)
+    runtime_select_time = time.time() - runtime_select_time
     serializer = SerializeIndependent(runtime_preinstalls)
+    if config['pywren'].get('compression'):
+        compression_codecs = negotiate_codecs(name for name, _ in runtime_preinstalls)
+    else:
+        compression_codecs = []
 
     if original_func_name:
         func_name = original_func_name
@@ -195,6 +394,8 @@ def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, e
 
     host_job_meta = {}
     job_description = {}
+    job_span = tracing.start_span('create_job', executor_id=executor_id, job_id=job_id,
+                                  func_name=func_name, total_calls=len(data))
 
     job_description['runtime_name'] = runtime_name
     job_description['runtime_memory'] = runtime_memory
@@ -207,39 +408,49 @@ def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, e
     job_description['overwrite_invoke_args'] = overwrite_invoke_args
     job_description['job_id'] = job_id
     job_description['remote_invocation'] = remote_invocation
-    job_description['original_total_calls'] = original_total_tasks
+    job_description['remote_invocation_fanout'] = remote_invocation_fanout or REMOTE_INVOCATION_FANOUT
+    job_description['compression_codecs'] = compression_codecs
 
     log_msg = 'ExecutorID {} | JobID {} - Serializing function and data'.format(executor_id, job_id)
     logger.debug(log_msg)
     # pickle func and all data (to capture module dependencies)
-    func_and_data_ser, mod_paths = serializer([func] + data)
+    with tracing.start_span('serialize', parent=job_span):
+        func_and_data_ser, mod_paths = serializer([func] + data)
 
     func_str = func_and_data_ser[0]
     data_strs = func_and_data_ser[1:]
     data_size_bytes = sum(len(x) for x in data_strs)
 
+    input_size = max(memory.call_input_size(datum, len(data_str)) for datum, data_str in zip(data, data_strs))
+    memory_profile_key = memory.profile_key(func, input_size)
+    if auto_memory:
+        recommended_memory = memory.MemoryProfiles().recommend(memory_profile_key)
+        if recommended_memory is None:
+            logger.debug('ExecutorID {} | JobID {} - Not enough memory profiles of {}, using '
+                         '{}MB'.format(executor_id, job_id, func_name, runtime_memory))
+        else:
+            logger.info('ExecutorID {} | JobID {} - Selected {}MB of runtime memory from the '
+                        'memory profiles of {}'.format(executor_id, job_id, recommended_memory, func_name))
+            runtime_memory = recommended_memory
+        auto_select_start = time.time()
+        select_runtime(config, internal_storage, executor_id, job_id, runtime_name, runtime_memory)
+        runtime_select_time += time.time() - auto_select_start
+        job_description['runtime_memory'] = runtime_memory
+
     host_job_meta['agg_data'] = False
     host_job_meta['data_size_bytes'] = data_size_bytes
+    host_job_meta['runtime_memory'] = runtime_memory
+    host_job_meta['memory_profile_key'] = memory_profile_key
+    host_job_meta['runtime_select_time'] = round(runtime_select_time, 8)
 
     log_msg = 'ExecutorID {} | JobID {} - Uploading function and data'.format(executor_id, job_id)
     logger.info(log_msg)
     if not log_level:
         print(log_msg, end=' ')
 
-    if data_size_bytes < MAX_AGG_DATA_SIZE:
-        agg_data_key = create_agg_data_key(internal_storage.prefix, executor_id, job_id)
-        job_description['data_key'] = agg_data_key
-        agg_data_bytes, agg_data_ranges = _agg_data(data_strs)
-        job_description['data_ranges'] = agg_data_ranges
-        agg_upload_time = time.time()
-        internal_storage.put_data(agg_data_key, agg_data_bytes)
-        host_job_meta['agg_data'] = True
-        host_job_meta['data_upload_time'] = time.time() - agg_upload_time
-        host_job_meta['data_upload_timestamp'] = time.time()
-    else:
-        log_msg = ('ExecutorID {} | JobID {} - Total data exceeded '
-                   'maximum size of {} bytes'.format(executor_id, job_id, MAX_AGG_DATA_SIZE))
-        raise Exception(log_msg)
+    upload_span = tracing.start_span('upload', parent=job_span)
+    _upload_data(internal_storage, executor_id, job_id, data_strs, compression_codecs,
+                 job_description, host_job_meta)
 
     if exclude_modules:
         for module in exclude_modules:
@@ -247,18 +458,39 @@ def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, e
                 if module in mod_path and mod_path in mod_paths:
                     mod_paths.remove(mod_path)
 
-    module_data = create_module_data(mod_paths)
+    # Pack module dependencies in an archive, uploaded once per content hash
+    module_archive_key = None
+    module_files = read_module_files(mod_paths)
+    if module_files:
+        module_setup_time = time.time()
+        module_archive_key = create_module_archive_key(internal_storage.prefix, module_archive_hash(module_files))
+        if internal_storage.module_archive_exists(module_archive_key):
+            logger.debug('ExecutorID {} | JobID {} - Module archive already '
+                         'in storage: {}'.format(executor_id, job_id, module_archive_key))
+            host_job_meta['module_archive_bytes'] = 0
+        else:
+            module_archive = create_module_archive(module_files)
+            internal_storage.put_module_archive(module_archive_key, module_archive)
+            host_job_meta['module_archive_bytes'] = len(module_archive)
+        host_job_meta['module_upload_time'] = time.time() - module_setup_time
+
     # Create func and upload
     host_job_meta['func_name'] = func_name
-    func_module_str = pickle.dumps({'func': func_str, 'module_data': module_data}, -1)
+    func_module_str = pickle.dumps({'func': func_str, 'module_archive': module_archive_key}, -1)
     host_job_meta['func_module_bytes'] = len(func_module_str)
 
     func_upload_time = time.time()
     func_key = create_func_key(internal_storage.prefix, executor_id, job_id)
     job_description['func_key'] = func_key
+    func_module_str = compress(func_module_str, compression_codecs)
+    host_job_meta['func_upload_bytes'] = len(func_module_str)
     internal_storage.put_func(func_key, func_module_str)
     host_job_meta['func_upload_time'] = time.time() - func_upload_time
     host_job_meta['func_upload_timestamp'] = time.time()
+    upload_span.set_attribute('data_upload_bytes', host_job_meta['data_upload_bytes'])
+    upload_span.set_attribute('func_upload_bytes', host_job_meta['func_upload_bytes'])
+    upload_span.end()
+    job_span.end()
 
     if not log_level:
         func_and_data_size = utils.sizeof_fmt(host_job_meta['func_module_bytes']+host_job_meta['data_size_bytes'])
@@ -266,5 +498,6 @@ def _create_job(config, internal_storage, executor_id, job_id, func, iterdata, e
         print(log_msg)
 
     job_description['host_job_meta'] = host_job_meta
+    job_description['trace_context'] = job_span.context
 
     return job_description
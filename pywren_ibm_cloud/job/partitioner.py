@@ -19,11 +19,8 @@ import os
 import json
 import struct
 import logging
-import requests
 import inspect
 from pywren_ibm_cloud import utils
-from multiprocessing.pool import ThreadPool
-from pywren_ibm_cloud.storage.backends.ibm_cos.ibm_cos import StorageBackend as ibm_cos_backend
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +40,7 @@ def partition_processor(map_function):
 
         if 'url' in map_func_args:
             # it is a public url
+            import requests
             resp = requests.get(map_func_args['url'], headers=extra_get_args, stream=True)
             map_func_args['data_stream'] = resp.raw
 
@@ -54,6 +52,7 @@ def partition_processor(map_function):
                 bucket = map_func_args['bucket']
                 key = map_func_args['key']
 
+            from pywren_ibm_cloud.storage.backends.ibm_cos.ibm_cos import StorageBackend as ibm_cos_backend
             config = json.loads(os.environ.get('CB_CONFIG'))
             storage = ibm_cos_backend(config['ibm_cos'])
             logger.info('Getting dataset from cos://{}/{}'.format(bucket, key))
@@ -82,6 +81,7 @@ def create_partitions(config, arg_data, chunk_size):
     logger.debug('Starting partitioner')
 
     # We suppose here that the data is always in IBM COS.  TODO: Make it Generic.
+    from pywren_ibm_cloud.storage.backends.ibm_cos.ibm_cos import StorageBackend as ibm_cos_backend
     storage = ibm_cos_backend(config['ibm_cos'])
 
     map_func_keys = arg_data[0].keys()
@@ -153,6 +153,7 @@ def split_objects_from_bucket(map_func_args_list, chunk_size, storage):
 
             parts_per_object.append(total_partitions)
 
+        from multiprocessing.pool import ThreadPool
         pool = ThreadPool(128)
         pool.map(_split, objects)
         pool.close()
@@ -198,6 +199,7 @@ def split_object_from_key(map_func_args_list, chunk_size, storage):
 
         parts_per_object.append(total_partitions)
 
+    from multiprocessing.pool import ThreadPool
     pool = ThreadPool(128)
     pool.map(_split, map_func_args_list)
     pool.close()
@@ -210,6 +212,8 @@ def split_object_from_url(map_func_args_list, chunk_size):
     """
     Create partitions from a list of objects urls
     """
+    import requests
+
     if chunk_size:
         logger.info('Creating chunks from urls...')
     partitions = []
@@ -250,6 +254,7 @@ def split_object_from_url(map_func_args_list, chunk_size):
 
         parts_per_object.append(total_partitions)
 
+    from multiprocessing.pool import ThreadPool
     pool = ThreadPool(128)
     pool.map(_split, map_func_args_list)
     pool.close()
@@ -15,12 +15,14 @@
 #
 
 import os
+import sys
+import hashlib
 import logging
+import zipfile
 from pathlib import Path
 from io import BytesIO as StringIO
-from pywren_ibm_cloud.utils import bytes_to_b64str
-from pywren_ibm_cloud.libs.cloudpipe.cloudpickle import CloudPickler
-from pywren_ibm_cloud.libs.cloudpipe.module_dependency import ModuleDependencyAnalyzer
+from pywren_ibm_cloud.utils import bytes_to_b64str, compile_bytecode
+from pywren_ibm_cloud.serializers import FrameWriter
 
 try:
     import glob2
@@ -30,6 +32,8 @@ except Exception:
 
 logger = logging.getLogger(__name__)
 
+MODULE_IMPORTS_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cloudbutton', 'module_imports.json')
+
 
 class SerializeIndependent:
 
@@ -40,21 +44,32 @@ class SerializeIndependent:
 
     def __call__(self, list_of_objs, **kwargs):
         """
-        Serialize f, args, kwargs independently
+        Serialize f, args, kwargs independently. The first object is the function,
+        the rest are the data objects. Data objects can use the fast path serializers
+        supported by the runtime, with a fallback to cloudpickle.
         """
-        self._modulemgr = ModuleDependencyAnalyzer()
+        from pywren_ibm_cloud.libs.cloudpipe.cloudpickle import CloudPickler
+        from pywren_ibm_cloud.libs.cloudpipe.module_dependency import get_module_dependency_analyzer
+
+        # The analyzer is shared by the jobs of the process
+        self._modulemgr = get_module_dependency_analyzer(MODULE_IMPORTS_CACHE_FILE)
         preinstalled_modules = [name for name, _ in self.preinstalled_modules]
-        self._modulemgr.ignore(preinstalled_modules)
 
         cps = []
         strs = []
-        for obj in list_of_objs:
+        for i, obj in enumerate(list_of_objs):
             file = StringIO()
             try:
                 cp = CloudPickler(file)
-                cp.dump(obj)
+                if i == 0:
+                    cp.dump(obj)
+                    strs.append(file.getvalue())
+                else:
+                    frame_writer = FrameWriter(preinstalled_modules)
+                    cp.persistent_id = frame_writer.persistent_id
+                    cp.dump(obj)
+                    strs.append(frame_writer.pack_bytes(file.getvalue()))
                 cps.append(cp)
-                strs.append(file.getvalue())
             finally:
                 file.close()
 
@@ -64,22 +79,25 @@ class SerializeIndependent:
         else:
             ignore_modulemgr = False
 
+        module_names = []
         if not ignore_modulemgr:
             # Add modules
             for cp in cps:
-                for module in cp.modules:
-                    self._modulemgr.add(module.__name__)
+                module_names.extend(module.__name__ for module in cp.modules)
 
-        mod_paths = self._modulemgr.get_and_clear_paths()
+        mod_paths = self._modulemgr.analyze(module_names, ignore=preinstalled_modules)
         logger.debug("Modules to transmit: {}".format(None if not mod_paths else mod_paths))
 
         return (strs, mod_paths)
 
 
-def create_module_data(mod_paths):
-
-    module_data = {}
-    # load mod paths
+def read_module_files(mod_paths):
+    """
+    Reads the source files of the modules to transmit.
+    :param mod_paths: module files and package directories
+    :return: dict with the archive file names as keys and the file contents as values
+    """
+    module_files = {}
     for m in mod_paths:
         if os.path.isdir(m):
             files = glob2.glob(os.path.join(m, "**/*.py"))
@@ -92,6 +110,56 @@ def create_module_data(mod_paths):
             with open(f, 'rb') as file:
                 mod_str = file.read()
             dest_filename = Path(f[len(pkg_root)+1:]).as_posix()
-            module_data[dest_filename] = bytes_to_b64str(mod_str)
+            module_files[dest_filename] = mod_str
 
-    return module_data
+    return module_files
+
+
+def create_module_data(mod_paths):
+    """
+    Legacy format: base64 encoded module files
+    """
+    module_files = read_module_files(mod_paths)
+    return {dest_filename: bytes_to_b64str(mod_str) for dest_filename, mod_str in module_files.items()}
+
+
+def module_archive_hash(module_files):
+    """
+    Content hash of the module files, used as the archive cache key.
+    The archive contains bytecode of this Python version, so it is part of the hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(sys.implementation.cache_tag.encode())
+    for dest_filename in sorted(module_files):
+        digest.update(dest_filename.encode())
+        digest.update(b'\0')
+        digest.update(hashlib.sha256(module_files[dest_filename]).digest())
+    return digest.hexdigest()
+
+
+def create_module_archive(module_files):
+    """
+    Packs the module files into a zip archive that can be added to sys.path
+    as is (zipimport). Entries are sorted and timestamps fixed, so the same
+    files always produce the same archive. Each module is also added compiled,
+    as zipimport expects it (module.pyc next to module.py), so the runtime does
+    not compile it on import. The bytecode is the one of the client's Python
+    version: jobs only run on runtimes with the same version, which
+    select_runtime() checks, and zipimport falls back to the source otherwise.
+    :return: archive bytes
+    """
+    archive_files = dict(module_files)
+    for dest_filename, mod_str in module_files.items():
+        if dest_filename.endswith('.py'):
+            bytecode = compile_bytecode(mod_str, dest_filename)
+            if bytecode is not None:
+                archive_files[dest_filename + 'c'] = bytecode
+
+    archive = StringIO()
+    with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for dest_filename in sorted(archive_files):
+            info = zipfile.ZipInfo(dest_filename, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            zf.writestr(info, archive_files[dest_filename])
+    return archive.getvalue()
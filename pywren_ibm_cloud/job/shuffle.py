@@ -0,0 +1,142 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pickle
+import inspect
+import logging
+from zlib import crc32
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pywren_ibm_cloud import serializers
+from pywren_ibm_cloud.storage.compression import compress
+from pywren_ibm_cloud.storage.utils import shuffle_key_suffix
+
+logger = logging.getLogger(__name__)
+
+SHUFFLE_FETCH_THREADS = 32
+
+
+def partition_of(key, num_partitions):
+    """
+    Partition of a record key. The hash must be the same in all the
+    functions, so the builtin (salted) hash() can not be used.
+    """
+    if isinstance(key, str):
+        key_bytes = key.encode()
+    elif isinstance(key, (bytes, bytearray)):
+        key_bytes = key
+    elif isinstance(key, int):
+        key_bytes = str(key).encode()
+    else:
+        key_bytes = pickle.dumps(key, protocol=4)
+    return crc32(key_bytes) % num_partitions
+
+
+def shuffle_map_function(map_function, num_partitions):
+    """
+    Method that returns the map function of a shuffle. The records returned by
+    `map_function`, (key, value) pairs or a dict, are hash-partitioned by key
+    into `num_partitions` partitions and written to the storage. The function
+    returns the shuffle index of the written object.
+    """
+    func_sig = inspect.signature(map_function)
+    storage_arg = 'internal_storage' in func_sig.parameters
+
+    def shuffle_map_wrapper(**map_func_args):
+        if storage_arg:
+            internal_storage = map_func_args['internal_storage']
+        else:
+            internal_storage = map_func_args.pop('internal_storage')
+        records = map_function(**map_func_args)
+        return write_partitions(records, num_partitions, internal_storage)
+
+    if not storage_arg:
+        # The JobRunner only passes internal_storage to the functions that request it
+        parameters = [p for p in func_sig.parameters.values() if p.kind != p.VAR_KEYWORD]
+        parameters.append(inspect.Parameter('internal_storage', inspect.Parameter.KEYWORD_ONLY))
+        parameters.extend(p for p in func_sig.parameters.values() if p.kind == p.VAR_KEYWORD)
+        func_sig = func_sig.replace(parameters=parameters)
+    shuffle_map_wrapper.__signature__ = func_sig
+
+    return shuffle_map_wrapper
+
+
+def write_partitions(records, num_partitions, internal_storage):
+    """
+    Writes all the partitions of a mapper to a single object, one after the
+    other, so each reducer can fetch its partition with a ranged GET.
+    :return: shuffle index: {'key': object key, 'ranges': byte range of each partition or None if empty}
+    """
+    if records is None:
+        records = []
+    elif isinstance(records, dict):
+        records = records.items()
+
+    partitions = [[] for _ in range(num_partitions)]
+    for record in records:
+        partitions[partition_of(record[0], num_partitions)].append(record)
+
+    codecs = internal_storage.compression_codecs
+    chunks = []
+    ranges = []
+    pos = 0
+    for partition in partitions:
+        if not partition:
+            ranges.append(None)
+            continue
+        chunk = serializers.dumps(partition)
+        if codecs:
+            chunk = compress(chunk, codecs)
+        chunks.append(chunk)
+        ranges.append((pos, pos+len(chunk)-1))
+        pos += len(chunk)
+
+    key = '/'.join([internal_storage.tmp_obj_prefix, shuffle_key_suffix])
+    if chunks:
+        internal_storage.put_data(key, b''.join(chunks))
+    logger.info('Shuffle - {} partitions written to {} ({} bytes)'.format(len(chunks), key, pos))
+
+    return {'key': key, 'ranges': ranges}
+
+
+def _fetch_range(internal_storage, key, byte_range):
+    extra_get_args = {'Range': 'bytes={}-{}'.format(*byte_range)}
+    data = internal_storage.get_data(key, extra_get_args=extra_get_args)
+    return serializers.loads(data)
+
+
+def fetch_partition(shuffle_indexes, partition, internal_storage, fetch_threads=SHUFFLE_FETCH_THREADS):
+    """
+    Generator of the records of a partition. The partition is fetched from
+    the object of each mapper with parallel ranged GETs, keeping at most
+    `fetch_threads` requests in flight, and the records are yielded in the
+    order the requests complete.
+    :param shuffle_indexes: iterable of the shuffle indexes returned by the mappers
+    """
+    with ThreadPoolExecutor(max_workers=fetch_threads) as pool:
+        pending = set()
+        for shuffle_index in shuffle_indexes:
+            byte_range = shuffle_index['ranges'][partition]
+            if byte_range is None:
+                continue
+            pending.add(pool.submit(_fetch_range, internal_storage, shuffle_index['key'], byte_range))
+            if len(pending) >= fetch_threads:
+                fs_dones, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fs_done in fs_dones:
+                    yield from fs_done.result()
+        while pending:
+            fs_dones, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fs_done in fs_dones:
+                yield from fs_done.result()
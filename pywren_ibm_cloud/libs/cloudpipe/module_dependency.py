@@ -25,28 +25,197 @@
 """
 From
 https://github.com/cloudpipe/multyvac-fork/blob/master/multyvac/util/module_dependency.py
+
+Ported from the deprecated imp module to importlib. The imports found in each
+source file are kept in an ImportsCache, keyed by path, mtime and size, that
+can be persisted in disk to be shared across jobs and executors. The analyzer
+is shared by the jobs of the process and keeps the inspection of each root
+module while its files do not change.
 """
+import os
 import ast
-import imp
+import json
 import logging
 import pkgutil
+import importlib.util
+import importlib.machinery
+from threading import Lock
 
 logging_level = logging.INFO
 
+# Module kinds
+PY_SOURCE = 'source'
+PY_COMPILED = 'compiled'
+C_EXTENSION = 'c-extension'
+C_BUILTIN = 'built-in'
+PY_FROZEN = 'frozen'
+PKG_DIRECTORY = 'package'
+UNKNOWN = 'unknown'
+
+
+def _module_kind(spec):
+    """
+    Returns the kind of module and its path, given its spec.
+    """
+    if spec.submodule_search_locations is not None:
+        if spec.origin and os.path.basename(spec.origin).startswith('__init__.'):
+            return PKG_DIRECTORY, os.path.dirname(spec.origin)
+        locations = list(spec.submodule_search_locations)
+        if locations and os.path.isdir(locations[0]):
+            # Namespace package
+            return PKG_DIRECTORY, locations[0]
+        return UNKNOWN, None
+    loader = spec.loader
+    if isinstance(loader, importlib.machinery.SourceFileLoader):
+        return PY_SOURCE, spec.origin
+    if isinstance(loader, importlib.machinery.SourcelessFileLoader):
+        return PY_COMPILED, spec.origin
+    if isinstance(loader, importlib.machinery.ExtensionFileLoader):
+        return C_EXTENSION, spec.origin
+    if loader is importlib.machinery.BuiltinImporter or spec.origin == 'built-in':
+        return C_BUILTIN, None
+    if loader is importlib.machinery.FrozenImporter or spec.origin == 'frozen':
+        return PY_FROZEN, None
+    return UNKNOWN, spec.origin
+
+
+def _find_spec(module_name, path=None):
+    """
+    Finds a module spec without importing it. If path is given, the module
+    is only searched within it.
+    """
+    try:
+        if path is not None:
+            return importlib.machinery.PathFinder.find_spec(module_name, path)
+        return importlib.util.find_spec(module_name)
+    except (ImportError, ValueError, AttributeError):
+        # ValueError: module in sys.modules without __spec__ (e.g. __main__)
+        return None
+
+
+class ImportsCache:
+    """
+    Root modules imported by each source file, keyed by path, mtime and size.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self._entries = {}
+        self._dirty = False
+        self._lock = Lock()
+        self._load()
+
+    def _load(self):
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as fid:
+                self._entries.update(json.load(fid))
+        except Exception:
+            # Corrupted or partially written cache, start over
+            self._entries = {}
+
+    def get_imports(self, path, module_name, find_imports):
+        """
+        Returns the root modules imported by the source file in `path`,
+        parsing it only if it changed since it was cached.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return set()
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return set(entry[2])
+
+        try:
+            with open(path, 'rb') as fp:
+                imports = find_imports(ast.parse(fp.read(), module_name))
+        except (SyntaxError, ValueError):
+            # For malformed source code
+            imports = set()
+
+        with self._lock:
+            self._entries[path] = [st.st_mtime_ns, st.st_size, sorted(imports)]
+            self._dirty = True
+        return imports
+
+    def save(self):
+        """
+        Writes the cache to disk, merged with the entries written
+        meanwhile by other processes.
+        """
+        if not self.cache_file or not self._dirty:
+            return
+        with self._lock:
+            entries = {}
+            try:
+                with open(self.cache_file, 'r') as fid:
+                    entries = json.load(fid)
+            except Exception:
+                pass
+            entries.update(self._entries)
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                tmp_file = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+                with open(tmp_file, 'w') as fid:
+                    json.dump(entries, fid)
+                os.replace(tmp_file, self.cache_file)
+                self._entries = entries
+                self._dirty = False
+            except OSError:
+                pass
+
+
+_imports_caches = {}
+_imports_caches_lock = Lock()
+
+
+def get_imports_cache(cache_file=None):
+    """
+    Returns the ImportsCache of `cache_file`, shared by all the analyzers of the process.
+    """
+    with _imports_caches_lock:
+        if cache_file not in _imports_caches:
+            _imports_caches[cache_file] = ImportsCache(cache_file)
+        return _imports_caches[cache_file]
+
+
+_analyzers = {}
+
+
+def get_module_dependency_analyzer(cache_file=None):
+    """
+    Returns the ModuleDependencyAnalyzer of `cache_file`, shared by all the
+    jobs of the process, so that the modules inspected by a job are not
+    inspected again by the next ones while their files do not change.
+    """
+    with _imports_caches_lock:
+        if cache_file not in _analyzers:
+            _analyzers[cache_file] = ModuleDependencyAnalyzer(cache_file)
+        return _analyzers[cache_file]
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
 
 class ModuleDependencyAnalyzer:
-    _IMP_TYPE_NAMES = {
-        imp.PY_FROZEN: 'frozen',
-        imp.PY_SOURCE: 'source',
-        imp.PY_COMPILED: 'compiled',
-        imp.C_EXTENSION: 'c-extension',
-        imp.C_BUILTIN: 'built-in',
-    }
-
-    def __init__(self):
-        """Creates new ModuleDependencyAnalyzer"""
+
+    def __init__(self, cache_file=None):
+        """
+        Creates new ModuleDependencyAnalyzer
+        :param cache_file: file where the imports of the inspected source
+        files are persisted. Default None (cached in memory only).
+        """
         self._logger = logging.getLogger('multyvac.dependency-analyzer')
         self._logger.setLevel(logging_level)
+        self._imports_cache = get_imports_cache(cache_file)
+        self._lock = Lock()
         # Root modules that have been or are being inspected
         self._inspected_modules = set()
         # Root modules that have yet to be inspected
@@ -57,6 +226,26 @@ class ModuleDependencyAnalyzer:
         # that contain c-extensions, and are thus untransmittable.
         self._paths_to_transmit = set()
         self.has_module_dependencies = False
+        # Inspection of each root module by previous analyses: (stat of the files and
+        # directories it read, path to transmit or None, absolute root modules imported)
+        self._inspections = {}
+        self._inspection_files = None
+
+    def analyze(self, module_names, ignore=()):
+        """
+        Finds the paths to transmit of some modules and of their dependencies.
+        The modules inspected in previous analyses are not inspected again
+        while the files and directories they read do not change.
+        :param module_names: names of the modules
+        :param ignore: root modules neither transmitted nor traversed
+        :return: set of paths to transmit
+        """
+        with self._lock:
+            self._modules_to_ignore = set(ignore)
+            self._inspected_modules = set()
+            for module_name in module_names:
+                self.add(module_name)
+            return self.get_and_clear_paths()
 
     def add(self, module_name):
         """
@@ -66,10 +255,10 @@ class ModuleDependencyAnalyzer:
         self._logger.debug('Queuing module %r', module_name)
         root_module_name = self._extract_root_module(module_name)
         self._modules_to_inspect.add(root_module_name)
-        
+
         while self._modules_to_inspect:
             self._inspect(self._modules_to_inspect.pop())
-        
+
     def ignore(self, module_name):
         """
         Ignores modules in dependency analysis so that they are neither
@@ -77,10 +266,10 @@ class ModuleDependencyAnalyzer:
         are sent the first time.
         """
         # what if module is already part of paths to transmit?
-        if hasattr(module_name, '__iter__'):
-            self._modules_to_ignore.update(module_name)
-        elif isinstance(module_name, str):
+        if isinstance(module_name, str):
             self._modules_to_ignore.add(module_name)
+        elif hasattr(module_name, '__iter__'):
+            self._modules_to_ignore.update(module_name)
         else:
             raise TypeError('module_name must be string')
 
@@ -90,8 +279,21 @@ class ModuleDependencyAnalyzer:
         if paths:
             self.has_module_dependencies = True
         self._paths_to_transmit = set()
+        self._imports_cache.save()
         return paths
 
+    def _queue_imports(self, source_imps, context):
+        for source_imp in source_imps:
+            if source_imp in self._inspected_modules:
+                self._logger.debug('%s -> %r already inspected', context, source_imp)
+            elif source_imp in self._modules_to_inspect:
+                self._logger.debug('%s -> %r already queued', context, source_imp)
+            elif source_imp in self._modules_to_ignore:
+                self._logger.debug('%s -> %r to be ignored', context, source_imp)
+            else:
+                self._modules_to_inspect.add(source_imp)
+                self._logger.debug('%s -> %r added to queue', context, source_imp)
+
     def _inspect(self, root_module_name):
         """
         Determines what resources to send over (if any) for a given module.
@@ -108,180 +310,110 @@ class ModuleDependencyAnalyzer:
             # Add module to set of scanned modules, before we've analyzed it
             self._inspected_modules.add(root_module_name)
 
+        inspection = self._inspections.get(root_module_name)
+        if inspection is not None and all(_stat(path) == st for path, st in inspection[0]):
+            self._logger.debug('Module %r is unchanged since its last inspection', root_module_name)
+        else:
+            inspection = self._inspect_module(root_module_name)
+            if inspection is None:
+                return
+            self._inspections[root_module_name] = inspection
+
+        _, path, source_imps = inspection
+        if path is not None:
+            self._paths_to_transmit.add(path)
+        self._queue_imports(source_imps, repr(root_module_name))
+
+    def _inspect_module(self, root_module_name):
+        """
+        Inspects a root module.
+        :return: (stat of the files and directories read, path to transmit or None,
+        absolute root modules imported), or None if the module is not found
+        """
         self._logger.debug('Inspecting module %r', root_module_name)
-        try:
-            fp, pathname, description = imp.find_module(root_module_name)
-        except ImportError:
+        spec = _find_spec(root_module_name)
+        if spec is None:
             self._logger.debug('Could not find module %r, skipping',
                                root_module_name)
-            return
-        _, _, mod_type = description
-        if mod_type == imp.PY_SOURCE:
-            self._paths_to_transmit.add(pathname)
-            self._logger.debug('Module %r is source/compiled. Added path %r',
+            return None
+
+        self._inspection_files = []
+        source_imps = set()
+        path = None
+        mod_type, pathname = _module_kind(spec)
+        if mod_type == PY_SOURCE:
+            path = pathname
+            self._logger.debug('Module %r is source. Added path %r',
                                root_module_name, pathname)
-            # TODO: Does this work with compiled sources?
-            try:
-                source_imps = self._find_imports(ast.parse(fp.read(),
-                                                           root_module_name))
-            except SyntaxError:
-                self._logger.debug('Module %r has a syntax error. '
-                                   'Skipping source analysis',
-                                   root_module_name)
-                # For malformed source code
-                source_imps = []
-            # Close the file handle that's been opened for us by find_module
-            fp.close()
+            # Cannot be relative import since this is top-level
+            source_imps = self._get_imports(pathname, root_module_name)
             self._logger.debug('Module %r had these imports %r',
                                root_module_name, source_imps)
-            for source_imp in source_imps:
-                if source_imp in self._inspected_modules:
-                    self._logger.debug('Module %r Source import %r '
-                                       'already inspected', root_module_name,
-                                       source_imp)
-                elif source_imp in self._modules_to_inspect:
-                    self._logger.debug('Module %r Source import %r '
-                                       'already queued', root_module_name,
-                                       source_imp)
-                elif source_imp in self._modules_to_ignore:
-                    self._logger.debug('Module %r Source import %r '
-                                       'to be ignored', root_module_name,
-                                       source_imp)
-                else:
-                    # Cannot be relative import since this is top-level
-                    self._modules_to_inspect.add(source_imp)
-                    self._logger.debug('Module %r Source import %r added '
-                                       'to queue', root_module_name, source_imp)
-        elif mod_type == imp.PKG_DIRECTORY:
+        elif mod_type == PKG_DIRECTORY:
             self._logger.debug('Module %r is package. Recursing...',
                                root_module_name)
-            if self._deep_inspect_path(pathname, root_module_name):
-                self._paths_to_transmit.add(pathname)
+            if self._deep_inspect_path(pathname, root_module_name, source_imps):
+                path = pathname
                 self._logger.debug('Module %r has no c-extensions. Added path %r',
                                    root_module_name, pathname)
-        elif mod_type in (imp.C_EXTENSION, imp.C_BUILTIN, imp.PY_FROZEN,
-                          imp.PY_COMPILED):
-            self._logger.debug('Module %r is %s. Skipping.',
-                               root_module_name,
-                               self._IMP_TYPE_NAMES[mod_type])
         else:
-            raise Exception('Unrecognized module %r type %s'
-                            % (root_module_name, mod_type))
+            self._logger.debug('Module %r is %s. Skipping.',
+                               root_module_name, mod_type)
 
-    def _deep_inspect_path(self, path, package_name):
+        files = [(file_path, _stat(file_path)) for file_path in self._inspection_files]
+        self._inspection_files = None
+        return files, path, source_imps
+
+    def _get_imports(self, path, module_name):
+        self._inspection_files.append(path)
+        return self._imports_cache.get_imports(path, module_name, self._find_imports)
+
+    def _deep_inspect_path(self, path, package_name, source_imps):
         """
         Traverses :param path: analyzing all valid Python modules.
         Returns True if this path is eligible to be sent (No c-extensions).
-        Adds module references to list of modules to be inspected.
+        Adds the absolute imports of the modules to :param source_imps:.
         """
         ret = True
+        # Adding or removing a module changes the mtime of the directory
+        self._inspection_files.append(path)
+        init_path = os.path.join(path, '__init__.py')
+        if os.path.isfile(init_path):
+            imps = self._get_imports(init_path, package_name)
+            source_imps.update(imp for imp in imps if not self._is_relative_import(imp, path))
+
         for _, submodule_name, _ in pkgutil.iter_modules([path]):
             self._logger.debug('Inspecting submodule %r', submodule_name)
-            try:
-                fp, pathname, description = imp.find_module(submodule_name, [path])
-            except Exception as e:
-                print (e)
+            spec = _find_spec(submodule_name, [path])
+            if spec is None:
                 continue
-            _, _, mod_type = description
-            if mod_type == imp.PY_SOURCE:
-                self._logger.debug('%r -> %r is source/compiled. '
-                                   'Scanning imports.',
-                                   package_name,
-                                   submodule_name)
-                # TODO: Does this work with compiled sources?
-                try:
-                    source_imps = self._find_imports(ast.parse(fp.read(),
-                                                               submodule_name))
-                except SyntaxError:
-                    self._logger.debug('%r -> %r has a syntax error. '
-                                       'Skipping source analysis',
-                                       package_name,
-                                       submodule_name)
-                    source_imps = []
-                # Close the file handle that's been opened for us by find_module
-                fp.close()
-                self._logger.debug('%r -> %r had these imports %r',
-                                   package_name, submodule_name, source_imps)
-                for source_imp in source_imps:
-                    if source_imp in self._inspected_modules:
-                        self._logger.debug('%r -> %r -> %r already inspected',
-                                           package_name,
-                                           submodule_name,
-                                           source_imp)
-                    elif source_imp in self._modules_to_inspect:
-                        self._logger.debug('%r -> %r -> %r already queued',
-                                           package_name,
-                                           submodule_name,
-                                           source_imp)
-                    elif source_imp in self._modules_to_ignore:
-                        self._logger.debug('%r -> %r -> %r to be ignored',
-                                           package_name,
-                                           submodule_name,
-                                           source_imp)
-                    elif self._is_relative_import(source_imp, path):
-                        self._logger.debug('%r -> %r -> %r is relative.',
-                                           package_name,
-                                           submodule_name,
-                                           source_imp)
-                    else:
-                        self._modules_to_inspect.add(source_imp)
-                        self._logger.debug('%r -> %r -> %r added to queue',
-                                           package_name,
-                                           submodule_name,
-                                           source_imp)
-            elif mod_type == imp.PKG_DIRECTORY:
-                self._logger.debug('%r -> %r is package. Recursing...',
-                                   package_name, submodule_name)
-                ret = ret and self._deep_inspect_path(pathname, package_name)
-            elif mod_type in (imp.C_EXTENSION, imp.C_BUILTIN, imp.PY_FROZEN,
-                              imp.PY_COMPILED):
-
-                self._logger.debug('%r -> %r is %s.',
-                                   package_name,
-                                   submodule_name,
-                                   self._IMP_TYPE_NAMES[mod_type])
-
-                # Close the file handle that's been opened for us by find_module
-                fp.close()
-
-                # TODO: Can we go from compiled Python to an AST to identify
-                # imports?
+            mod_type, pathname = _module_kind(spec)
+            context = '{!r} -> {!r}'.format(package_name, submodule_name)
+            if mod_type == PY_SOURCE:
+                self._logger.debug('%s is source. Scanning imports.', context)
+                imps = self._get_imports(pathname, submodule_name)
+                self._logger.debug('%s had these imports %r', context, imps)
+                source_imps.update(imp for imp in imps if not self._is_relative_import(imp, path))
+            elif mod_type == PKG_DIRECTORY:
+                self._logger.debug('%s is package. Recursing...', context)
+                ret = self._deep_inspect_path(pathname, package_name, source_imps) and ret
+            else:
+                self._logger.debug('%s is %s.', context, mod_type)
                 # Since this is a common case, we assume that the PY will be
                 # alongside the PYC for now, and ignore any issues that may
                 # arise.
-                if mod_type != imp.PY_COMPILED:
+                if mod_type != PY_COMPILED:
                     ret = False
-            else:
-                raise Exception('Unrecognized module type %s' % submodule_name)
 
         return ret
 
     @staticmethod
     def _is_relative_import(module_name, path):
-        """Checks if import is relative. Returns True if relative, False if
-        absolute, and None if import could not be found."""
-        try:
-            # Check within the restricted path of a (sub-)package
-            imp.find_module(module_name, [path])
-        except ImportError:
-            pass
-        else:
-            return True
-
-        try:
-            # Check across all of sys.path
-            imp.find_module(module_name)
-        except ImportError:
-            pass
-        else:
-            return False
-
-        # Module could not be found on system due to:
-        # 1. Import that doesn't exist. "Bad import".
-        # 2. Since we're only scanning the AST, there's a good chance the
-        #    import's inclusion is conditional, and would never be triggered.
-        #    For example, an import specific to an OS.
-        return None
+        """Checks if import is relative, that is, if the module is found
+        within the restricted path of a (sub-)package. Imports that are not
+        relative are either absolute or could not be found on the system,
+        for example because they are conditional (OS specific, ...)."""
+        return _find_spec(module_name, [path]) is not None
 
     @staticmethod
     def _extract_root_module(module_name):
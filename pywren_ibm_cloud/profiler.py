@@ -0,0 +1,190 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import csv
+import json
+import math
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Phases of a call, in execution order:
+#   submit: invocation request of the client
+#   queue: from the invocation until the handler starts, in a warm container
+#   cold_start: the same, in a new container
+#   setup: handler setup and module setup of the JobRunner
+#   download: function and data download
+#   exec: function execution
+#   upload: result upload
+#   detect: from the end of the call until the client gets its status
+PHASES = ['submit', 'queue', 'cold_start', 'setup', 'download', 'exec', 'upload', 'detect']
+PERCENTILES = [50, 90, 99]
+
+
+def _get(status, key):
+    value = status.get(key)
+    return float(value) if value is not None else 0.0
+
+
+def call_profile(future):
+    """
+    Phase breakdown of a call, from the invoke status and the run status of its future.
+    :return: dict with the call identifiers, the duration of each phase in seconds and the GB-seconds
+    """
+    invoke_status = future.invoke_status
+    run_status = future.run_status or {}
+
+    profile = OrderedDict()
+    profile['executor_id'] = future.executor_id
+    profile['job_id'] = future.job_id
+    profile['call_id'] = future.call_id
+    profile['activation_id'] = future.activation_id
+    profile['is_cold_start'] = bool(run_status.get('cold_start'))
+
+    host_submit_time = _get(invoke_status, 'host_submit_time')
+    start_time = _get(run_status, 'start_time')
+    end_time = _get(run_status, 'end_time')
+    status_done_time = _get(invoke_status, 'status_done_timestamp')
+
+    submit = _get(invoke_status, 'invoke_time')
+    wait_time = max(0.0, start_time - host_submit_time - submit) if start_time else 0.0
+    profile['submit'] = submit
+    profile['queue'] = 0.0 if run_status.get('cold_start') else wait_time
+    profile['cold_start'] = wait_time if run_status.get('cold_start') else 0.0
+    profile['setup'] = _get(run_status, 'setup_time') + _get(run_status, 'module_setup_time')
+    profile['download'] = _get(run_status, 'func_download_time') + _get(run_status, 'data_download_time')
+    profile['exec'] = _get(run_status, 'function_exec_time')
+    profile['upload'] = _get(run_status, 'output_upload_time')
+    profile['detect'] = max(0.0, status_done_time - end_time) if end_time and status_done_time else 0.0
+    profile['total'] = max(0.0, (status_done_time or end_time) - host_submit_time) if host_submit_time else 0.0
+
+    runtime_memory = invoke_status.get('runtime_memory')
+    duration = end_time - start_time if end_time and start_time else 0.0
+    profile['gb_seconds'] = duration * runtime_memory / 1024 if runtime_memory else None
+    profile['peak_memory'] = run_status.get('peak_memory')
+
+    return profile
+
+
+def percentile(values, p):
+    """
+    Percentile of a list of values, with linear interpolation between the closest ranks.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def job_profile(call_profiles, host_job_meta=None):
+    """
+    Summary of the calls of a job: percentiles of each phase, critical path,
+    dominant phase and GB-seconds.
+    :param call_profiles: profiles of the calls of the job
+    :param host_job_meta: invoke status of one call, which contains the job metadata of the client
+    """
+    host_job_meta = host_job_meta or {}
+    summary = OrderedDict()
+    summary['executor_id'] = call_profiles[0]['executor_id']
+    summary['job_id'] = call_profiles[0]['job_id']
+    summary['calls'] = len(call_profiles)
+    summary['cold_starts'] = sum(1 for call in call_profiles if call['is_cold_start'])
+
+    # Client-side work done once per job, before the invocations
+    summary['job_setup'] = sum(_get(host_job_meta, key) for key in
+                               ('runtime_select_time', 'func_upload_time', 'data_upload_time', 'module_upload_time'))
+
+    phases = OrderedDict()
+    for phase in PHASES + ['total']:
+        values = [call[phase] for call in call_profiles]
+        stats = OrderedDict()
+        stats['mean'] = sum(values) / len(values)
+        for p in PERCENTILES:
+            stats['p{}'.format(p)] = percentile(values, p)
+        stats['max'] = max(values)
+        stats['sum'] = sum(values)
+        phases[phase] = stats
+    summary['phases'] = phases
+    summary['dominant_phase'] = max(PHASES, key=lambda phase: phases[phase]['sum'])
+
+    # The job finishes when its slowest call is detected, so the slowest
+    # call is the critical path of the job
+    slowest = max(call_profiles, key=lambda call: call['total'])
+    critical_path = OrderedDict()
+    critical_path['call_id'] = slowest['call_id']
+    critical_path['job_setup'] = summary['job_setup']
+    for phase in PHASES:
+        critical_path[phase] = slowest[phase]
+    critical_path['total'] = summary['job_setup'] + slowest['total']
+    critical_path['dominant_phase'] = max(['job_setup'] + PHASES, key=lambda phase: critical_path[phase])
+    summary['critical_path'] = critical_path
+
+    gb_seconds = [call['gb_seconds'] for call in call_profiles if call['gb_seconds'] is not None]
+    summary['gb_seconds'] = sum(gb_seconds) if gb_seconds else None
+    peak_memory = [call['peak_memory'] for call in call_profiles if call['peak_memory'] is not None]
+    summary['peak_memory'] = max(peak_memory) if peak_memory else None
+
+    return summary
+
+
+def create_profile(futures):
+    """
+    Profile of the futures of one or more jobs.
+    :param futures: completed futures
+    :return: dict with the profile of each call in 'calls' and the summary of each job in 'jobs'
+    """
+    calls = []
+    jobs = OrderedDict()
+    job_meta = {}
+    for future in futures:
+        if not future.run_status:
+            continue
+        profile = call_profile(future)
+        calls.append(profile)
+        job_key = '{}/{}'.format(future.executor_id, future.job_id)
+        jobs.setdefault(job_key, []).append(profile)
+        job_meta.setdefault(job_key, future.invoke_status)
+
+    summaries = OrderedDict((job_key, job_profile(job_calls, job_meta[job_key]))
+                            for job_key, job_calls in jobs.items())
+    return {'calls': calls, 'jobs': summaries}
+
+
+def export_json(profile, dst):
+    """
+    Writes the whole profile to a JSON file.
+    """
+    with open(dst, 'w') as json_file:
+        json.dump(profile, json_file, indent=2)
+    logger.info('Profile written to {}'.format(dst))
+
+
+def export_csv(profile, dst):
+    """
+    Writes the profile of the calls to a CSV file, one row per call.
+    """
+    calls = profile['calls']
+    if not calls:
+        return
+    with open(dst, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(calls[0].keys()))
+        writer.writeheader()
+        writer.writerows(calls)
+    logger.info('Profile written to {}'.format(dst))
@@ -5,3 +5,4 @@ from pywren_ibm_cloud.runtime.deploy_utils import delete_runtime
 from pywren_ibm_cloud.runtime.deploy_utils import clean_runtimes
 
 from pywren_ibm_cloud.runtime.runtime import select_runtime
+from pywren_ibm_cloud.runtime.runtime import get_runtime_preinstalls
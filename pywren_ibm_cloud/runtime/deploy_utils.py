@@ -17,93 +17,137 @@
 import os
 import shutil
 import logging
-from pywren_ibm_cloud.config import default_config, extract_storage_config, extract_compute_config
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pywren_ibm_cloud.config import default_config, extract_storage_config, extract_compute_config, extract_compute_regions
+from pywren_ibm_cloud.config import DEPLOY_POOL_SIZE
 from pywren_ibm_cloud.storage import InternalStorage
 from pywren_ibm_cloud.compute import Compute
+from pywren_ibm_cloud.runtime.memory import AUTO, AUTO_MEMORY_DEFAULT
+from pywren_ibm_cloud.runtime.runtime import invalidate_runtime_registry
 
 
 logger = logging.getLogger(__name__)
 
 
-def create_runtime(name, memory=None, config=None):
+def _run_concurrently(tasks, progress=None):
+    """
+    Runs the tasks, with at most DEPLOY_POOL_SIZE at the same time.
+    :param tasks: list of (description, function) pairs
+    :param progress: function called with the number of tasks done, the total number of tasks
+    and the description of the last one, every time a task finishes. Default None
+    """
+    total = len(tasks)
+    with ThreadPoolExecutor(DEPLOY_POOL_SIZE) as pool:
+        futures = {pool.submit(task): description for description, task in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress:
+                progress(done, total, futures[future])
+
+
+def create_runtime(name, memory=None, config=None, progress=None):
     config = default_config(config)
     storage_config = extract_storage_config(config)
     internal_storage = InternalStorage(storage_config)
-    compute_config = extract_compute_config(config)
-    internal_compute = Compute(compute_config)
 
     memory = config['pywren']['runtime_memory'] if not memory else memory
+    if memory == AUTO:
+        memory = AUTO_MEMORY_DEFAULT
     timeout = config['pywren']['runtime_timeout']
-    logger.info('Creating runtime: {}, memory: {}'.format(name, memory))
 
-    runtime_meta = internal_compute.generate_runtime_meta(name)
-    internal_compute.create_runtime(name, memory, timeout=timeout)
+    regions = extract_compute_regions(config)
+    # The preinstalled modules only depend on the image
+    runtime_meta = Compute(extract_compute_config(config, regions[0])).generate_runtime_meta(name)
+
+    def create(region):
+        internal_compute = Compute(extract_compute_config(config, region))
+        logger.info('Creating runtime: {}, memory: {}, region: {}'.format(name, memory, region))
+        internal_compute.create_runtime(name, memory, timeout=timeout, python_ver=runtime_meta['python_ver'])
+        try:
+            runtime_key = internal_compute.get_runtime_key(name, memory)
+            internal_storage.put_runtime_meta(runtime_key, runtime_meta)
+        except Exception:
+            raise Exception("Unable to upload 'preinstalled modules' file into {}".format(internal_storage.backend))
 
-    try:
-        runtime_key = internal_compute.get_runtime_key(name, memory)
-        internal_storage.put_runtime_meta(runtime_key, runtime_meta)
-    except Exception:
-        raise("Unable to upload 'preinstalled modules' file into {}".format(internal_storage.backend))
+    _run_concurrently([('{} {}MB {}'.format(name, memory, region), partial(create, region)) for region in regions],
+                      progress)
+    invalidate_runtime_registry()
 
 
-def update_runtime(name, config=None):
+def update_runtime(name, config=None, progress=None):
     config = default_config(config)
     storage_config = extract_storage_config(config)
     internal_storage = InternalStorage(storage_config)
-    compute_config = extract_compute_config(config)
-    internal_compute = Compute(compute_config)
 
     timeout = config['pywren']['runtime_timeout']
-    logger.info('Updating runtime: {}'.format(name))
-
-    if name != 'all':
-        runtime_meta = internal_compute.generate_runtime_meta(name)
-    else:
-        runtime_meta = None
-
-    runtimes = internal_compute.list_runtimes(name)
 
-    for runtime in runtimes:
-        internal_compute.create_runtime(runtime[0], runtime[1], timeout)
+    def update(internal_compute, runtime, runtime_meta):
+        python_ver = runtime_meta['python_ver'] if runtime_meta else None
+        internal_compute.create_runtime(runtime[0], runtime[1], timeout, python_ver=python_ver)
         if runtime_meta:
             try:
                 runtime_key = internal_compute.get_runtime_key(runtime[0], runtime[1])
                 internal_storage.put_runtime_meta(runtime_key, runtime_meta)
             except Exception:
-                raise("Unable to upload 'preinstalled modules' file into {}".format(internal_storage.backend))
+                raise Exception("Unable to upload 'preinstalled modules' file into {}".format(internal_storage.backend))
+
+    runtime_meta = None
+    tasks = []
+    for region in extract_compute_regions(config):
+        compute_config = extract_compute_config(config, region)
+        internal_compute = Compute(compute_config)
+        logger.info('Updating runtime: {}, region: {}'.format(name, region))
+
+        if name != 'all' and runtime_meta is None:
+            runtime_meta = internal_compute.generate_runtime_meta(name)
 
+        for runtime in internal_compute.list_runtimes(name):
+            tasks.append(('{} {}MB {}'.format(runtime[0], runtime[1], region),
+                          partial(update, internal_compute, runtime, runtime_meta)))
 
-def build_runtime(name, file, config=None):
+    _run_concurrently(tasks, progress)
+    invalidate_runtime_registry()
+
+
+def build_runtime(name, file, config=None, progress=None):
     config = default_config(config)
     compute_config = extract_compute_config(config)
     internal_compute = Compute(compute_config)
     internal_compute.build_runtime(name, file)
 
-    create_runtime(name, config=config)
-    update_runtime(name, config=config)
+    create_runtime(name, config=config, progress=progress)
+    update_runtime(name, config=config, progress=progress)
 
 
-def delete_runtime(name, config=None):
+def delete_runtime(name, config=None, progress=None):
     config = default_config(config)
     storage_config = extract_storage_config(config)
     internal_storage = InternalStorage(storage_config)
-    compute_config = extract_compute_config(config)
-    internal_compute = Compute(compute_config)
 
-    runtimes = internal_compute.list_runtimes(name)
-    for runtime in runtimes:
+    def delete(internal_compute, runtime):
         internal_compute.delete_runtime(runtime[0], runtime[1])
         runtime_key = internal_compute.get_runtime_key(runtime[0], runtime[1])
         internal_storage.delete_runtime_meta(runtime_key)
 
+    tasks = []
+    for region in extract_compute_regions(config):
+        compute_config = extract_compute_config(config, region)
+        internal_compute = Compute(compute_config)
+
+        for runtime in internal_compute.list_runtimes(name):
+            tasks.append(('{} {}MB {}'.format(runtime[0], runtime[1], region),
+                          partial(delete, internal_compute, runtime)))
 
-def clean_runtimes(config=None):
+    _run_concurrently(tasks, progress)
+    invalidate_runtime_registry()
+
+
+def clean_runtimes(config=None, progress=None):
     logger.info('Cleaning all runtimes')
     config = default_config(config)
     storage_config = extract_storage_config(config)
     internal_storage = InternalStorage(storage_config)
-    compute_config = extract_compute_config(config)
-    internal_compute = Compute(compute_config)
 
     # Clean local runtime_meta cache
     cache_dir = os.path.join(os.path.expanduser('~'), '.cloudbutton')
@@ -115,4 +159,11 @@ def clean_runtimes(config=None):
     if runtimes:
         sh.delete_objects(storage_config['bucket'], runtimes)
 
-    internal_compute.delete_all_runtimes()
+    tasks = []
+    for region in extract_compute_regions(config):
+        compute_config = extract_compute_config(config, region)
+        internal_compute = Compute(compute_config)
+        tasks.append(('all runtimes {}'.format(region), internal_compute.delete_all_runtimes))
+
+    _run_concurrently(tasks, progress)
+    invalidate_runtime_registry()
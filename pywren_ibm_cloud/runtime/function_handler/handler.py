@@ -17,14 +17,15 @@
 import os
 import sys
 import time
-import pika
 import json
 import pickle
+import signal
 import logging
 import subprocess
 import multiprocessing
 from distutils.util import strtobool
 from pywren_ibm_cloud import version
+from pywren_ibm_cloud import tracing
 from pywren_ibm_cloud.utils import sizeof_fmt
 from pywren_ibm_cloud.storage import InternalStorage
 from pywren_ibm_cloud.config import extract_storage_config, cloud_logging_config
@@ -35,9 +36,16 @@ logging.getLogger('pika').setLevel(logging.CRITICAL)
 logger = logging.getLogger('handler')
 
 PYTHON_MODULE_PATH = "/tmp/pymodules"
+MODULE_ARCHIVES_PATH = "/tmp/pywren.modules"
+OBJECT_CACHE_PATH = "/tmp/pywren.objects"
+BROADCAST_CACHE_PATH = "/tmp/pywren.broadcast"
 JOBRUNNER_STATS_FILENAME = "/tmp/jobrunner.stats.txt"
+JOBRUNNER_TRACE_FILENAME = "/tmp/jobrunner.trace.json"
 PYWREN_LIBS_PATH = '/action/pywren_ibm_cloud/libs'
 
+# The handler module is loaded once per container
+COLD_START = True
+
 
 def free_disk_space(dirname):
     """
@@ -65,12 +73,36 @@ def get_server_info():
 
 
 def function_handler(event):
+    if event.get('remote_invoker'):
+        # Intermediate node of a remote invocation tree
+        cloud_logging_config(event['log_level'])
+        from pywren_ibm_cloud.invoker import remote_invoker, set_calls_failed
+        try:
+            if version.__version__ != event['pywren_version']:
+                raise Exception("WRONGVERSION", "PyWren version mismatch",
+                                version.__version__, event['pywren_version'])
+        except Exception:
+            logger.error("There was an exception: {}".format(str(sys.exc_info()[1])))
+            set_calls_failed(event['template_payload'], tuple(event['call_range']), sys.exc_info())
+            return
+        remote_invoker(event)
+        return
+
+    global COLD_START
     start_time = time.time()
     logger.debug("Action handler started")
     response_status = {'exception': False}
+    response_status['cold_start'] = COLD_START
+    COLD_START = False
     response_status['host_submit_time'] = event['host_submit_time']
     response_status['start_time'] = start_time
 
+    # Spans of the activation are returned in its status
+    tracing.set_exporter(tracing.InMemoryExporter() if event.get('trace_context') else None)
+    handler_span = tracing.start_span('function_handler', parent=event.get('trace_context'),
+                                      call_id=event['call_id'])
+    setup_span = tracing.start_span('setup', parent=handler_span)
+
     context_dict = {
         'ibm_cf_request_id': os.environ.get("__OW_ACTIVATION_ID"),
         'ibm_cf_python_version': os.environ.get("PYTHON_VERSION"),
@@ -93,6 +125,7 @@ def function_handler(event):
     data_byte_range = event['data_byte_range']
     output_key = event['output_key']
     extra_env = event.get('extra_env', {})
+    compression_codecs = event.get('compression_codecs', [])
 
     response_status['call_id'] = call_id
     response_status['job_id'] = job_id
@@ -125,15 +158,24 @@ def function_handler(event):
                             'log_level': log_level,
                             'data_byte_range': data_byte_range,
                             'python_module_path': PYTHON_MODULE_PATH,
+                            'module_archives_path': MODULE_ARCHIVES_PATH,
+                            'object_cache_path': OBJECT_CACHE_PATH,
+                            'broadcast_cache_path': BROADCAST_CACHE_PATH,
                             'output_key': output_key,
-                            'stats_filename': JOBRUNNER_STATS_FILENAME}
+                            'compression_codecs': compression_codecs,
+                            'stats_filename': JOBRUNNER_STATS_FILENAME,
+                            'trace_filename': JOBRUNNER_TRACE_FILENAME}
 
-        if os.path.exists(JOBRUNNER_STATS_FILENAME):
-            os.remove(JOBRUNNER_STATS_FILENAME)
+        for filename in (JOBRUNNER_STATS_FILENAME, JOBRUNNER_TRACE_FILENAME):
+            if os.path.exists(filename):
+                os.remove(filename)
 
         setup_time = time.time()
         response_status['setup_time'] = round(setup_time - start_time, 8)
+        setup_span.end()
 
+        jobrunner_span = tracing.start_span('jobrunner', parent=handler_span)
+        jobrunner_config['trace_context'] = jobrunner_span.context
         result_queue = multiprocessing.Queue()
         tr = JobRunner(jobrunner_config, result_queue)
         tr.daemon = True
@@ -141,6 +183,11 @@ def function_handler(event):
         tr.start()
         tr.join(task_execution_timeout)
         response_status['exec_time'] = round(time.time() - setup_time, 8)
+        jobrunner_span.end()
+
+        if os.path.exists(JOBRUNNER_TRACE_FILENAME):
+            with open(JOBRUNNER_TRACE_FILENAME, 'r') as trace_file:
+                tracing.export_spans(json.load(trace_file))
 
         if tr.is_alive():
             # If process is still alive after jr.join(job_max_runtime), kill it
@@ -149,6 +196,12 @@ def function_handler(event):
             tr.terminate()
             raise Exception("OUTATIME",  "Process executed for too long and was killed")
 
+        if tr.exitcode == -signal.SIGKILL:
+            # The kernel kills the process that exceeds the memory of the container
+            logger.error("Process exceeded maximum memory and was killed")
+            response_status['out_of_memory'] = True
+            raise Exception("OUTOFMEMORY",  "Process exceeded maximum memory and was killed")
+
         try:
             # Only 1 message is returned by jobrunner
             result_queue.get(block=False)
@@ -168,7 +221,7 @@ def function_handler(event):
                     except Exception:
                         response_status[key] = value
                     if key == 'exception' or key == 'exc_pickle_fail' \
-                       or key == 'result':
+                       or key == 'result' or key == 'resource_usage':
                         response_status[key] = eval(value)
 
         # response_status['server_info'] = get_server_info()
@@ -186,12 +239,19 @@ def function_handler(event):
         response_status['exc_info'] = str(pickled_exc)
 
     finally:
+        handler_span.end()
+        exporter = tracing.get_exporter()
+        if exporter is not None:
+            response_status['trace_spans'] = exporter.spans
+            response_status['trace_context'] = handler_span.context
+
         store_status = strtobool(os.environ.get('STORE_STATUS', 'True'))
         rabbit_amqp_url = config['rabbitmq'].get('amqp_url')
         dmpd_response_status = json.dumps(response_status)
         drs = sizeof_fmt(len(dmpd_response_status))
 
         if rabbit_amqp_url and store_status:
+            import pika
             status_sent = False
             output_query_count = 0
             while not status_sent and output_query_count < 5:
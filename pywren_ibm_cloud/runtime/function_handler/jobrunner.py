@@ -22,16 +22,19 @@ import shutil
 import pickle
 import logging
 import inspect
-import numpy as np
 from multiprocessing import Process
 from distutils.util import strtobool
+from pywren_ibm_cloud import serializers
+from pywren_ibm_cloud import tracing
+from pywren_ibm_cloud import broadcast
 from pywren_ibm_cloud.storage import InternalStorage
+from pywren_ibm_cloud.storage.compression import compress
 from pywren_ibm_cloud.future import ResponseFuture
 from pywren_ibm_cloud.libs.tblib import pickling_support
 from pywren_ibm_cloud.utils import sizeof_fmt, b64str_to_bytes
 from pywren_ibm_cloud.utils import get_current_memory_usage
 from pywren_ibm_cloud.config import extract_storage_config, cloud_logging_config
-from pywren_ibm_cloud.storage.backends.ibm_cos.ibm_cos import StorageBackend as ibm_cos_backend
+from pywren_ibm_cloud.runtime.function_handler.sampler import ResourceSampler
 
 pickling_support.install()
 logger = logging.getLogger('JobRunner')
@@ -64,6 +67,7 @@ class JobRunner(Process):
         self.stats.write('jobrunner_start', start_time)
         cb_config = json.loads(os.environ.get('CB_CONFIG'))
         self.storage_config = extract_storage_config(cb_config)
+        self.sampling_interval = cb_config['pywren'].get('resource_sampling_interval')
 
         if 'SHOW_MEMORY_USAGE' in os.environ:
             self.show_memory = eval(os.environ['SHOW_MEMORY_USAGE'])
@@ -74,6 +78,7 @@ class JobRunner(Process):
         self.data_key = self.config['data_key']
         self.data_byte_range = self.config['data_byte_range']
         self.output_key = self.config['output_key']
+        self.compression_codecs = self.config.get('compression_codecs', [])
 
     def _get_function_and_modules(self):
         """
@@ -85,6 +90,7 @@ class JobRunner(Process):
         loaded_func_all = pickle.loads(func_obj)
         func_download_time_t2 = time.time()
         self.stats.write('func_download_time', round(func_download_time_t2-func_download_time_t1, 8))
+        self.stats.write('func_size', len(func_obj))
         logger.debug("Finished getting Function and modules")
 
         return loaded_func_all
@@ -122,6 +128,34 @@ class JobRunner(Process):
         #logger.debug(subprocess.check_output("find {}".format(os.getcwd()), shell=True))
         logger.debug("Finished writing Function dependencies")
 
+    def _add_module_archive(self, module_archive_key):
+        """
+        Add the modules archive to sys.path, before we unpickle actual function.
+        Archives are cached in local disk by their content hash, so warm
+        containers do not download them again.
+        """
+        logger.debug("Adding Function dependencies archive to sys.path")
+        module_setup_time_t1 = time.time()
+        MODULE_ARCHIVES_PATH = self.config['module_archives_path']
+        archive_path = os.path.join(MODULE_ARCHIVES_PATH, os.path.basename(module_archive_key))
+
+        if not os.path.isfile(archive_path):
+            os.makedirs(MODULE_ARCHIVES_PATH, exist_ok=True)
+            module_archive = self.internal_storage.get_module_archive(module_archive_key)
+            tmp_path = '{}.{}.tmp'.format(archive_path, os.getpid())
+            with open(tmp_path, 'wb') as fid:
+                fid.write(module_archive)
+            os.rename(tmp_path, archive_path)
+            self.stats.write('module_archive_bytes', len(module_archive))
+        else:
+            self.stats.write('module_archive_bytes', 0)
+
+        if archive_path not in sys.path:
+            sys.path.append(archive_path)
+        module_setup_time_t2 = time.time()
+        self.stats.write('module_setup_time', round(module_setup_time_t2-module_setup_time_t1, 8))
+        logger.debug("Finished adding Function dependencies archive")
+
     def _unpickle_function(self, pickled_func):
         """
         Unpickle function; it will expect modules to be there
@@ -140,10 +174,10 @@ class JobRunner(Process):
 
         logger.debug("Getting function data")
         data_download_time_t1 = time.time()
-        data_obj = self.internal_storage.get_data(self.data_key, extra_get_args=extra_get_args)
-        logger.debug("Finished getting Function data")
+        # The buffers of the data are read into writable buffers, without an intermediate copy
+        data_stream = self.internal_storage.get_data(self.data_key, stream=True, extra_get_args=extra_get_args)
         logger.debug("Unpickle Function data")
-        loaded_data = pickle.loads(data_obj)
+        loaded_data = serializers.loads_stream(data_stream)
         logger.debug("Finished unpickle Function data")
         data_download_time_t2 = time.time()
         self.stats.write('data_download_time', round(data_download_time_t2-data_download_time_t1, 8))
@@ -155,6 +189,7 @@ class JobRunner(Process):
         func_sig = inspect.signature(function)
 
         if 'ibm_cos' in func_sig.parameters:
+            from pywren_ibm_cloud.storage.backends.ibm_cos.ibm_cos import StorageBackend as ibm_cos_backend
             ibm_boto3_client = ibm_cos_backend(self.storage_config['ibm_cos']).get_client()
             data['ibm_cos'] = ibm_boto3_client
 
@@ -171,14 +206,32 @@ class JobRunner(Process):
         # initial output file in case job fails
         result = None
         exception = False
+        # Spans are written to a file that the handler returns in the status
+        trace_context = self.config.get('trace_context')
+        tracing.set_exporter(tracing.InMemoryExporter() if trace_context else None)
+        setup_span = tracing.start_span('get_function', parent=trace_context)
+        sampler = None
+        if self.sampling_interval:
+            sampler = ResourceSampler(self.sampling_interval)
+            sampler.start()
         try:
             self.internal_storage = InternalStorage(self.storage_config)
             self.internal_storage.tmp_obj_prefix = self.output_key.rsplit('/', 1)[0]
+            self.internal_storage.compression_codecs = self.compression_codecs
+            self.internal_storage.object_cache_dir = self.config.get('object_cache_path')
+            self.internal_storage.broadcast_cache_dir = self.config.get('broadcast_cache_path')
             loaded_func_all = self._get_function_and_modules()
-            self._save_modules(loaded_func_all['module_data'])
+            if 'module_archive' in loaded_func_all:
+                if loaded_func_all['module_archive']:
+                    self._add_module_archive(loaded_func_all['module_archive'])
+            else:
+                self._save_modules(loaded_func_all['module_data'])
             function = self._unpickle_function(loaded_func_all['func'])
-            data = self._load_data()
-            data = self._create_storage_clients(function, data)
+            setup_span.end()
+
+            with tracing.start_span('load_data', parent=trace_context):
+                data = self._load_data()
+                data = self._create_storage_clients(function, data)
 
             if self.show_memory:
                 logger.debug("Memory usage before call the function: {}".format(get_current_memory_usage()))
@@ -186,7 +239,8 @@ class JobRunner(Process):
             logger.info("Function: Going to execute '{}()'".format(str(function.__name__)))
             print('---------------------- FUNCTION LOG ----------------------', flush=True)
             func_exec_time_t1 = time.time()
-            result = function(**data)
+            with tracing.start_span('exec', parent=trace_context, function=function.__name__):
+                result = function(**data)
             func_exec_time_t2 = time.time()
             print('----------------------------------------------------------', flush=True)
             logger.info("Function: Success execution")
@@ -195,6 +249,7 @@ class JobRunner(Process):
                 logger.debug("Memory usage after call the function: {}".format(get_current_memory_usage()))
 
             self.stats.write('function_exec_time', round(func_exec_time_t2-func_exec_time_t1, 8))
+            self.stats.write('broadcast_download_bytes', broadcast.downloaded_bytes)
 
             # Check for new futures
             if result is not None:
@@ -210,7 +265,7 @@ class JobRunner(Process):
 
                 logger.debug("Pickling result")
                 output_dict = {'result': result}
-                pickled_output = pickle.dumps(output_dict)
+                output_size, pickled_output = serializers.dumps_stream(output_dict)
 
                 if self.show_memory:
                     logger.debug("Memory usage after output serialization: {}".format(get_current_memory_usage()))
@@ -253,9 +308,21 @@ class JobRunner(Process):
             store_result = strtobool(os.environ.get('STORE_RESULT', 'True'))
             if result is not None and store_result and not exception:
                 output_upload_timestamp_t1 = time.time()
-                logger.info("Storing function result - output.pickle - Size: {}".format(sizeof_fmt(len(pickled_output))))
-                self.internal_storage.put_data(self.output_key, pickled_output)
+                logger.info("Storing function result - output.pickle - Size: {}".format(sizeof_fmt(output_size)))
+                with tracing.start_span('upload_output', parent=trace_context, bytes=output_size):
+                    if self.compression_codecs and isinstance(pickled_output, bytes):
+                        pickled_output = compress(pickled_output, self.compression_codecs)
+                    self.internal_storage.put_data(self.output_key, pickled_output)
                 output_upload_timestamp_t2 = time.time()
                 self.stats.write("output_upload_time", round(output_upload_timestamp_t2 - output_upload_timestamp_t1, 8))
+            if trace_context:
+                setup_span.end()
+                with open(self.config['trace_filename'], 'w') as trace_file:
+                    json.dump(tracing.get_exporter().spans, trace_file)
+            if sampler is not None:
+                resource_usage = sampler.stop()
+                if resource_usage['peak_rss'] is not None:
+                    self.stats.write('peak_memory', resource_usage['peak_rss'])
+                self.stats.write('resource_usage', resource_usage)
             self.result_queue.put("Finished")
             logger.info("Finished")
@@ -0,0 +1,163 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The series are halved when they reach this length, so the status of
+# long calls stays small
+MAX_SAMPLES = 128
+METRICS = ['rss', 'cpu', 'net_rx', 'net_tx', 'disk_read', 'disk_write']
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+PROC_DIR = '/proc'
+
+
+def _read_rss():
+    with open(os.path.join(PROC_DIR, 'self', 'statm'), 'r') as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+def _read_peak_rss():
+    with open(os.path.join(PROC_DIR, 'self', 'status'), 'r') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def _read_net():
+    rx = tx = 0
+    with open(os.path.join(PROC_DIR, 'net', 'dev'), 'r') as net_dev:
+        for line in net_dev.readlines()[2:]:
+            interface, counters = line.split(':', 1)
+            if interface.strip() == 'lo':
+                continue
+            counters = counters.split()
+            rx += int(counters[0])
+            tx += int(counters[8])
+    return rx, tx
+
+
+def _read_disk():
+    read_bytes = write_bytes = 0
+    with open(os.path.join(PROC_DIR, 'self', 'io'), 'r') as io:
+        for line in io:
+            key, value = line.split(':')
+            if key == 'read_bytes':
+                read_bytes = int(value)
+            elif key == 'write_bytes':
+                write_bytes = int(value)
+    return read_bytes, write_bytes
+
+
+def _read_cpu():
+    times = os.times()
+    return times.user + times.system
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Samples the RSS, CPU time, network bytes and disk I/O of the process from
+    /proc at a fixed interval. Counters are relative to the start of the sampler.
+    Metrics that can not be read in the runtime are left out.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_time = None
+        self.times = []
+        self.series = {metric: [] for metric in METRICS}
+        self._readers = self._available_readers()
+        self._base = {}
+        self._stop_event = threading.Event()
+
+    def _available_readers(self):
+        readers = {'rss': _read_rss, 'cpu': _read_cpu,
+                   'net_rx': lambda: _read_net()[0], 'net_tx': lambda: _read_net()[1],
+                   'disk_read': lambda: _read_disk()[0], 'disk_write': lambda: _read_disk()[1]}
+        available = {}
+        for metric, reader in readers.items():
+            try:
+                reader()
+                available[metric] = reader
+            except (OSError, ValueError, IndexError):
+                logger.debug('Resource metric {} not available'.format(metric))
+        return available
+
+    def _sample(self):
+        values = {}
+        if 'net_rx' in self._readers:
+            values['net_rx'], values['net_tx'] = _read_net()
+        if 'disk_read' in self._readers:
+            values['disk_read'], values['disk_write'] = _read_disk()
+        if 'rss' in self._readers:
+            values['rss'] = _read_rss()
+        values['cpu'] = _read_cpu()
+        return values
+
+    def _record(self):
+        try:
+            values = self._sample()
+        except (OSError, ValueError, IndexError):
+            return
+        self.times.append(round(time.time() - self.start_time, 3))
+        for metric, value in values.items():
+            value = value - self._base.get(metric, 0)
+            self.series[metric].append(round(value, 3) if metric == 'cpu' else value)
+
+        if len(self.times) >= MAX_SAMPLES:
+            # Keep every other sample and sample at half the rate
+            self.times = self.times[::2]
+            for metric in self.series:
+                self.series[metric] = self.series[metric][::2]
+            self.interval *= 2
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._record()
+
+    def start(self):
+        self.start_time = time.time()
+        try:
+            self._base = self._sample()
+        except (OSError, ValueError, IndexError):
+            self._base = {}
+        self._base.pop('rss', None)
+        super().start()
+
+    def stop(self):
+        """
+        Stops the sampler after recording a last sample.
+        :return: dict with the sample times, in seconds from the start, the series of each metric and the peak RSS
+        """
+        self._stop_event.set()
+        self.join()
+        self._record()
+
+        usage = {'interval': self.interval, 'time': self.times}
+        usage.update((metric, series) for metric, series in self.series.items() if series)
+        try:
+            usage['peak_rss'] = _read_peak_rss()
+        except (OSError, ValueError):
+            rss = usage.get('rss')
+            usage['peak_rss'] = max(rss) if rss else None
+        return usage
@@ -0,0 +1,200 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import math
+import types
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILES_FILE = os.path.join(os.path.expanduser('~'), '.cloudbutton', 'memory_profiles.json')
+
+AUTO = 'auto'
+MEMORY_TIERS = [128, 256, 512, 1024, 2048]  # MB
+AUTO_MEMORY_DEFAULT = 256  # MB, used while a function has no profiles
+AUTO_MEMORY_RISK = 0.01  # Maximum fraction of calls expected to run out of memory
+MIN_PROFILE_CALLS = 5
+MAX_PROFILE_CALLS = 200  # Most recent calls kept per function and input size class
+# The peak RSS of the function process does not include the handler process
+# nor the memory of the container itself
+MEMORY_HEADROOM = 1.25
+
+
+def _hash_code(code, digest):
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, digest)
+        else:
+            digest.update(repr(const).encode())
+    digest.update(repr(code.co_names).encode())
+
+
+def _hash_function(func, digest):
+    digest.update('{}.{}'.format(getattr(func, '__module__', None),
+                                 getattr(func, '__qualname__', type(func).__name__)).encode())
+    code = getattr(func, '__code__', None)
+    if code is None:
+        code = getattr(getattr(func, '__call__', None), '__code__', None)
+    if code is not None:
+        _hash_code(code, digest)
+    # Wrapped functions, like the function of a map over object partitions
+    for cell in getattr(func, '__closure__', None) or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError:
+            continue
+        if isinstance(contents, types.FunctionType):
+            _hash_function(contents, digest)
+
+
+def function_hash(func):
+    """
+    Hash of the name and the code of a function. It changes when the code
+    of the function changes, but not when the function is defined again.
+    """
+    digest = hashlib.sha256()
+    _hash_function(func, digest)
+    return digest.hexdigest()[:16]
+
+
+def call_input_size(datum, datum_size):
+    """
+    Input size of a call: the serialized size of its arguments, plus the size of
+    the object partition of object processing functions.
+    """
+    size = datum_size
+    if isinstance(datum, dict) and 'chunk_size' in datum:
+        byte_range = datum.get('data_byte_range')
+        size += byte_range[1] - byte_range[0] + 1 if byte_range else datum['chunk_size'] or 0
+    return size
+
+
+def size_class(input_size):
+    """
+    Size class of an input: inputs in the same power of two are in the same class.
+    """
+    return int(math.log2(input_size)) if input_size > 1 else 0
+
+
+def profile_key(func, input_size):
+    return '{}/{}'.format(function_hash(func), size_class(input_size))
+
+
+def _demand(record):
+    # Memory needed by a call, in MB. A call that ran out of memory is
+    # assumed to need at least the next tier.
+    if record.get('oom'):
+        return record['runtime_memory'] * 2
+    return record['peak_memory'] / 1024 ** 2 * MEMORY_HEADROOM
+
+
+def failure_risk(records, tier):
+    """
+    Fraction of the recorded calls that would run out of memory with `tier` MB.
+    """
+    return sum(1 for record in records if _demand(record) > tier) / len(records)
+
+
+def recommend_memory(records, tiers=MEMORY_TIERS, risk=AUTO_MEMORY_RISK):
+    """
+    Selects the runtime memory for a function from the profiles of its calls:
+    among the tiers whose failure risk is under `risk`, the one with the least
+    expected GB-seconds.
+    :param records: profiles of the calls of the function
+    :param tiers: available runtime memory tiers, in MB
+    :param risk: maximum failure risk
+    :return: runtime memory in MB, or None if there are not enough profiles
+    """
+    if len(records) < MIN_PROFILE_CALLS:
+        return None
+
+    durations = [record['duration'] for record in records if not record.get('oom')]
+    mean_duration = sum(durations) / len(durations) if durations else 0.0
+
+    best_tier = None
+    best_cost = None
+    for tier in sorted(tiers):
+        if failure_risk(records, tier) > risk:
+            continue
+        # Calls get more CPU with more memory, so the duration measured in a
+        # tier is used when there is one
+        tier_durations = [record['duration'] for record in records
+                          if record['runtime_memory'] == tier and not record.get('oom')]
+        duration = sum(tier_durations) / len(tier_durations) if tier_durations else mean_duration
+        cost = tier * duration
+        if best_cost is None or cost < best_cost:
+            best_tier, best_cost = tier, cost
+
+    return best_tier if best_tier is not None else max(tiers)
+
+
+class MemoryProfiles:
+    """
+    Profiles of the calls of each function and input size class, persisted
+    in a local JSON file.
+    """
+
+    def __init__(self, path=PROFILES_FILE):
+        self.path = path
+        self.profiles = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as profiles_file:
+                    self.profiles = json.load(profiles_file)
+            except (OSError, ValueError):
+                logger.debug('Unable to load the memory profiles from {}'.format(path))
+
+    def get(self, key):
+        return self.profiles.get(key, [])
+
+    def record(self, key, records):
+        """
+        Adds the profiles of some calls. They are persisted by save().
+        """
+        key_records = self.profiles.setdefault(key, [])
+        key_records.extend(records)
+        del key_records[:-MAX_PROFILE_CALLS]
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as profiles_file:
+            json.dump(self.profiles, profiles_file)
+        os.replace(tmp_path, self.path)
+
+    def recommend(self, key, tiers=MEMORY_TIERS, risk=AUTO_MEMORY_RISK):
+        return recommend_memory(self.get(key), tiers, risk)
+
+
+def call_record(future):
+    """
+    Profile of a completed call, or None if the call did not report its memory usage.
+    """
+    run_status = future.run_status or {}
+    runtime_memory = future.invoke_status.get('runtime_memory')
+    if not runtime_memory:
+        return None
+    if run_status.get('out_of_memory'):
+        return {'runtime_memory': runtime_memory, 'oom': True}
+    if run_status.get('peak_memory') is None:
+        return None
+    return {'runtime_memory': runtime_memory,
+            'peak_memory': run_status['peak_memory'],
+            'duration': round(run_status['end_time'] - run_status['start_time'], 3)}
@@ -8,6 +8,12 @@ logging.basicConfig(level=logging.DEBUG)
 os.environ["CB_LOG_LEVEL"] = 'DEBUG'
 
 
+def progress(action):
+    def echo(done, total, runtime):
+        click.echo('{} {} [{}/{}]'.format(action, runtime, done, total))
+    return echo
+
+
 @click.group()
 @click.pass_context
 def cli(ctx):
@@ -18,31 +24,31 @@ def cli(ctx):
 @click.argument('image_name')
 @click.option('--memory', default=None, help='memory used by the runtime', type=int)
 def create(image_name, memory):
-    create_runtime(image_name, memory=memory)
+    create_runtime(image_name, memory=memory, progress=progress('Created'))
 
 
 @cli.command('build')
 @click.argument('image_name')
 @click.option('--file', '-f', default=None, help='file needed to build the runtime')
 def build(image_name, file):
-    build_runtime(image_name, file)
+    build_runtime(image_name, file, progress=progress('Deployed'))
 
 
 @cli.command('update')
 @click.argument('image_name')
 def update(image_name):
-    update_runtime(image_name)
+    update_runtime(image_name, progress=progress('Updated'))
 
 
 @cli.command('delete')
 @click.argument('image_name')
 def delete(image_name):
-    delete_runtime(image_name)
+    delete_runtime(image_name, progress=progress('Deleted'))
 
 
 @cli.command('clean')
 def clean():
-    clean_runtimes()
+    clean_runtimes(progress=progress('Deleted'))
 
 
 if __name__ == "__main__":
@@ -1,43 +1,184 @@
 import os
 import sys
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pywren_ibm_cloud.compute import Compute
 from pywren_ibm_cloud.utils import version_str
-from pywren_ibm_cloud.config import extract_compute_config
+from pywren_ibm_cloud.config import extract_compute_config, extract_compute_regions
 
 logger = logging.getLogger(__name__)
 
+RUNTIME_REGISTRY_TTL = 600  # seconds
+
+# Runtime metadata of the deployed runtimes, by runtime key: (metadata, expiration time)
+_registry = {}
+# Runtime metadata by backend and runtime name. The preinstalled modules only
+# depend on the image, so they are shared by all the memory sizes and regions
+_image_meta = {}
+_lock = threading.Lock()
+_deploy_locks = {}
+
+
+def _deploy_lock(key):
+    with _lock:
+        return _deploy_locks.setdefault(key, threading.Lock())
+
+
+def _register(runtime_key, image_key, runtime_meta):
+    with _lock:
+        _registry[runtime_key] = (runtime_meta, time.time() + RUNTIME_REGISTRY_TTL)
+        _image_meta.setdefault(image_key, runtime_meta)
+
+
+def invalidate_runtime_registry():
+    """
+    Forgets the runtimes known by this process, for example after they are deleted or updated.
+    """
+    with _lock:
+        _registry.clear()
+        _image_meta.clear()
+
+
+def _lookup_runtime(internal_storage, runtime_key, image_key):
+    """
+    Runtime metadata of a deployed runtime, from the registry or from the storage.
+    None if the runtime is not deployed.
+    """
+    with _lock:
+        entry = _registry.get(runtime_key)
+    if entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    try:
+        runtime_meta = internal_storage.get_runtime_meta(runtime_key)
+    except Exception:
+        return None
+    _register(runtime_key, image_key, runtime_meta)
+    return runtime_meta
+
+
+def _deploy_runtime(config, internal_storage, executor_id, job_id, runtime_name, runtime_memory, region):
+    compute_config = extract_compute_config(config, region)
+    internal_compute = Compute(compute_config)
+    runtime_key = internal_compute.get_runtime_key(runtime_name, runtime_memory)
+    image_key = (compute_config['backend'], runtime_name)
+
+    with _deploy_lock(runtime_key):
+        # Another thread may have deployed it meanwhile
+        runtime_meta = _lookup_runtime(internal_storage, runtime_key, image_key)
+        if runtime_meta is not None:
+            return runtime_meta
+
+        deploy_start = time.time()
+        with _deploy_lock(image_key):
+            runtime_meta = _image_meta.get(image_key)
+            if runtime_meta is None:
+                logger.debug('Extracting the preinstalled modules of runtime {}'.format(runtime_name))
+                runtime_meta = internal_compute.generate_runtime_meta(runtime_name)
+                with _lock:
+                    _image_meta[image_key] = runtime_meta
+
+        timeout = config['pywren']['runtime_timeout']
+        logger.debug('Creating runtime: {}, memory: {}'.format(runtime_name, runtime_memory))
+        internal_compute.create_runtime(runtime_name, runtime_memory, timeout=timeout,
+                                        python_ver=runtime_meta['python_ver'])
+        internal_storage.put_runtime_meta(runtime_key, runtime_meta)
+        _register(runtime_key, image_key, runtime_meta)
+        logger.info('ExecutorID {} | JobID {} - Runtime {} with {}MB deployed in region {} in {} '
+                    'seconds'.format(executor_id, job_id, runtime_name, runtime_memory, region,
+                                     round(time.time() - deploy_start, 3)))
+
+    return runtime_meta
+
 
 def select_runtime(config, internal_storage, executor_id, job_id, runtime_name, runtime_memory):
     """
     Auxiliary method that gets the runtime metadata from the storage. This metadata contains the preinstalled
     python modules needed to serialize the local function.  If the .metadata file does not exists in the storage,
     this means that the runtime is not installed, so this method will proceed to install it.
+    When several compute regions are configured, the runtime is installed in all of them.
+    The metadata is kept in memory for RUNTIME_REGISTRY_TTL seconds, and the runtimes
+    that are not installed are deployed in parallel.
+    :param runtime_memory: memory of the runtime, or list of memories to deploy. The first one is selected.
     """
     log_level = os.getenv('CB_LOG_LEVEL')
-    compute_config = extract_compute_config(config)
-    internal_compute = Compute(compute_config)
 
-    log_msg = 'ExecutorID {} | JobID {} - Selected Runtime: {} - {}MB'.format(executor_id, job_id, runtime_name, runtime_memory)
+    memories = list(runtime_memory) if isinstance(runtime_memory, (list, tuple)) else [runtime_memory]
+    log_msg = 'ExecutorID {} | JobID {} - Selected Runtime: {} - {}MB'.format(executor_id, job_id, runtime_name,
+                                                                            'MB, '.join(map(str, memories)))
     logger.info(log_msg)
     if not log_level:
         print(log_msg, end=' ')
 
-    runtime_key = internal_compute.get_runtime_key(runtime_name, runtime_memory)
-    try:
-        runtime_meta = internal_storage.get_runtime_meta(runtime_key)
-        if not log_level:
-            print()
-    except Exception:
-        logger.debug('ExecutorID {} | JobID {} - Runtime {} with {}MB is not yet installed'.format(executor_id, job_id, runtime_name, runtime_memory))
+    targets = [(memory, region) for memory in memories for region in extract_compute_regions(config)]
+    runtime_metas = {}
+    for memory, region in targets:
+        compute_config = extract_compute_config(config, region)
+        runtime_key = Compute(compute_config).get_runtime_key(runtime_name, memory)
+        runtime_meta = _lookup_runtime(internal_storage, runtime_key, (compute_config['backend'], runtime_name))
+        if runtime_meta is not None:
+            runtime_metas[(memory, region)] = runtime_meta
+        else:
+            logger.debug('ExecutorID {} | JobID {} - Runtime {} with {}MB is not yet installed '
+                         'in region {}'.format(executor_id, job_id, runtime_name, memory, region))
+
+    missing = [target for target in targets if target not in runtime_metas]
+    if missing:
         if not log_level:
-            print('(Installing...)')
+            print('(Installing...)', end=' ')
 
-        timeout = config['pywren']['runtime_timeout']
-        logger.debug('Creating runtime: {}, memory: {}'.format(runtime_name, runtime_memory))
-        runtime_meta = internal_compute.generate_runtime_meta(runtime_name)
-        internal_compute.create_runtime(runtime_name, runtime_memory, timeout=timeout)
-        internal_storage.put_runtime_meta(runtime_key, runtime_meta)
+        def deploy(target):
+            memory, region = target
+            return _deploy_runtime(config, internal_storage, executor_id, job_id, runtime_name, memory, region)
+
+        with ThreadPoolExecutor(len(missing)) as pool:
+            runtime_metas.update(zip(missing, pool.map(deploy, missing)))
+
+    if not log_level:
+        print()
+
+    runtime_meta = runtime_metas[targets[0]]
+    if not _runtime_valid(runtime_meta):
+        raise Exception(("The indicated runtime: {} "
+                         "is not appropriate for this Python version.")
+                        .format(runtime_name))
+
+    return runtime_meta['preinstalls']
+
+
+def get_runtime_preinstalls(config, internal_storage, runtime_name):
+    """
+    Gets the preinstalled modules of a runtime without deploying it, for example
+    to serialize a function whose runtime memory is not yet selected. They only
+    depend on the image, so the metadata of any deployed memory size is used. If
+    none is deployed, the modules are extracted from the image.
+    """
+    from pywren_ibm_cloud.runtime import memory
+
+    compute_config = extract_compute_config(config, extract_compute_regions(config)[0])
+    image_key = (compute_config['backend'], runtime_name)
+    with _lock:
+        runtime_meta = _image_meta.get(image_key)
+
+    if runtime_meta is None:
+        internal_compute = Compute(compute_config)
+        tiers = [memory.AUTO_MEMORY_DEFAULT] + [t for t in memory.MEMORY_TIERS if t != memory.AUTO_MEMORY_DEFAULT]
+        for runtime_memory in tiers:
+            runtime_key = internal_compute.get_runtime_key(runtime_name, runtime_memory)
+            runtime_meta = _lookup_runtime(internal_storage, runtime_key, image_key)
+            if runtime_meta is not None:
+                break
+
+    if runtime_meta is None:
+        with _deploy_lock(image_key):
+            runtime_meta = _image_meta.get(image_key)
+            if runtime_meta is None:
+                logger.debug('Extracting the preinstalled modules of runtime {}'.format(runtime_name))
+                runtime_meta = internal_compute.generate_runtime_meta(runtime_name)
+                with _lock:
+                    _image_meta[image_key] = runtime_meta
 
     if not _runtime_valid(runtime_meta):
         raise Exception(("The indicated runtime: {} "
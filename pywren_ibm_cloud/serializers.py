@@ -0,0 +1,338 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import io
+import struct
+import pickle
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Serialized objects format:
+#   MAGIC | num_oob (u64) | num_frames (u64) | pickle_len (u64) | buffer_len (u64) * (num_oob + num_frames)
+#   | pickle | pickle out-of-band buffers | serializer frames
+# Plain pickles never start with MAGIC, since they start with the PROTO opcode (0x80)
+OOB_MAGIC = b'PWOOB002'
+OOB_SUPPORTED = pickle.HIGHEST_PROTOCOL >= 5
+READ_CHUNK_SIZE = 8 * 1024 ** 2  # 8MiB
+PERSISTENT_ID_TAG = 'pywren'
+
+_serializers = OrderedDict()
+_serializers_by_type = {}
+
+
+class Serializer:
+    """
+    A fast path to serialize objects of a given type as a raw frame instead of
+    pickling them. `encode(obj)` returns (meta, buffer) or None to fall back to
+    pickle. `decode(meta, buffer)` rebuilds the object from the frame.
+    """
+
+    def __init__(self, name, type_name, encode, decode, requires=()):
+        self.name = name
+        self.type_name = type_name
+        self.encode = encode
+        self.decode = decode
+        self.requires = set(requires)
+
+
+def register_serializer(name, type_name, encode, decode, requires=()):
+    """
+    Registers a fast path serializer.
+    :param name: name of the serializer, stored in the serialized objects.
+    :param type_name: fully qualified name of the type, for example 'numpy.ndarray'.
+    :param encode: function obj -> (meta, buffer). `meta` must be made of builtin types.
+    :param decode: function (meta, buffer) -> obj.
+    :param requires: modules needed to decode, apart from the one of the type.
+    """
+    _serializers[name] = Serializer(name, type_name, encode, decode, requires)
+    _serializers_by_type.clear()
+
+
+def _get_serializer(obj_type, modules):
+    try:
+        serializer = _serializers_by_type[obj_type]
+    except KeyError:
+        type_name = '{}.{}'.format(obj_type.__module__, obj_type.__qualname__)
+        serializer = None
+        for candidate in _serializers.values():
+            if candidate.type_name == type_name:
+                serializer = candidate
+                break
+        _serializers_by_type[obj_type] = serializer
+
+    if serializer is None or not serializer.requires <= modules:
+        return None
+    return serializer
+
+
+class FrameWriter:
+    """
+    Collects the objects handled by the registered serializers while an object
+    is pickled. Assign `persistent_id` to a pickler before dumping.
+    """
+
+    def __init__(self, modules=None):
+        """
+        :param modules: top-level modules available where the object will be
+        deserialized. Serializers that require other modules are not used.
+        """
+        self.modules = set(modules or ())
+        self.frames = []
+
+    def persistent_id(self, obj):
+        serializer = _get_serializer(type(obj), self.modules)
+        if serializer is None:
+            return None
+        encoded = serializer.encode(obj)
+        if encoded is None:
+            return None
+        meta, buffer = encoded
+        self.frames.append(memoryview(buffer).cast('B'))
+        return (PERSISTENT_ID_TAG, serializer.name, meta, len(self.frames) - 1)
+
+    def pack(self, pickled, oob_buffers=()):
+        """
+        Packs the pickle and the collected frames.
+        :return: (size, body) where body is bytes or an iterator of bytes-like chunks
+        """
+        if not oob_buffers and not self.frames:
+            return len(pickled), pickled
+
+        buffers = list(oob_buffers) + self.frames
+        header = OOB_MAGIC + struct.pack('<QQQ{}Q'.format(len(buffers)), len(oob_buffers), len(self.frames),
+                                         len(pickled), *[b.nbytes for b in buffers])
+        size = len(header) + len(pickled) + sum(b.nbytes for b in buffers)
+
+        return size, iter([header, pickled] + buffers)
+
+    def pack_bytes(self, pickled):
+        size, body = self.pack(pickled)
+        if isinstance(body, bytes):
+            return body
+        return b''.join(body)
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, file, frames, buffers=None):
+        if buffers is not None:
+            super().__init__(file, buffers=buffers)
+        else:
+            super().__init__(file)
+        self._frames = frames
+
+    def persistent_load(self, pid):
+        tag, name, meta, index = pid
+        if tag != PERSISTENT_ID_TAG:
+            raise pickle.UnpicklingError('Unsupported persistent id: {}'.format(tag))
+        try:
+            serializer = _serializers[name]
+        except KeyError:
+            raise pickle.UnpicklingError('Unknown serializer: {}'.format(name))
+        return serializer.decode(meta, self._frames[index])
+
+
+def dumps_stream(obj, modules=None):
+    """
+    Serializes an object for being uploaded to the storage. Objects handled by the
+    registered serializers are stored as raw frames. When pickle protocol 5 is
+    available, other large buffers are kept out-of-band. In both cases the buffers
+    are never copied into a single bytes object.
+    :param obj: object to serialize
+    :param modules: top-level modules available where the object will be deserialized.
+    :return: (size, body) where body is bytes or an iterator of bytes-like chunks
+    """
+    frame_writer = FrameWriter(modules)
+    file = io.BytesIO()
+
+    if OOB_SUPPORTED:
+        oob_buffers = []
+        pickler = pickle.Pickler(file, protocol=5, buffer_callback=oob_buffers.append)
+    else:
+        oob_buffers = None
+        pickler = pickle.Pickler(file, protocol=-1)
+    pickler.persistent_id = frame_writer.persistent_id
+    pickler.dump(obj)
+
+    raw_buffers = [buf.raw() for buf in oob_buffers] if oob_buffers else []
+    return frame_writer.pack(file.getvalue(), raw_buffers)
+
+
+def dumps(obj, modules=None):
+    """
+    Serializes an object into a single bytes object
+    """
+    size, body = dumps_stream(obj, modules)
+    if isinstance(body, bytes):
+        return body
+    return b''.join(body)
+
+
+def loads_stream(stream):
+    """
+    Deserializes an object from a file-like object. Buffers and frames are read
+    directly into preallocated buffers.
+    :param stream: file-like object, for example a storage StreamingBody
+    :return: deserialized object
+    """
+    magic = _read_exact(stream, len(OOB_MAGIC))
+    if magic != OOB_MAGIC:
+        return pickle.loads(magic + stream.read())
+
+    num_oob, num_frames, pickle_len = struct.unpack('<QQQ', _read_exact(stream, 24))
+    num_buffers = num_oob + num_frames
+    buffer_lens = struct.unpack('<{}Q'.format(num_buffers), _read_exact(stream, 8 * num_buffers))
+    pickled = _read_exact(stream, pickle_len)
+
+    buffers = []
+    for buffer_len in buffer_lens:
+        buffer = bytearray(buffer_len)
+        _readinto(stream, buffer)
+        buffers.append(buffer)
+
+    return _unpickle(pickled, buffers[:num_oob], buffers[num_oob:])
+
+
+def loads(data, copy=True):
+    """
+    Deserializes an object from a bytes-like object. Buffers and frames are
+    memoryview slices of `data`, so they are not copied when `data` is writable,
+    like a bytearray. Otherwise they are copied, so that the deserialized objects,
+    like numpy arrays, are writable as with pickle.
+    :param data: bytes-like object
+    :param copy: copy the buffers of a read-only `data`. With False they are
+    read-only views of `data`, which must be kept alive and unchanged while the
+    deserialized object is used. Default True
+    :return: deserialized object
+    """
+    view = memoryview(data)
+    if bytes(view[:len(OOB_MAGIC)]) != OOB_MAGIC:
+        return pickle.loads(view)
+
+    pos = len(OOB_MAGIC)
+    num_oob, num_frames, pickle_len = struct.unpack_from('<QQQ', view, pos)
+    pos += 24
+    num_buffers = num_oob + num_frames
+    buffer_lens = struct.unpack_from('<{}Q'.format(num_buffers), view, pos)
+    pos += 8 * num_buffers
+    pickled = view[pos:pos+pickle_len]
+    pos += pickle_len
+
+    buffers = []
+    for buffer_len in buffer_lens:
+        buffer = view[pos:pos+buffer_len]
+        buffers.append(bytearray(buffer) if copy and view.readonly else buffer)
+        pos += buffer_len
+
+    return _unpickle(pickled, buffers[:num_oob], buffers[num_oob:])
+
+
+def _unpickle(pickled, oob_buffers, frames):
+    file = io.BytesIO(pickled)
+    if OOB_SUPPORTED:
+        return _Unpickler(file, frames, buffers=oob_buffers).load()
+    return _Unpickler(file, frames).load()
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) == size or not data:
+        return data
+    chunks = [data]
+    read = len(data)
+    while read < size:
+        chunk = stream.read(size - read)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        read += len(chunk)
+    return b''.join(chunks)
+
+
+def _readinto(stream, buffer):
+    view = memoryview(buffer)
+    pos = 0
+    while pos < len(view):
+        end = min(pos + READ_CHUNK_SIZE, len(view))
+        if hasattr(stream, 'readinto'):
+            read = stream.readinto(view[pos:end])
+        else:
+            chunk = stream.read(end - pos)
+            read = len(chunk)
+            view[pos:pos+read] = chunk
+        if not read:
+            raise EOFError('Unexpected end of stream reading serialized buffers')
+        pos += read
+
+
+# Builtin fast paths
+
+def _encode_ndarray(array):
+    if array.dtype.hasobject:
+        return None
+    import numpy as np
+    if array.flags.c_contiguous:
+        order = 'C'
+    elif array.flags.f_contiguous:
+        order = 'F'
+    else:
+        order = 'C'
+        array = np.ascontiguousarray(array)
+    raw = array.reshape(-1, order=order).view(np.uint8)
+    dtype = array.dtype.str if array.dtype.fields is None else array.dtype.descr
+    return (dtype, array.shape, order), raw
+
+
+def _decode_ndarray(meta, buffer):
+    import numpy as np
+    dtype, shape, order = meta
+    return np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(shape, order=order)
+
+
+def _encode_arrow_table(table):
+    import pyarrow as pa
+    sink = pa.BufferOutputStream()
+    writer = pa.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return None, sink.getvalue()
+
+
+def _decode_arrow_table(meta, buffer):
+    import pyarrow as pa
+    return pa.ipc.open_stream(pa.py_buffer(buffer)).read_all()
+
+
+def _encode_dataframe(df):
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df)
+    except Exception:
+        # pyarrow not installed or unsupported column types
+        return None
+    return _encode_arrow_table(table)
+
+
+def _decode_dataframe(meta, buffer):
+    return _decode_arrow_table(meta, buffer).to_pandas()
+
+
+register_serializer('ndarray', 'numpy.ndarray', _encode_ndarray, _decode_ndarray)
+register_serializer('arrow_table', 'pyarrow.lib.Table', _encode_arrow_table, _decode_arrow_table)
+register_serializer('dataframe', 'pandas.core.frame.DataFrame', _encode_dataframe, _decode_dataframe,
+                    requires=('pyarrow',))
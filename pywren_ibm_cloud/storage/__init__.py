@@ -1 +1 @@
-from .storage import InternalStorage
+from .storage import InternalStorage, CallsetDone
@@ -1,4 +1,7 @@
 IBM_AUTH_ENDPOINT_DEFAULT = 'https://iam.cloud.ibm.com/oidc/token'
+MULTIPART_THRESHOLD_DEFAULT = 32 * 1024 ** 2  # 32MiB
+MULTIPART_CHUNKSIZE_DEFAULT = 16 * 1024 ** 2  # 16MiB
+MULTIPART_CONCURRENCY_DEFAULT = 8
 
 
 def load_config(config_data=None):
@@ -24,3 +27,10 @@ def load_config(config_data=None):
                                                                                     required_parameters_3))
 
     config_data['ibm_cos']['ibm_iam'] = config_data['ibm_iam']
+
+    if 'multipart_threshold' not in config_data['ibm_cos']:
+        config_data['ibm_cos']['multipart_threshold'] = MULTIPART_THRESHOLD_DEFAULT
+    if 'multipart_chunksize' not in config_data['ibm_cos']:
+        config_data['ibm_cos']['multipart_chunksize'] = MULTIPART_CHUNKSIZE_DEFAULT
+    if 'multipart_concurrency' not in config_data['ibm_cos']:
+        config_data['ibm_cos']['multipart_concurrency'] = MULTIPART_CONCURRENCY_DEFAULT
@@ -14,19 +14,63 @@
 # limitations under the License.
 #
 
+import io
+import math
 import logging
+import itertools
 import ibm_boto3
 import ibm_botocore
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from ibm_botocore.credentials import DefaultTokenManager
 from ...utils import StorageNoSuchKeyError
 from ....utils import sizeof_fmt, is_cf_cluster
+from .config import MULTIPART_THRESHOLD_DEFAULT, MULTIPART_CHUNKSIZE_DEFAULT, MULTIPART_CONCURRENCY_DEFAULT
 
 logging.getLogger('ibm_boto3').setLevel(logging.CRITICAL)
 logging.getLogger('ibm_botocore').setLevel(logging.CRITICAL)
 logging.getLogger('urllib3').setLevel(logging.CRITICAL)
 logger = logging.getLogger(__name__)
 
+MULTIPART_MAX_PARTS = 10000
+MULTIPART_MIN_CHUNKSIZE = 5 * 1024 ** 2  # 5MiB, S3 API limit
+# The size of a stream is not known in advance, so its part size is doubled
+# every MULTIPART_STREAM_PARTS_PER_SIZE parts to stay under MULTIPART_MAX_PARTS
+MULTIPART_STREAM_PARTS_PER_SIZE = 1000
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable file-like object over a bytes-like object, without copying it.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
 
 class StorageBackend:
     """
@@ -38,6 +82,11 @@ class StorageBackend:
         self.ibm_cos_config = ibm_cos_config
         iam_config = ibm_cos_config['ibm_iam']
 
+        self.multipart_threshold = ibm_cos_config.get('multipart_threshold', MULTIPART_THRESHOLD_DEFAULT)
+        self.multipart_chunksize = max(ibm_cos_config.get('multipart_chunksize', MULTIPART_CHUNKSIZE_DEFAULT),
+                                       MULTIPART_MIN_CHUNKSIZE)
+        self.multipart_concurrency = ibm_cos_config.get('multipart_concurrency', MULTIPART_CONCURRENCY_DEFAULT)
+
         service_endpoint = ibm_cos_config.get('endpoint').replace('http:', 'https:')
         if self.is_cf_cluster and 'private_endpoint' in ibm_cos_config:
             service_endpoint = ibm_cos_config.get('private_endpoint')
@@ -107,11 +156,44 @@ class StorageBackend:
     def put_object(self, bucket_name, key, data):
         """
         Put an object in COS. Override the object if the key already exists.
+        Bodies bigger than the multipart threshold, as well as file-like objects
+        and generators of bytes, are uploaded as a parallel multipart upload.
         :param key: key of the object.
         :param data: data of the object
-        :type data: str/bytes
+        :type data: str/bytes/file-like/iterable of bytes
         :return: None
         """
+        if isinstance(data, str):
+            data = data.encode()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if len(data) < self.multipart_threshold:
+                return self._put_object(bucket_name, key, data)
+            chunksize = max(self.multipart_chunksize, math.ceil(len(data) / MULTIPART_MAX_PARTS))
+            parts = self._iter_buffer_parts(data, chunksize)
+        else:
+            parts = self._iter_stream_parts(data, self.multipart_chunksize)
+
+        # Read parts until reaching the threshold. Small streams are uploaded
+        # with a single request
+        head_parts = []
+        head_size = 0
+        part = None
+        while head_size < self.multipart_threshold:
+            part = next(parts, None)
+            if part is None:
+                break
+            head_parts.append(part)
+            head_size += len(part)
+
+        if part is None:
+            return self._put_object(bucket_name, key, b''.join(head_parts))
+
+        return self._multipart_upload(bucket_name, key, itertools.chain(head_parts, parts))
+
+    def _put_object(self, bucket_name, key, data):
+        """
+        Put an object in COS with a single request.
+        """
         try:
             res = self.cos_client.put_object(Bucket=bucket_name, Key=key, Body=data)
             status = 'OK' if res['ResponseMetadata']['HTTPStatusCode'] == 200 else 'Error'
@@ -125,6 +207,95 @@ class StorageBackend:
             else:
                 raise e
 
+    def _multipart_upload(self, bucket_name, key, parts):
+        """
+        Upload the parts of an object concurrently. At most `multipart_concurrency`
+        parts are kept in memory at the same time. The upload is aborted if any
+        part fails.
+        :param parts: iterable of bytes-like parts, all but the last one of at least 5MiB.
+        """
+        mpu = self.cos_client.create_multipart_upload(Bucket=bucket_name, Key=key)
+        upload_id = mpu['UploadId']
+
+        def upload_part(part_number, body):
+            res = self.cos_client.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                              PartNumber=part_number,
+                                              Body=body if isinstance(body, bytes) else BufferReader(body))
+            return {'PartNumber': part_number, 'ETag': res['ETag']}, len(body)
+
+        completed_parts = []
+        total_size = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.multipart_concurrency) as executor:
+                pending = set()
+                for part_number, body in enumerate(parts, start=1):
+                    if part_number > MULTIPART_MAX_PARTS:
+                        raise Exception('The object is too large for a multipart upload of at most {} parts'
+                                        .format(MULTIPART_MAX_PARTS))
+                    if len(pending) >= self.multipart_concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for ft in done:
+                            completed_part, part_size = ft.result()
+                            completed_parts.append(completed_part)
+                            total_size += part_size
+                    pending.add(executor.submit(upload_part, part_number, body))
+                for ft in wait(pending)[0]:
+                    completed_part, part_size = ft.result()
+                    completed_parts.append(completed_part)
+                    total_size += part_size
+
+            completed_parts.sort(key=lambda p: p['PartNumber'])
+            self.cos_client.complete_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                                      MultipartUpload={'Parts': completed_parts})
+            logger.debug('PUT Object {} - Size: {} - {} parts - OK'.format(key, sizeof_fmt(total_size),
+                                                                          len(completed_parts)))
+        except Exception as e:
+            logger.debug('PUT Object {} - Multipart upload failed, aborting: {}'.format(key, e))
+            try:
+                self.cos_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+            except Exception:
+                pass
+            raise e
+
+    @staticmethod
+    def _iter_buffer_parts(data, chunksize):
+        """
+        Split an in-memory buffer in parts without copying it.
+        """
+        view = memoryview(data)
+        for pos in range(0, len(view), chunksize):
+            yield view[pos:pos+chunksize]
+
+    @staticmethod
+    def _iter_stream_parts(data, chunksize):
+        """
+        Split a file-like object or an iterable of bytes in parts of `chunksize` bytes.
+        The part size is doubled every MULTIPART_STREAM_PARTS_PER_SIZE parts.
+        """
+        def read_chunks(fileobj):
+            chunk = fileobj.read(chunksize)
+            while chunk:
+                yield chunk
+                chunk = fileobj.read(chunksize)
+
+        chunks = read_chunks(data) if hasattr(data, 'read') else data
+
+        part_size = chunksize
+        part_count = 0
+        buffer = bytearray()
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            buffer.extend(chunk)
+            while len(buffer) >= part_size:
+                yield bytes(buffer[:part_size])
+                del buffer[:part_size]
+                part_count += 1
+                if part_count % MULTIPART_STREAM_PARTS_PER_SIZE == 0:
+                    part_size *= 2
+        if buffer:
+            yield bytes(buffer)
+
     def get_object(self, bucket_name, key, stream=False, extra_get_args={}):
         """
         Get object from COS with a key. Throws StorageNoSuchKeyError if the given key does not exist.
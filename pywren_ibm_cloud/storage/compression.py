@@ -0,0 +1,308 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import zlib
+import struct
+import logging
+import importlib
+
+logger = logging.getLogger(__name__)
+
+# Compressed objects format:
+#   MAGIC | codec id (u8) | uncompressed size (u64) | compressed data
+# The header travels with the data, so byte ranges of aggregated objects
+# and streamed outputs can be decoded without querying object metadata.
+COMPRESSION_MAGIC = b'PWZ1'
+HEADER_SIZE = len(COMPRESSION_MAGIC) + 9
+MIN_COMPRESSION_SIZE = 16 * 1024  # 16KiB
+LARGE_OBJECT_SIZE = 64 * 1024 ** 2  # 64MiB
+SAMPLE_SIZE = 64 * 1024  # 64KiB
+MAX_COMPRESSION_RATIO = 0.9
+STREAM_CHUNK_SIZE = 1024 ** 2  # 1MiB
+
+
+class Codec:
+
+    def __init__(self, codec_id, name, module, compress, decompress, decompressobj):
+        self.codec_id = codec_id
+        self.name = name
+        self.module = module
+        self.compress = compress
+        self.decompress = decompress
+        self.decompressobj = decompressobj
+
+    def available(self):
+        try:
+            importlib.import_module(self.module)
+            return True
+        except ImportError:
+            return False
+
+
+def _zstd_compress(data, level):
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data):
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def _zstd_decompressobj():
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _lz4_compress(data, level):
+    import lz4.frame
+    return lz4.frame.compress(data)
+
+
+def _lz4_decompress(data):
+    import lz4.frame
+    return lz4.frame.decompress(data)
+
+
+def _lz4_decompressobj():
+    import lz4.frame
+    return lz4.frame.LZ4FrameDecompressor()
+
+
+CODECS = {
+    'zlib': Codec(1, 'zlib', 'zlib', lambda data, level: zlib.compress(data, level),
+                  zlib.decompress, zlib.decompressobj),
+    'zstd': Codec(2, 'zstd', 'zstandard', _zstd_compress, _zstd_decompress, _zstd_decompressobj),
+    'lz4': Codec(3, 'lz4', 'lz4', _lz4_compress, _lz4_decompress, _lz4_decompressobj),
+}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+# Preferred codecs: best ratio for regular objects, best speed for large ones
+PREFERENCE = ['zstd', 'zlib', 'lz4']
+PREFERENCE_LARGE = ['lz4', 'zstd', 'zlib']
+LEVELS = {'zstd': 3, 'zlib': 6, 'lz4': 0}
+LEVELS_LARGE = {'zstd': 1, 'zlib': 1, 'lz4': 0}
+
+
+def negotiate_codecs(remote_modules):
+    """
+    Returns the codecs available both locally and in the remote side.
+    zlib is part of the standard library, so it is always available.
+    :param remote_modules: top-level modules installed in the remote side (runtime preinstalls)
+    :return: list of codec names
+    """
+    remote_modules = set(remote_modules)
+    codecs = []
+    for name in PREFERENCE:
+        codec = CODECS[name]
+        if (codec.module == 'zlib' or codec.module in remote_modules) and codec.available():
+            codecs.append(name)
+    return codecs
+
+
+def select_codec(data, codecs):
+    """
+    Selects the codec for an object according to its size and compressibility.
+    :return: (codec, level) or None if it is not worth to compress the object
+    """
+    if not codecs or len(data) < MIN_COMPRESSION_SIZE:
+        return None
+
+    large = len(data) >= LARGE_OBJECT_SIZE
+    preference = PREFERENCE_LARGE if large else PREFERENCE
+    levels = LEVELS_LARGE if large else LEVELS
+    name = next((name for name in preference if name in codecs), None)
+    if name is None:
+        return None
+    codec = CODECS[name]
+
+    # Probe the compressibility of the object with a sample
+    sample = bytes(memoryview(data)[:SAMPLE_SIZE])
+    if len(codec.compress(sample, levels[name])) > len(sample) * MAX_COMPRESSION_RATIO:
+        return None
+
+    return codec, levels[name]
+
+
+def compress(data, codecs):
+    """
+    Compresses `data` with one of the negotiated `codecs`, if worth it.
+    :return: compressed object with header, or the original data
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    selected = select_codec(data, codecs)
+    if selected is None:
+        return data
+
+    codec, level = selected
+    compressed = codec.compress(data, level)
+    if len(compressed) + HEADER_SIZE >= len(data):
+        return data
+
+    logger.debug('Compressed object with {} - {} -> {} bytes'.format(codec.name, len(data), len(compressed)))
+    return COMPRESSION_MAGIC + struct.pack('<BQ', codec.codec_id, len(data)) + compressed
+
+
+def is_compressed(data):
+    return bytes(data[:len(COMPRESSION_MAGIC)]) == COMPRESSION_MAGIC
+
+
+def _get_codec(codec_id):
+    try:
+        codec = CODECS_BY_ID[codec_id]
+    except KeyError:
+        raise Exception('Unknown compression codec id: {}'.format(codec_id))
+    if not codec.available():
+        raise Exception('Unable to decompress the object: {} is not installed'.format(codec.module))
+    return codec
+
+
+def decompress(data):
+    """
+    Decompresses `data` if it has a compression header. Otherwise returns `data`.
+    """
+    if not is_compressed(data):
+        return data
+
+    codec_id, size = struct.unpack_from('<BQ', data, len(COMPRESSION_MAGIC))
+    codec = _get_codec(codec_id)
+    decompressed = codec.decompress(memoryview(data)[HEADER_SIZE:])
+    if len(decompressed) != size:
+        raise Exception('Corrupted compressed object: expected {} bytes, got {}'.format(size, len(decompressed)))
+    return decompressed
+
+
+def decompress_stream(stream):
+    """
+    Returns a file-like object with the decompressed content of `stream`. Not
+    compressed streams are returned as they are, so they keep being streamed.
+    Compressed streams are decoded incrementally as they are read.
+    """
+    head = stream.read(len(COMPRESSION_MAGIC))
+    if head == COMPRESSION_MAGIC:
+        codec_id, size = struct.unpack('<BQ', _read_exact(stream, HEADER_SIZE - len(COMPRESSION_MAGIC)))
+        return _DecompressedStream(stream, _get_codec(codec_id), size)
+    return _PrefixedStream(head, stream)
+
+
+def _read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise Exception('Corrupted compressed object: truncated header')
+        data += chunk
+    return data
+
+
+class _DecompressedStream:
+    """
+    File-like object that decompresses `stream` by chunks of STREAM_CHUNK_SIZE
+    compressed bytes, so only one chunk of each side is kept in memory.
+    """
+
+    def __init__(self, stream, codec, size):
+        self._stream = stream
+        self._decompressor = codec.decompressobj()
+        self._size = size
+        self._read = 0
+        self._buffer = memoryview(b'')
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Decompresses the next chunk when the pending one has been read.
+        :return: pending decompressed bytes
+        """
+        while self._pos == len(self._buffer) and not self._eof:
+            chunk = self._stream.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                decompressed = self._decompressor.decompress(chunk)
+            else:
+                self._eof = True
+                decompressed = self._decompressor.flush() if hasattr(self._decompressor, 'flush') else b''
+                if self._read + len(decompressed) != self._size:
+                    raise Exception('Corrupted compressed object: expected {} bytes, '
+                                    'got {}'.format(self._size, self._read + len(decompressed)))
+            self._read += len(decompressed)
+            self._buffer = memoryview(decompressed)
+            self._pos = 0
+        return len(self._buffer) - self._pos
+
+    def read(self, n=-1):
+        remaining = None if n is None or n < 0 else n
+        chunks = []
+        while remaining != 0:
+            pending = self._fill()
+            if not pending:
+                break
+            read = pending if remaining is None else min(pending, remaining)
+            chunks.append(self._buffer[self._pos:self._pos+read])
+            self._pos += read
+            if remaining is not None:
+                remaining -= read
+        return b''.join(chunks)
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        read = min(self._fill(), len(view))
+        view[:read] = self._buffer[self._pos:self._pos+read]
+        self._pos += read
+        return read
+
+    def close(self):
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
+
+
+class _PrefixedStream:
+    """
+    File-like object that returns `prefix` before reading from `stream`.
+    """
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, n=-1):
+        if not self._prefix:
+            return self._stream.read() if n is None or n < 0 else self._stream.read(n)
+        if n is None or n < 0:
+            data = self._prefix + self._stream.read()
+            self._prefix = b''
+            return data
+        data = self._prefix[:n]
+        self._prefix = self._prefix[n:]
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        if self._prefix:
+            read = min(len(self._prefix), len(view))
+            view[:read] = self._prefix[:read]
+            self._prefix = self._prefix[read:]
+            return read
+        if hasattr(self._stream, 'readinto'):
+            return self._stream.readinto(view)
+        chunk = self._stream.read(len(view))
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def close(self):
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
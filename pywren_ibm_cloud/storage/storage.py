@@ -1,13 +1,18 @@
 import os
+import io
 import json
-import pickle
+import uuid
+import hashlib
 import logging
 import importlib
+from .. import serializers
 from ..version import __version__
+from .compression import decompress, decompress_stream
 from .utils import create_status_key, create_output_key, status_key_suffix, CloudObject, StorageNoSuchKeyError
 
 
 LOCAL_HOME_DIR = os.path.join(os.path.expanduser('~'), '.cloudbutton')
+OBJECT_CACHE_SIZE = 256 * 1024 ** 2  # 256MiB
 logger = logging.getLogger(__name__)
 
 
@@ -19,6 +24,17 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+class CallsetDone(dict):
+    """
+    Done bitmap of each job of a callset, by job ID, and the status keys
+    already listed, so that the next listings only parse the new keys.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.listed_keys = set()
+
+
 class InternalStorage(metaclass=Singleton):
     """
     An InternalStorage object is used by executors and other components to access underlying storage backend
@@ -31,7 +47,11 @@ class InternalStorage(metaclass=Singleton):
         self.backend = self.config['backend']
         self.bucket = self.config['bucket']
         self.prefix = self.config['prefix']
-        self.tmp_obj_count = 0
+        self.tmp_obj_prefix = None
+        self.compression_codecs = []
+        # Read-through cache of CloudObjects and cache of broadcast objects, only enabled in the functions
+        self.object_cache_dir = None
+        self.broadcast_cache_dir = None
 
         try:
             module_location = 'pywren_ibm_cloud.storage.backends.{}'.format(self.backend)
@@ -50,7 +70,8 @@ class InternalStorage(metaclass=Singleton):
 
     def put_data(self, key, data):
         """
-        Put data object into storage.
+        Put data object into storage. Objects are compressed by the callers with
+        compression.compress(), the storage only decompresses them when read.
         :param key: data key
         :param data: data content
         :return: None
@@ -68,11 +89,15 @@ class InternalStorage(metaclass=Singleton):
 
     def get_data(self, key, stream=False, extra_get_args={}):
         """
-        Get data object from storage.
+        Get data object from storage. Compressed objects, or byte ranges
+        of compressed objects, are decompressed.
         :param key: data key
         :return: data content
         """
-        return self.storage_handler.get_object(self.bucket, key, stream, extra_get_args)
+        data = self.storage_handler.get_object(self.bucket, key, stream, extra_get_args)
+        if stream:
+            return decompress_stream(data)
+        return decompress(data)
 
     def get_func(self, key):
         """
@@ -80,38 +105,209 @@ class InternalStorage(metaclass=Singleton):
         :param key: function key
         :return: serialized function
         """
+        return decompress(self.storage_handler.get_object(self.bucket, key))
+
+    def module_archive_exists(self, key):
+        """
+        Check if a module archive is already in storage.
+        :param key: module archive key
+        :return: True if the archive exists
+        """
+        return self._key_exists(key)
+
+    def put_module_archive(self, key, archive):
+        """
+        Put module archive into storage.
+        :param key: module archive key
+        :param archive: zip archive bytes
+        :return: None
+        """
+        return self.storage_handler.put_object(self.bucket, key, archive)
+
+    def get_module_archive(self, key):
+        """
+        Get module archive from storage.
+        :param key: module archive key
+        :return: zip archive bytes
+        """
         return self.storage_handler.get_object(self.bucket, key)
 
+    def broadcast_exists(self, key):
+        """
+        Check if a broadcast object is already in storage.
+        :param key: broadcast key
+        :return: True if the object exists
+        """
+        return self._key_exists(key)
+
+    def put_broadcast(self, key, body):
+        """
+        Put serialized broadcast object into storage. It is not compressed,
+        so the workers can map it into memory.
+        :param key: broadcast key
+        :param body: bytes or iterator of bytes-like chunks
+        :return: None
+        """
+        return self.storage_handler.put_object(self.bucket, key, body)
+
+    def get_broadcast(self, key):
+        """
+        Get serialized broadcast object from storage.
+        :param key: broadcast key
+        :return: stream
+        """
+        return self.storage_handler.get_object(self.bucket, key, stream=True)
+
+    def _key_exists(self, key):
+        try:
+            self.storage_handler.head_object(self.bucket, key)
+            return True
+        except StorageNoSuchKeyError:
+            return False
+
     def put_object(self, content, bucket=None, key=None):
         """
-        Put temporal data object into storage.
-        :param key: data key
-        :param data: data content
+        Put temporal data object into storage. Bytes-like content is stored as is,
+        so it can be read by ranges. Any other object is serialized.
+        :param content: data content
+        :param bucket: bucket. Default the storage bucket
+        :param key: data key. Default a random key under the prefix of the call
         :return: CloudObject instance
         """
+        serialized = not isinstance(content, (bytes, bytearray, memoryview))
+        if serialized:
+            size, body = serializers.dumps_stream(content)
+            chunks = [body] if isinstance(body, bytes) else list(body)
+        else:
+            size = memoryview(content).nbytes
+            chunks = [content]
+
+        content_hash = hashlib.sha256()
+        for chunk in chunks:
+            content_hash.update(chunk)
+
         prefix = self.tmp_obj_prefix or 'tmp'
-        key = key or '{}.pickle'.format('data_{}'.format(self.tmp_obj_count))
+        key = key or '{}.{}'.format(uuid.uuid4().hex, 'pickle' if serialized else 'data')
         key = '/'.join([prefix, key])
         bucket = bucket or self.bucket
-        body = pickle.dumps(content)
-        self.storage_handler.put_object(bucket, key, body)
-        self.tmp_obj_count += 1
-        return CloudObject(self.backend, bucket, key)
+        self.storage_handler.put_object(bucket, key, chunks[0] if len(chunks) == 1 else iter(chunks))
+
+        return CloudObject(self.backend, bucket, key, size=size,
+                           content_hash=content_hash.hexdigest(), serialized=serialized)
 
     def get_object(self, cloudobject):
         """
         get temporal data object from storage.
         :param cloudobject:
-        :return: body text
+        :return: the deserialized object, or bytes if the object was stored as is
         """
-        if self.backend == cloudobject.storage_backend:
-            bucket = cloudobject.bucket
-            key = cloudobject.key
-            body = self.storage_handler.get_object(bucket, key)
-            return pickle.loads(body)
+        self._check_cloudobject(cloudobject)
+        serialized = getattr(cloudobject, 'serialized', True)
+
+        cache_path = self._get_cached_object(cloudobject)
+        if cache_path is None and self._is_cacheable(cloudobject):
+            data = self.storage_handler.get_object(cloudobject.bucket, cloudobject.key)
+            self._cache_object(cloudobject, data)
+        elif cache_path is not None:
+            # Read into a writable buffer, so the deserialized buffers are not copied
+            data = bytearray(os.path.getsize(cache_path))
+            with open(cache_path, 'rb') as cache_file:
+                cache_file.readinto(data)
         else:
+            stream = self.storage_handler.get_object(cloudobject.bucket, cloudobject.key, stream=True)
+            return serializers.loads_stream(stream) if serialized else stream.read()
+
+        return serializers.loads(data) if serialized else data
+
+    def get_object_stream(self, cloudobject, byte_range=None):
+        """
+        Get a file-like object to read the stored bytes of a temporal data object.
+        The data is read lazily from storage, or from the local cache.
+        :param cloudobject:
+        :param byte_range: (start, end) bytes to read, both included. Default None (whole object)
+        :return: file-like object
+        """
+        self._check_cloudobject(cloudobject)
+
+        cache_path = self._get_cached_object(cloudobject)
+        if cache_path is not None:
+            cache_file = open(cache_path, 'rb')
+            if byte_range is None:
+                return cache_file
+            with cache_file:
+                cache_file.seek(byte_range[0])
+                return io.BytesIO(cache_file.read(byte_range[1] - byte_range[0] + 1))
+
+        extra_get_args = {}
+        if byte_range is not None:
+            extra_get_args['Range'] = 'bytes={}-{}'.format(*byte_range)
+        return self.storage_handler.get_object(cloudobject.bucket, cloudobject.key,
+                                               stream=True, extra_get_args=extra_get_args)
+
+    def get_object_range(self, cloudobject, start, end):
+        """
+        Get a byte range of a temporal data object stored as is.
+        :param cloudobject:
+        :param start: first byte
+        :param end: last byte, included
+        :return: bytes
+        """
+        return self.get_object_stream(cloudobject, (start, end)).read()
+
+    def _check_cloudobject(self, cloudobject):
+        if self.backend != cloudobject.storage_backend:
             raise Exception("CloudObject: Invalid Storage backend for retrieving the object")
 
+    def _is_cacheable(self, cloudobject):
+        size = getattr(cloudobject, 'size', None)
+        return (self.object_cache_dir is not None and getattr(cloudobject, 'content_hash', None) is not None
+                and size is not None and size <= OBJECT_CACHE_SIZE // 4)
+
+    def _get_cached_object(self, cloudobject):
+        """
+        Path of the cached copy of an object. Objects are cached by content hash,
+        so a cached copy is never stale.
+        :return: path, or None if the object is not cached
+        """
+        if not self._is_cacheable(cloudobject):
+            return None
+        cache_path = os.path.join(self.object_cache_dir, cloudobject.content_hash)
+        try:
+            if os.path.getsize(cache_path) != cloudobject.size:
+                return None
+            os.utime(cache_path)
+        except OSError:
+            return None
+        logger.debug('CloudObject {} read from local cache'.format(cloudobject.key))
+        return cache_path
+
+    def _cache_object(self, cloudobject, data):
+        """
+        Adds an object to the local cache, evicting the least recently used
+        objects when the cache exceeds OBJECT_CACHE_SIZE.
+        """
+        cache_path = os.path.join(self.object_cache_dir, cloudobject.content_hash)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            os.makedirs(self.object_cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, cache_path)
+
+            cached = []
+            for entry in os.scandir(self.object_cache_dir):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    cached.append((stat.st_mtime, stat.st_size, entry.path))
+            cache_size = sum(size for _, size, _ in cached)
+            for _, size, path in sorted(cached):
+                if cache_size <= OBJECT_CACHE_SIZE:
+                    break
+                os.remove(path)
+                cache_size -= size
+        except OSError as e:
+            logger.debug('Unable to cache CloudObject {}: {}'.format(cloudobject.key, e))
+
     def get_callset_status(self, executor_id):
         """
         Get the status of a callset.
@@ -127,6 +323,37 @@ class InternalStorage(metaclass=Singleton):
         call_ids = [tuple(k[len(callset_prefix)+1:].split("/")[:2]) for k in status_keys]
         return call_ids
 
+    def get_callset_done(self, executor_id, done=None):
+        """
+        Get the status of a callset as a done bitmap per job: a bytearray indexed by
+        call number, with a 1 for each call whose status is in the storage.
+        :param executor_id: executor's ID
+        :param done: CallsetDone of a previous listing, updated in place. The status
+        keys already listed are skipped without being parsed. Default None
+        :return: A CallsetDone with the done bitmap of each job ID.
+        """
+        if done is None:
+            done = CallsetDone()
+        listed_keys = done.listed_keys
+        callset_prefix = '/'.join([self.prefix, executor_id])
+        keys = self.storage_handler.list_keys_with_prefix(self.bucket, callset_prefix)
+
+        for key in keys:
+            if key in listed_keys or not key.endswith(status_key_suffix):
+                continue
+            listed_keys.add(key)
+            job_id, call_id = key[len(callset_prefix)+1:].split("/")[:2]
+            if not call_id.isdigit():
+                continue
+            call_no = int(call_id)
+            bitmap = done.setdefault(job_id, bytearray())
+            if call_no >= len(bitmap):
+                # Grow by at least the current size, so that a job is resized only a few times
+                bitmap.extend(bytes(max(call_no + 1 - len(bitmap), len(bitmap))))
+            bitmap[call_no] = 1
+
+        return done
+
     def get_call_status(self, executor_id, callgroup_id, call_id):
         """
         Get status of a call.
@@ -141,16 +368,20 @@ class InternalStorage(metaclass=Singleton):
         except StorageNoSuchKeyError:
             return None
 
-    def get_call_output(self, executor_id, callgroup_id, call_id):
+    def get_call_output(self, executor_id, callgroup_id, call_id, stream=False):
         """
         Get the output of a call.
         :param executor_id: executor ID of the call
         :param call_id: call ID of the call
+        :param stream: return a file-like object instead of the whole output
         :return: Output of the call.
         """
         output_key = create_output_key(self.prefix, executor_id, callgroup_id, call_id)
         try:
-            return self.storage_handler.get_object(self.bucket, output_key)
+            output = self.storage_handler.get_object(self.bucket, output_key, stream=stream)
+            if stream:
+                return decompress_stream(output)
+            return decompress(output)
         except StorageNoSuchKeyError:
             return None
 
@@ -24,6 +24,9 @@ agg_data_key_suffix = "aggdata.pickle"
 data_key_suffix = "data.pickle"
 output_key_suffix = "output.pickle"
 status_key_suffix = "status.json"
+shuffle_key_suffix = "shuffle.data"
+module_archive_dir = "modules"
+broadcast_dir = "broadcast"
 
 
 class StorageNoSuchKeyError(Exception):
@@ -46,10 +49,15 @@ class StorageConfigMismatchError(Exception):
 
 
 class CloudObject:
-    def __init__(self, storage_backend, bucket, key):
+    def __init__(self, storage_backend, bucket, key, size=None, content_hash=None, serialized=True):
         self.storage_backend = storage_backend
         self.key = key
         self.bucket = bucket
+        # Stored bytes and their sha256, None for the objects of older versions
+        self.size = size
+        self.content_hash = content_hash
+        # False if the object holds raw bytes, which can be read by ranges
+        self.serialized = serialized
 
 
 def clean_bucket(bucket, prefix, storage_config):
@@ -93,6 +101,26 @@ def create_func_key(prefix, executor_id, job_id):
     return func_key
 
 
+def create_module_archive_key(prefix, archive_hash):
+    """
+    Create module archive key. Archives are shared by all the executors
+    :param prefix: prefix
+    :param archive_hash: content hash of the archive
+    :return: module archive key
+    """
+    return '/'.join([prefix, module_archive_dir, '{}.zip'.format(archive_hash)])
+
+
+def create_broadcast_key(prefix, content_hash):
+    """
+    Create broadcast key. Broadcast objects are shared by all the executors
+    :param prefix: prefix
+    :param content_hash: content hash of the serialized object
+    :return: broadcast key
+    """
+    return '/'.join([prefix, broadcast_dir, '{}.pickle'.format(content_hash)])
+
+
 def create_agg_data_key(prefix, executor_id, job_id):
     """
     Create aggregate data key
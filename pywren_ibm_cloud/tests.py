@@ -1,7 +1,10 @@
 import sys
 import json
+import time
+import asyncio
 import argparse
 import unittest
+import threading
 import pywren_ibm_cloud as pywren
 import urllib.request
 from pywren_ibm_cloud.storage import InternalStorage
@@ -69,6 +72,11 @@ def simple_map_function(x, y):
     return x + y
 
 
+def sleep_function(secs):
+    time.sleep(secs)
+    return secs
+
+
 def simple_reduce_function(results):
     total = 0
     for map_result in results:
@@ -296,6 +304,29 @@ class TestPywren(unittest.TestCase):
         result = pw.get_result()
         self.checkResult(result)
 
+    def test_monitor_cancel(self):
+        pw = pywren.ibm_cf_executor(config=CONFIG)
+        futures = pw.map(sleep_function, [10, 10])
+
+        # Timeout, from a thread other than the main one
+        result = {}
+        monitor = threading.Thread(target=lambda: result.update(fs=pw.monitor(futures=futures, timeout=1)))
+        monitor.start()
+        monitor.join()
+        fs_dones, fs_notdones = result['fs']
+        self.assertEqual(len(fs_notdones), 2)
+
+        # Cancellation of a wait in progress
+        threading.Timer(1, pw.cancel).start()
+        start = time.time()
+        fs_dones, fs_notdones = pw.monitor(futures=futures)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(len(fs_notdones), 2)
+
+        fs_dones, fs_notdones = asyncio.run(pw.wait_async(futures=futures))
+        self.assertEqual(len(fs_dones), 2)
+        self.assertEqual(pw.get_result(futures=futures), [10, 10])
+
 
 if __name__ == '__main__':
 
@@ -314,6 +345,7 @@ if __name__ == '__main__':
         print("-> test_chunks_bucket")
         print("-> test_chunks_bucket_one_reducer_per_object")
         print("-> test_cloudobject")
+        print("-> test_monitor_cancel")
 
     else:
         suite = unittest.TestSuite()
@@ -0,0 +1,213 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+TRACES_FILE = os.path.join(os.path.expanduser('~'), '.cloudbutton', 'traces.jsonl')
+
+_exporter = None
+# Span of the enclosing `with` block, per thread
+_local = threading.local()
+
+
+class InMemoryExporter:
+    """
+    Keeps the finished spans in a list. Used by the workers, and by tests
+    that check the spans of an execution.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class FileExporter:
+    """
+    Appends the finished spans to a file, one JSON object per line.
+    """
+
+    def __init__(self, path=TRACES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, span):
+        with self._lock:
+            with open(self.path, 'a') as trace_file:
+                trace_file.write(json.dumps(span) + '\n')
+
+
+def set_exporter(exporter):
+    """
+    Sets the exporter of the finished spans. Tracing is disabled while the
+    exporter is None. An exporter is any object with an `export(span)` method
+    that gets each span as a dict.
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter():
+    return _exporter
+
+
+def export_spans(spans):
+    """
+    Exports spans finished in another process, for example the spans of a
+    function returned in its status.
+    """
+    if _exporter is not None:
+        for span in spans:
+            _exporter.export(span)
+
+
+def _parse_context(traceparent):
+    # W3C trace context: version-trace_id-parent_id-flags
+    try:
+        unused_version, trace_id, span_id, unused_flags = traceparent.split('-')
+        return trace_id, span_id
+    except (AttributeError, ValueError):
+        return None, None
+
+
+class Span:
+    """
+    A timed operation of a trace. Ends, and is exported, when end() is called
+    or when the `with` block that uses it exits.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start_time = time.time()
+        self.end_time = None
+        self._previous = None
+
+    @property
+    def context(self):
+        """
+        Trace context of the span, propagated to the spans of other processes.
+        """
+        return '00-{}-{}-01'.format(self.trace_id, self.span_id)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if _exporter is not None:
+            _exporter.export(self.to_dict())
+
+    def to_dict(self):
+        return {'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                'parent_id': self.parent_id, 'start_time': self.start_time,
+                'end_time': self.end_time, 'attributes': self.attributes}
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'span', None)
+        _local.span = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.set_attribute('error', repr(exc_value))
+        _local.span = self._previous
+        self.end()
+
+
+class _NoopSpan:
+    context = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def child_span_id(span_id, index):
+    """
+    Span ID of the `index`-th child of a span, derived from the ID of the span.
+    """
+    return '{:016x}'.format((int(span_id, 16) + index + 1) % 2 ** 64)
+
+
+def child_context(traceparent, index):
+    """
+    Trace context of the `index`-th child of the span of `traceparent`, as
+    started with start_span(child_index=index). None if `traceparent` is None.
+    """
+    trace_id, span_id = _parse_context(traceparent)
+    if trace_id is None:
+        return None
+    return '00-{}-{}-01'.format(trace_id, child_span_id(span_id, index))
+
+
+def start_span(name, parent=None, child_index=None, **attributes):
+    """
+    Starts a span. Returns a no-op span if tracing is disabled.
+    :param name: name of the operation
+    :param parent: parent span, or trace context of a span of another process.
+    Default the span of the enclosing `with` block, or a new trace.
+    :param child_index: derive the span ID from the ID of the parent and this index,
+    so that the context of the span can be computed with child_context() instead of
+    being kept. Default None (random span ID)
+    :param attributes: attributes of the span
+    """
+    if _exporter is None:
+        return NOOP_SPAN
+
+    if parent is None:
+        parent = getattr(_local, 'span', None)
+    if isinstance(parent, Span):
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    elif isinstance(parent, str):
+        trace_id, parent_id = _parse_context(parent)
+    else:
+        trace_id, parent_id = None, None
+
+    span = Span(name, trace_id or os.urandom(16).hex(), parent_id, attributes)
+    if child_index is not None and parent_id is not None:
+        span.span_id = child_span_id(parent_id, child_index)
+    return span
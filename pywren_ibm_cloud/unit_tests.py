@@ -0,0 +1,1205 @@
+#
+# (C) Copyright IBM Corp. 2019
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Unit tests of the client and runtime internals. They run locally, without a
+PyWren configuration or access to IBM Cloud:
+
+    python -m pywren_ibm_cloud.unit_tests [-v] [TestCase[.test_name]]
+"""
+import io
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import asyncio
+import tempfile
+import importlib
+import zipfile
+import unittest
+import threading
+from collections import OrderedDict, Counter
+from unittest import mock
+from concurrent.futures import CancelledError
+from pywren_ibm_cloud import serializers, broadcast, profiler, tracing
+from pywren_ibm_cloud import executor as pywren_executor
+from pywren_ibm_cloud import wait as pywren_wait
+from pywren_ibm_cloud.runtime import memory
+from pywren_ibm_cloud.runtime import runtime as pywren_runtime
+from pywren_ibm_cloud.runtime.function_handler import sampler
+from pywren_ibm_cloud.libs.cloudpipe import module_dependency
+from pywren_ibm_cloud.utils import version_str
+from pywren_ibm_cloud.compute.backends.ibm_cf import ibm_cf
+from pywren_ibm_cloud import invoker as pywren_invoker
+from pywren_ibm_cloud.invoker import Invoker, shard_calls
+from pywren_ibm_cloud.future import JobStore, JobState
+from pywren_ibm_cloud.job.job import plan_reduce_levels, split_reduce_groups
+from pywren_ibm_cloud.job import shuffle
+from pywren_ibm_cloud.storage import InternalStorage, CallsetDone
+from pywren_ibm_cloud.storage.backends.ibm_cos import StorageBackend as COSStorageBackend
+from pywren_ibm_cloud.storage.utils import create_status_key, create_output_key, StorageNoSuchKeyError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STORAGE_CONFIG = {'backend': 'ibm_cos', 'prefix': 'pywren.jobs', 'bucket': 'bucket', 'ibm_cos': {}}
+CONFIG = {'pywren': {'storage_backend': 'ibm_cos', 'storage_prefix': 'pywren.jobs', 'storage_bucket': 'bucket',
+                     'compute_backend': 'ibm_cf', 'invocation_retry': True, 'retry_sleeps': [1], 'retries': 1},
+          'ibm_cos': {}, 'ibm_cf': {}}
+
+
+def simple_map_function(x, y):
+    return x + y
+
+
+class MemoryStorageHandler:
+    """
+    Storage backend kept in memory
+    """
+
+    def __init__(self):
+        self.objects = OrderedDict()
+
+    def put_object(self, bucket_name, key, data):
+        self.objects[key] = data if isinstance(data, (bytes, str)) else b''.join(data)
+
+    def head_object(self, bucket_name, key):
+        if key not in self.objects:
+            raise StorageNoSuchKeyError(key)
+        return {'content-length': str(len(self.objects[key]))}
+
+    def get_object(self, bucket_name, key, stream=False, extra_get_args={}):
+        data = self.objects[key]
+        if 'Range' in extra_get_args:
+            first, last = extra_get_args['Range'][len('bytes='):].split('-')
+            data = data[int(first):int(last) + 1]
+        return io.BytesIO(data) if stream else data
+
+    def list_keys_with_prefix(self, bucket_name, prefix):
+        return [key for key in self.objects if key.startswith(prefix)]
+
+
+class MemoryStorage:
+    """
+    InternalStorage over a MemoryStorageHandler. InternalStorage is a singleton,
+    so its methods are used instead of subclassing it.
+    """
+    get_storage_config = InternalStorage.get_storage_config
+    put_data = InternalStorage.put_data
+    get_data = InternalStorage.get_data
+    get_callset_done = InternalStorage.get_callset_done
+    broadcast_exists = InternalStorage.broadcast_exists
+    put_broadcast = InternalStorage.put_broadcast
+    get_broadcast = InternalStorage.get_broadcast
+    _key_exists = InternalStorage._key_exists
+
+    def __init__(self):
+        self.config = STORAGE_CONFIG
+        self.backend = STORAGE_CONFIG['backend']
+        self.prefix = STORAGE_CONFIG['prefix']
+        self.bucket = STORAGE_CONFIG['bucket']
+        self.storage_handler = MemoryStorageHandler()
+        self.tmp_obj_prefix = self.prefix
+        self.compression_codecs = []
+        self.broadcast_cache_dir = None
+
+    def get_call_status(self, executor_id, job_id, call_id):
+        return None
+
+    def get_runtime_meta(self, key):
+        return json.loads(self.storage_handler.get_object(self.bucket, key + '.meta.json'))
+
+    def put_runtime_meta(self, key, runtime_meta):
+        self.storage_handler.put_object(self.bucket, key + '.meta.json', json.dumps(runtime_meta))
+
+
+class StubCOSClient:
+    """
+    ibm_boto3 S3 client that keeps the objects in memory and records the
+    requests. The parts in `failed_parts` raise an exception.
+    """
+
+    def __init__(self, failed_parts=()):
+        self.failed_parts = set(failed_parts)
+        self.objects = {}
+        self.requests = []
+        self.uploaded_parts = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        self.requests.append('put_object')
+        self.objects[Key] = bytes(Body)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.requests.append('create_multipart_upload')
+        return {'UploadId': 'upload'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        # Parts finish out of order
+        time.sleep(random.random() / 100)
+        if PartNumber in self.failed_parts:
+            raise Exception('Unable to upload part {}'.format(PartNumber))
+        with self.lock:
+            self.uploaded_parts[PartNumber] = Body if isinstance(Body, bytes) else Body.read()
+        return {'ETag': 'etag{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.requests.append('complete_multipart_upload')
+        parts = MultipartUpload['Parts']
+        assert [part['ETag'] for part in parts] == ['etag{}'.format(part['PartNumber']) for part in parts]
+        self.objects[Key] = b''.join(self.uploaded_parts[part['PartNumber']] for part in parts)
+        self.completed_parts = [part['PartNumber'] for part in parts]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.requests.append('abort_multipart_upload')
+
+
+class FakeCompute:
+    """
+    Compute backend that records the invocations with their timestamps. The
+    invoker activations of a remote invocation run remote_invoker() in the
+    invoking thread; patch invoker.Compute to return this backend. The calls
+    in `failed_calls` are not started, as if the invocation had failed.
+    """
+
+    def __init__(self, region='eu-de', concurrency=None, failed_calls=()):
+        self.region = region
+        self.concurrency = concurrency
+        self.failed_calls = set(failed_calls)
+        self.invocations = []
+        self.invoker_errors = []
+
+    @property
+    def call_ids(self):
+        return [payload['call_id'] for _, payload in self.invocations if not payload.get('remote_invoker')]
+
+    def invoke(self, runtime_name, runtime_memory, payload):
+        self.invocations.append((time.time(), payload))
+        if payload['call_id'] in self.failed_calls:
+            return None
+        if payload.get('remote_invoker'):
+            # Nobody waits for the invoker activations
+            try:
+                pywren_invoker.remote_invoker(payload)
+            except Exception as e:
+                self.invoker_errors.append(e)
+        return 'activation' + payload['call_id']
+
+
+class ReadIntoStream(io.BytesIO):
+    """
+    Stream that reads at most 1 MiB at a time, like a socket, and records the
+    buffers it reads into
+    """
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.views = []
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)[:1024 ** 2]
+        self.views.append(view)
+        return super().readinto(view)
+
+
+def invoked_futures(total_calls, job_id='000'):
+    futures = JobStore('executor', job_id, STORAGE_CONFIG, {}, total_calls).futures()
+    for f in futures:
+        f._set_state(JobState.invoked)
+    return futures
+
+
+def fake_executor(config, internal_storage=None):
+    """
+    FunctionExecutor whose invoker returns a mock future per call, without invoking them
+    """
+    executor = pywren_executor.FunctionExecutor.__new__(pywren_executor.FunctionExecutor)
+    executor.config = config
+    executor.internal_storage = internal_storage
+    executor.executor_id = 'executor'
+    executor.is_cf_cluster = False
+    executor.jobs = {}
+    executor._state = pywren_executor.ExecutorState.ready
+    executor.invoker = mock.Mock()
+    executor.invoker.run.side_effect = lambda job: [mock.Mock(job_id=job['job_id'], call_id=i)
+                                                    for i in range(job['total_calls'])]
+    return executor
+
+
+@unittest.skipUnless(np, 'numpy is not installed')
+class TestSerializers(unittest.TestCase):
+
+    def test_serializers(self):
+        data = {'x': np.arange(1000, dtype='float64').reshape(10, 100), 'y': [1, 2, 3]}
+        payload = serializers.dumps(data)
+
+        # Read-only inputs (bytes), writable inputs and streams give writable arrays, as pickle does
+        for loaded in (serializers.loads(payload), serializers.loads(bytearray(payload)),
+                       serializers.loads_stream(io.BytesIO(payload))):
+            self.assertTrue(loaded['x'].flags.writeable)
+            self.assertTrue(np.array_equal(loaded['x'], data['x']))
+            self.assertEqual(loaded['y'], data['y'])
+            loaded['x'] += 1
+
+    def test_stream(self):
+        data = {'x': np.arange(3 * 1024 ** 2, dtype='float64'), 'y': [1, 2, 3]}
+        size, body = serializers.dumps_stream(data)
+        chunks = list(body)
+        self.assertEqual(sum(memoryview(chunk).nbytes for chunk in chunks), size)
+        # The array is uploaded as an out-of-band buffer, not copied into the pickle
+        self.assertTrue(any(np.shares_memory(np.asarray(chunk), data['x']) for chunk in chunks[2:]))
+
+        storage = MemoryStorage()
+        storage.put_data('output.pickle', iter(chunks))
+        for stream in (storage.get_data('output.pickle', stream=True),
+                       ReadIntoStream(storage.storage_handler.objects['output.pickle'])):
+            loaded = serializers.loads_stream(stream)
+            self.assertTrue(np.array_equal(loaded['x'], data['x']))
+            self.assertEqual(loaded['y'], data['y'])
+
+        # The buffers are read into preallocated buffers, in chunks of at most READ_CHUNK_SIZE
+        targets = set(id(view.obj) for view in stream.views)
+        self.assertEqual(len(targets), 1)
+        self.assertTrue(all(view.nbytes <= serializers.READ_CHUNK_SIZE for view in stream.views))
+        self.assertTrue(np.shares_memory(loaded['x'], np.frombuffer(stream.views[0].obj, dtype='uint8')))
+
+
+@unittest.skipUnless(np, 'numpy is not installed')
+class TestBroadcast(unittest.TestCase):
+
+    def test_broadcast(self):
+        storage = MemoryStorage()
+        data = {'x': np.arange(1000, dtype='float64'), 'y': [1, 2, 3]}
+        shared = broadcast.create_broadcast(storage, data)
+        self.assertEqual(len(storage.storage_handler.objects), 1)
+        broadcast.create_broadcast(storage, data)
+        self.assertEqual(len(storage.storage_handler.objects), 1)
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.object(broadcast, 'InternalStorage', return_value=storage):
+            storage.broadcast_cache_dir = cache_dir
+            downloaded_bytes = broadcast.downloaded_bytes
+            references = [pickle.loads(pickle.dumps(shared)) for _ in range(2)]
+            values = [reference.value for reference in references]
+            # The file is downloaded once, and the arrays are read-only views of its map
+            self.assertEqual(broadcast.downloaded_bytes - downloaded_bytes, shared.size)
+            for value in values:
+                self.assertTrue(np.array_equal(value['x'], data['x']))
+                self.assertEqual(value['y'], data['y'])
+                self.assertFalse(value['x'].flags.writeable)
+                self.assertFalse(value['x'].flags.owndata)
+
+            # The map stays open while the arrays are used elsewhere
+            maps = [reference._map for reference in references]
+            references[0].close()
+            self.assertFalse(maps[0].closed)
+            self.assertEqual(values[0]['x'].sum(), data['x'].sum())
+            del value, values[1]
+            references[1].close()
+            self.assertTrue(maps[1].closed)
+
+
+class TestModuleDependency(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.modules_dir = os.path.join(self.tmp_dir.name, 'modules')
+        self.cache_file = os.path.join(self.tmp_dir.name, 'module_imports.json')
+        self.write_module('pkg/__init__.py', 'from . import sub\nimport mod_b\n')
+        self.write_module('pkg/sub.py', 'import json\nfrom pkg import helpers\n')
+        self.write_module('pkg/helpers.py', '')
+        self.write_module('mod_b.py', 'import mod_c\n')
+        self.write_module('mod_c.py', '')
+        sys.path.insert(0, self.modules_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.modules_dir)
+        self.tmp_dir.cleanup()
+
+    def write_module(self, name, source, mtime=None):
+        path = os.path.join(self.modules_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as module_file:
+            module_file.write(source)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+        importlib.invalidate_caches()
+        return path
+
+    def analyze(self, analyzer):
+        with mock.patch.object(module_dependency.ast, 'parse', wraps=module_dependency.ast.parse) as parse:
+            paths = analyzer.analyze(['pkg.sub'], ignore=['json'])
+        return set(os.path.relpath(path, self.modules_dir) for path in paths), parse.call_count
+
+    def test_analyzer(self):
+        analyzer = module_dependency.ModuleDependencyAnalyzer(self.cache_file)
+        self.assertEqual(self.analyze(analyzer), ({'pkg', 'mod_b.py', 'mod_c.py'}, 5))
+
+        # Unchanged modules are not inspected again by the same analyzer, nor parsed again
+        # by a new analyzer with the same cache file, in this process or in another one
+        with mock.patch.object(module_dependency, '_find_spec') as find_spec:
+            self.assertEqual(self.analyze(analyzer), ({'pkg', 'mod_b.py', 'mod_c.py'}, 0))
+        self.assertFalse(find_spec.called)
+        self.assertEqual(self.analyze(module_dependency.ModuleDependencyAnalyzer(self.cache_file))[1], 0)
+        module_dependency._imports_caches.clear()
+        self.assertEqual(self.analyze(module_dependency.ModuleDependencyAnalyzer(self.cache_file))[1], 0)
+
+        # A change of size, a change of mtime, or a new module of a package is inspected again
+        self.write_module('mod_c.py', 'import mod_d\n')
+        self.write_module('mod_d.py', '')
+        self.assertEqual(self.analyze(analyzer), ({'pkg', 'mod_b.py', 'mod_c.py', 'mod_d.py'}, 2))
+        mtime = os.stat(os.path.join(self.modules_dir, 'mod_c.py')).st_mtime_ns + 10 ** 9
+        self.write_module('mod_c.py', 'import mod_e\n', mtime=mtime)
+        self.write_module('mod_e.py', '')
+        self.assertEqual(self.analyze(analyzer), ({'pkg', 'mod_b.py', 'mod_c.py', 'mod_e.py'}, 2))
+        self.write_module('pkg/other.py', 'import mod_d\n')
+        self.assertEqual(self.analyze(analyzer), ({'pkg', 'mod_b.py', 'mod_c.py', 'mod_d.py', 'mod_e.py'}, 1))
+
+    def test_imports_cache(self):
+        path = self.write_module('mod_f.py', 'import mod_b\nimport mod_c\n')
+        find_imports = module_dependency.ModuleDependencyAnalyzer()._find_imports
+        imports_cache = module_dependency.ImportsCache(self.cache_file)
+        self.assertEqual(imports_cache.get_imports(path, 'mod_f', find_imports), {'mod_b', 'mod_c'})
+        imports_cache.save()
+        with open(self.cache_file) as cache_file:
+            self.assertEqual(json.load(cache_file)[path][2], ['mod_b', 'mod_c'])
+
+        # The entry of a file is only used while its mtime and size do not change
+        imports_cache = module_dependency.ImportsCache(self.cache_file)
+        self.assertEqual(imports_cache.get_imports(path, 'mod_f', mock.Mock()), {'mod_b', 'mod_c'})
+        mtime = os.stat(path).st_mtime_ns + 10 ** 9
+        self.write_module('mod_f.py', 'import mod_c\nimport mod_b\n', mtime=mtime)
+        self.assertEqual(imports_cache.get_imports(path, 'mod_f', find_imports), {'mod_b', 'mod_c'})
+        self.assertEqual(imports_cache._entries[path][0], mtime)
+        self.write_module('mod_f.py', 'import mod_c\n', mtime=mtime)
+        self.assertEqual(imports_cache.get_imports(path, 'mod_f', find_imports), {'mod_c'})
+
+        # A corrupt cache file is ignored, and written again
+        with open(self.cache_file, 'w') as cache_file:
+            cache_file.write('{"corrupt')
+        imports_cache = module_dependency.ImportsCache(self.cache_file)
+        self.assertEqual(imports_cache._entries, {})
+        self.assertEqual(imports_cache.get_imports(path, 'mod_f', find_imports), {'mod_c'})
+        imports_cache.save()
+        with open(self.cache_file) as cache_file:
+            self.assertEqual(list(json.load(cache_file)), [path])
+
+
+class TestJobStore(unittest.TestCase):
+
+    def test_job_store(self):
+        job_meta = {'func_name': 'simple_map_function', 'runtime_memory': 256}
+        store = JobStore('executor', '000', STORAGE_CONFIG, job_meta, 3, [(0, 9), (10, 19), (20, 29)])
+        futures = store.futures()
+        for f in futures:
+            f.activation_id = 'activation' + f.call_id
+            f.invoke_status['host_submit_time'] = 1.0
+            f.invoke_status['compute_region'] = 'eu-de'
+            f._set_state(JobState.invoked)
+        futures[1]._set_state(JobState.success)
+
+        # The invoke status of each call is a view of its row and of the job metadata
+        invoke_status = futures[1].invoke_status
+        self.assertEqual(invoke_status['call_id'], '00001')
+        self.assertEqual(invoke_status['data_byte_range'], (10, 19))
+        self.assertEqual(invoke_status['runtime_memory'], 256)
+        self.assertNotIn('status_done_timestamp', invoke_status)
+        invoke_status['status_done_timestamp'] = 2.0
+        self.assertEqual(futures[1].invoke_status.copy()['status_done_timestamp'], 2.0)
+        self.assertEqual([f.done for f in futures], [False, True, False])
+
+        # Futures sent to and returned by the functions keep their call
+        f = pickle.loads(pickle.dumps(futures[1]))
+        self.assertEqual((f.executor_id, f.job_id, f.call_id, f.activation_id), ('executor', '000', '00001', 'activation00001'))
+        self.assertTrue(f.done)
+        self.assertEqual(f.invoke_status.copy(), futures[1].invoke_status.copy())
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'hash-based .pyc files need Python 3.7')
+class TestReduceLevels(unittest.TestCase):
+
+    def test_plan_reduce_levels(self):
+        # A single reducer when the fan-in covers all the mappers, or there is only one
+        self.assertEqual(plan_reduce_levels(100, None), [])
+        self.assertEqual(plan_reduce_levels(100, 100), [])
+        self.assertEqual(plan_reduce_levels(100, 1000), [])
+        self.assertEqual(plan_reduce_levels(1, 2), [])
+        # Levels with a remainder
+        self.assertEqual(plan_reduce_levels(101, 100), [2])
+        self.assertEqual(plan_reduce_levels(25, 4), [7, 2])
+        self.assertEqual(plan_reduce_levels(10000, 10), [1000, 100, 10])
+        self.assertRaises(Exception, plan_reduce_levels, 10, 1)
+
+        groups = split_reduce_groups(list(range(25)), 4)
+        self.assertEqual([len(group) for group in groups], [4] * 6 + [1])
+        self.assertEqual(sum(groups, []), list(range(25)))
+
+    def map_reduce(self, total_mappers, reducer_fanin):
+        """
+        Runs map_reduce() with fake jobs.
+        :return: list of (job_id, groups of futures of each reducer) of the reduce jobs
+        """
+        reduce_jobs = []
+
+        def create_reduce_job(config, internal_storage, executor_id, job_id, reduce_function,
+                              reduce_runtime_memory, map_futures, *args, reducer_fanin=None, level=None, **kwargs):
+            if level is None:
+                groups = [map_futures]
+                reduce_job_id = 'R{}'.format(job_id)
+            else:
+                groups = split_reduce_groups(map_futures, reducer_fanin)
+                reduce_job_id = 'R{}L{}'.format(job_id, level)
+            reduce_jobs.append((reduce_job_id, groups))
+            return {'job_id': reduce_job_id, 'total_calls': len(groups)}
+
+        executor = fake_executor({'pywren': {'runtime': 'runtime', 'runtime_memory': 256}})
+        map_job = {'job_id': 'M000', 'total_calls': total_mappers}
+        with mock.patch.object(pywren_executor, 'create_map_job', return_value=(map_job, None)), \
+                mock.patch.object(pywren_executor, 'create_reduce_job', side_effect=create_reduce_job):
+            futures = executor.map_reduce(None, None, sum, reducer_fanin=reducer_fanin)
+
+        self.assertEqual(len(futures), total_mappers + sum(len(groups) for _, groups in reduce_jobs))
+        self.assertEqual(list(executor.jobs), ['M000'] + [job_id for job_id, _ in reduce_jobs])
+        # Each future is reduced exactly once, and only the final reducer produces output
+        reduced = [f for _, groups in reduce_jobs for group in groups for f in group]
+        self.assertEqual(len(reduced), len(set(map(id, reduced))))
+        self.assertEqual(len(reduced), len(futures) - 1)
+        self.assertTrue(all(f.produce_output is False for f in futures[:-1]))
+        self.assertIsInstance(futures[-1].produce_output, mock.Mock)
+        return [(job_id, [len(group) for group in groups]) for job_id, groups in reduce_jobs]
+
+    def test_map_reduce_levels(self):
+        self.assertEqual(self.map_reduce(1, 10), [('R000', [1])])
+        self.assertEqual(self.map_reduce(10, 10), [('R000', [10])])
+        self.assertEqual(self.map_reduce(10, 100), [('R000', [10])])
+        self.assertEqual(self.map_reduce(25, 4), [('R000L0', [4] * 6 + [1]), ('R000L1', [4, 3]), ('R000', [2])])
+        self.assertEqual(self.map_reduce(25, None), [('R000', [25])])
+
+
+class TestShuffle(unittest.TestCase):
+
+    def test_partition_of(self):
+        # crc32 is not salted, so the partitions are the same in every function
+        self.assertEqual(shuffle.partition_of('hello', 16), 6)
+        self.assertEqual(shuffle.partition_of(b'hello', 16), 6)
+        self.assertEqual(shuffle.partition_of(bytearray(b'hello'), 16), 6)
+        self.assertEqual(shuffle.partition_of(42, 16), shuffle.partition_of('42', 16))
+        self.assertEqual(shuffle.partition_of(('w', 1), 16), shuffle.partition_of(('w', 1), 16))
+        self.assertEqual(shuffle.partition_of('hello', 1), 0)
+
+        counts = Counter(shuffle.partition_of('w{}'.format(i), 16) for i in range(16000))
+        self.assertEqual(sorted(counts), list(range(16)))
+        self.assertTrue(all(800 < count < 1200 for count in counts.values()))
+
+    def test_write_and_fetch_partitions(self):
+        storage = MemoryStorage()
+        storage.compression_codecs = ['zlib']
+        records = [{'w{}'.format(i): i for i in range(100)},
+                   [('w{}'.format(i), i) for i in range(50, 150)] * 20,
+                   None]
+        shuffle_indexes = []
+        for mapper, mapper_records in enumerate(records):
+            storage.tmp_obj_prefix = 'pywren.jobs/executor/M000/{:05d}'.format(mapper)
+            shuffle_indexes.append(shuffle.write_partitions(mapper_records, 4, storage))
+
+        # All the partitions of a mapper are in one object, the mapper without records writes nothing
+        self.assertEqual(len(storage.storage_handler.objects), 2)
+        self.assertEqual(shuffle_indexes[2]['ranges'], [None] * 4)
+        for shuffle_index in shuffle_indexes[:2]:
+            data = storage.storage_handler.objects[shuffle_index['key']]
+            ranges = [byte_range for byte_range in shuffle_index['ranges'] if byte_range]
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data) - 1)
+            self.assertTrue(all(prev[1] + 1 == next[0] for prev, next in zip(ranges, ranges[1:])))
+        # Repeated records compress
+        self.assertLess(len(storage.storage_handler.objects[shuffle_indexes[1]['key']]), 100 * 20 * 4)
+
+        expected = Counter()
+        for mapper_records in records[:2]:
+            for key, value in (mapper_records.items() if isinstance(mapper_records, dict) else mapper_records):
+                expected[key] += value
+
+        with mock.patch.object(storage.storage_handler, 'get_object',
+                               wraps=storage.storage_handler.get_object) as get_object:
+            fetched = Counter()
+            for partition in range(4):
+                for key, value in shuffle.fetch_partition(shuffle_indexes, partition, storage, fetch_threads=1):
+                    self.assertEqual(shuffle.partition_of(key, 4), partition)
+                    fetched[key] += value
+        self.assertEqual(fetched, expected)
+
+        # One ranged GET per mapper and partition with records
+        self.assertEqual(get_object.call_count, sum(1 for shuffle_index in shuffle_indexes
+                                                    for byte_range in shuffle_index['ranges'] if byte_range))
+        for call in get_object.call_args_list:
+            self.assertRegex(call[0][3]['Range'], r'^bytes=\d+-\d+$')
+
+    def test_partitioned_result(self):
+        executor = pywren_executor.FunctionExecutor.__new__(pywren_executor.FunctionExecutor)
+        executor.executor_id = 'executor'
+        executor.internal_storage = None
+        executor.monitor = lambda futures, **kwargs: (futures, [])
+
+        def get_result(job_id, results, partitioned):
+            futures = [mock.Mock(executor_id='executor', job_id=job_id, futures=None, produce_output=True,
+                                 **{'result.return_value': result}) for result in results]
+            executor.jobs = {job_id: {'futures': futures, 'state': JobState.running}}
+            if partitioned:
+                executor.jobs[job_id]['partitioned'] = True
+            return executor.get_result()
+
+        # The reducers of a shuffle return a list for any number of partitions
+        self.assertEqual(get_result('R000', [(10, 100)], True), [(10, 100)])
+        self.assertEqual(get_result('R000', [(10, 100), (20, 200)], True), [(10, 100), (20, 200)])
+        self.assertEqual(get_result('R000', [(10, 100)], False), (10, 100))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def future(self, call_id, invoke_status, run_status):
+        return mock.Mock(executor_id='executor', job_id='M000', call_id=call_id, activation_id='a' + call_id,
+                         invoke_status=invoke_status, run_status=run_status)
+
+    def futures(self):
+        host_job_meta = {'runtime_select_time': 0.3, 'func_upload_time': 0.2, 'runtime_memory': 2048,
+                         'host_submit_time': 100.0}
+        warm = self.future('00000', dict(host_job_meta, invoke_time=0.1, status_done_timestamp=102.5),
+                           {'start_time': 100.6, 'end_time': 102.0, 'setup_time': 0.05, 'module_setup_time': 0.05,
+                            'func_download_time': 0.1, 'data_download_time': 0.1, 'function_exec_time': 1.0,
+                            'output_upload_time': 0.2, 'peak_memory': 100})
+        cold = self.future('00001', dict(host_job_meta, invoke_time=0.2, status_done_timestamp=107.0),
+                           {'start_time': 102.2, 'end_time': 106.5, 'cold_start': True, 'function_exec_time': 4.0,
+                            'peak_memory': 300})
+        not_done = self.future('00002', dict(host_job_meta, invoke_time=0.1), None)
+        return [warm, cold, not_done]
+
+    def test_percentile(self):
+        self.assertIsNone(profiler.percentile([], 50))
+        self.assertEqual(profiler.percentile([5], 99), 5)
+        self.assertEqual(profiler.percentile([4, 1, 3, 2], 50), 2.5)
+        self.assertAlmostEqual(profiler.percentile([4, 1, 3, 2], 90), 3.7)
+        self.assertEqual(profiler.percentile(list(range(101)), 99), 99)
+
+    def test_call_profile(self):
+        warm, cold, _ = [profiler.call_profile(future) for future in self.futures()]
+        expected_warm = {'submit': 0.1, 'queue': 0.5, 'cold_start': 0.0, 'setup': 0.1, 'download': 0.2,
+                         'exec': 1.0, 'upload': 0.2, 'detect': 0.5, 'total': 2.5, 'gb_seconds': 2.8}
+        expected_cold = {'submit': 0.2, 'queue': 0.0, 'cold_start': 2.0, 'setup': 0.0, 'download': 0.0,
+                         'exec': 4.0, 'upload': 0.0, 'detect': 0.5, 'total': 7.0, 'gb_seconds': 8.6}
+        for profile, expected in ((warm, expected_warm), (cold, expected_cold)):
+            for key, value in expected.items():
+                self.assertAlmostEqual(profile[key], value, msg=key)
+        self.assertFalse(warm['is_cold_start'])
+        self.assertTrue(cold['is_cold_start'])
+
+        # Without the runtime memory there are no GB-seconds
+        future = self.futures()[0]
+        del future.invoke_status['runtime_memory']
+        self.assertIsNone(profiler.call_profile(future)['gb_seconds'])
+
+    def test_job_profile(self):
+        profile = profiler.create_profile(self.futures())
+        self.assertEqual([call['call_id'] for call in profile['calls']], ['00000', '00001'])
+        summary = profile['jobs']['executor/M000']
+        self.assertEqual((summary['calls'], summary['cold_starts']), (2, 1))
+        self.assertAlmostEqual(summary['job_setup'], 0.5)
+        self.assertAlmostEqual(summary['phases']['exec']['mean'], 2.5)
+        self.assertAlmostEqual(summary['phases']['exec']['p50'], 2.5)
+        self.assertAlmostEqual(summary['phases']['exec']['p90'], 3.7)
+        self.assertAlmostEqual(summary['phases']['total']['max'], 7.0)
+        self.assertEqual(summary['dominant_phase'], 'exec')
+        self.assertAlmostEqual(summary['gb_seconds'], 11.4)
+        self.assertEqual(summary['peak_memory'], 300)
+
+        # The slowest call, after the setup of the job, is the critical path
+        critical_path = summary['critical_path']
+        self.assertEqual(critical_path['call_id'], '00001')
+        self.assertAlmostEqual(critical_path['cold_start'], 2.0)
+        self.assertAlmostEqual(critical_path['total'], 7.5)
+        self.assertEqual(critical_path['dominant_phase'], 'exec')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler.export_json(profile, os.path.join(tmp_dir, 'profile.json'))
+            profiler.export_csv(profile, os.path.join(tmp_dir, 'profile.csv'))
+            with open(os.path.join(tmp_dir, 'profile.json')) as json_file:
+                self.assertEqual(json.load(json_file)['jobs']['executor/M000']['critical_path']['call_id'], '00001')
+            with open(os.path.join(tmp_dir, 'profile.csv')) as csv_file:
+                self.assertEqual(len(csv_file.read().splitlines()), 3)
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.exporter = tracing.InMemoryExporter()
+        tracing.set_exporter(self.exporter)
+
+    def tearDown(self):
+        tracing.set_exporter(None)
+
+    def test_disabled(self):
+        tracing.set_exporter(None)
+        with tracing.start_span('job') as span:
+            self.assertIs(span, tracing.NOOP_SPAN)
+            self.assertIsNone(span.context)
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_parent_propagation(self):
+        with tracing.start_span('job', job_id='M000') as job_span:
+            with tracing.start_span('invoke') as invoke_span:
+                pass
+            self.assertRaises(ValueError, self.raise_in_span, 'upload')
+        root = tracing.start_span('other job')
+
+        # Spans are exported when they end, the children first
+        names = [span['name'] for span in self.exporter.spans]
+        self.assertEqual(names, ['invoke', 'upload', 'job'])
+        spans = {span['name']: span for span in self.exporter.spans}
+        self.assertIsNone(spans['job']['parent_id'])
+        self.assertEqual(spans['job']['attributes'], {'job_id': 'M000'})
+        self.assertEqual(spans['invoke']['parent_id'], job_span.span_id)
+        self.assertEqual(spans['upload']['parent_id'], job_span.span_id)
+        self.assertEqual(spans['upload']['attributes'], {'error': "ValueError('upload')"})
+        self.assertEqual(set(span['trace_id'] for span in spans.values()), {job_span.trace_id})
+        self.assertTrue(all(span['start_time'] <= span['end_time'] for span in spans.values()))
+        self.assertEqual(invoke_span.context, '00-{}-{}-01'.format(job_span.trace_id, invoke_span.span_id))
+
+        # A span outside the `with` block starts a new trace
+        self.assertIsNone(root.parent_id)
+        self.assertNotEqual(root.trace_id, job_span.trace_id)
+
+    def raise_in_span(self, name):
+        with tracing.start_span(name):
+            raise ValueError(name)
+
+    def test_remote_propagation(self):
+        # The context of a span is the parent of the spans of other processes and threads
+        job_span = tracing.start_span('job')
+        spans = []
+        thread = threading.Thread(target=lambda: spans.append(tracing.start_span('call', parent=job_span.context)))
+        thread.start()
+        thread.join()
+        self.assertEqual((spans[0].trace_id, spans[0].parent_id), (job_span.trace_id, job_span.span_id))
+
+        # The children started with an index get the context computed by child_context()
+        for index in (0, 1, 99):
+            call_span = tracing.start_span('call', parent=job_span.context, child_index=index)
+            self.assertEqual(call_span.context, tracing.child_context(job_span.context, index))
+        self.assertEqual(tracing.child_span_id('ffffffffffffffff', 0), '0000000000000000')
+        self.assertIsNone(tracing.child_context(None, 0))
+        self.assertIsNone(tracing.start_span('call', parent='invalid').parent_id)
+
+    def test_exporters(self):
+        with tracing.start_span('job'):
+            pass
+        # A span is exported once
+        span = tracing.start_span('call')
+        span.end()
+        span.end()
+        self.assertEqual(len(self.exporter.spans), 2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            traces_file = os.path.join(tmp_dir, 'traces', 'traces.jsonl')
+            tracing.set_exporter(tracing.FileExporter(traces_file))
+            tracing.export_spans(self.exporter.spans)
+            with open(traces_file) as trace_file:
+                self.assertEqual([json.loads(line) for line in trace_file], self.exporter.spans)
+
+
+class TestResourceSampler(unittest.TestCase):
+
+    PROC_FILES = {
+        'self/statm': '{} {} 500 10 0 2000 0\n',
+        'self/status': 'Name:\tpython\nVmPeak:\t  900000 kB\nVmHWM:\t  {} kB\nVmRSS:\t  40000 kB\n',
+        'self/io': 'rchar: 100\nwchar: 200\nsyscr: 1\nsyscw: 2\nread_bytes: {}\nwrite_bytes: {}\n'
+                   'cancelled_write_bytes: 0\n',
+        'net/dev': 'Inter-|   Receive                            |  Transmit\n'
+                   ' face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop '
+                   'fifo colls carrier compressed\n'
+                   '    lo: 1000 10 0 0 0 0 0 0 1000 10 0 0 0 0 0 0\n'
+                   '  eth0: {} 10 0 0 0 0 0 0 {} 10 0 0 0 0 0 0\n'
+                   '  eth1: 5 1 0 0 0 0 0 0 7 1 0 0 0 0 0 0\n',
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(sampler, 'PROC_DIR', self.tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def write_proc(self, rss_pages=1000, peak_kb=50000, disk=(4096, 8192), net=(2000, 3000), skip=()):
+        values = {'self/statm': (9000, rss_pages), 'self/status': (peak_kb,), 'self/io': disk, 'net/dev': net}
+        for name, content in self.PROC_FILES.items():
+            path = os.path.join(self.tmp_dir.name, name)
+            if name in skip:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as proc_file:
+                proc_file.write(content.format(*values[name]))
+
+    def test_readers(self):
+        self.write_proc()
+        self.assertEqual(sampler._read_rss(), 1000 * sampler.PAGE_SIZE)
+        self.assertEqual(sampler._read_peak_rss(), 50000 * 1024)
+        self.assertEqual(sampler._read_disk(), (4096, 8192))
+        # The loopback interface is left out
+        self.assertEqual(sampler._read_net(), (2005, 3007))
+
+    def test_sampler(self):
+        self.write_proc()
+        resource_sampler = sampler.ResourceSampler(60)
+        resource_sampler.start()
+        self.write_proc(rss_pages=3000, peak_kb=70000, disk=(5096, 10192), net=(2500, 4000))
+        usage = resource_sampler.stop()
+
+        # Counters are relative to the start, the RSS is not
+        self.assertEqual(len(usage['time']), 1)
+        self.assertEqual(usage['rss'], [3000 * sampler.PAGE_SIZE])
+        self.assertEqual((usage['disk_read'], usage['disk_write']), ([1000], [2000]))
+        self.assertEqual((usage['net_rx'], usage['net_tx']), ([500], [1000]))
+        self.assertEqual(usage['peak_rss'], 70000 * 1024)
+        self.assertGreaterEqual(usage['cpu'][0], 0)
+
+    def test_missing_proc(self):
+        # Without /proc, only the CPU time is sampled, and the peak RSS is unknown
+        os.rmdir(self.tmp_dir.name)
+        resource_sampler = sampler.ResourceSampler(60)
+        self.assertEqual(list(resource_sampler._readers), ['cpu'])
+        resource_sampler.start()
+        usage = resource_sampler.stop()
+        self.assertEqual(sorted(usage), ['cpu', 'interval', 'peak_rss', 'time'])
+        self.assertIsNone(usage['peak_rss'])
+
+        # Without the status file, the peak RSS is the highest sampled RSS
+        self.write_proc(skip=('self/status', 'self/io'))
+        resource_sampler = sampler.ResourceSampler(60)
+        self.assertEqual(sorted(resource_sampler._readers), ['cpu', 'net_rx', 'net_tx', 'rss'])
+        resource_sampler.start()
+        self.write_proc(rss_pages=2000, skip=('self/status', 'self/io'))
+        resource_sampler._record()
+        self.write_proc(rss_pages=1500, skip=('self/status', 'self/io'))
+        usage = resource_sampler.stop()
+        self.assertEqual(usage['peak_rss'], 2000 * sampler.PAGE_SIZE)
+        self.assertNotIn('disk_read', usage)
+
+        # A sample that can not be read is skipped
+        os.remove(os.path.join(self.tmp_dir.name, 'self', 'statm'))
+        resource_sampler._record()
+        self.assertEqual(len(resource_sampler.times), 2)
+
+    def test_max_samples(self):
+        self.write_proc()
+        resource_sampler = sampler.ResourceSampler(1)
+        resource_sampler.start_time = time.time()
+        for _ in range(sampler.MAX_SAMPLES):
+            resource_sampler._record()
+        self.assertEqual(len(resource_sampler.times), sampler.MAX_SAMPLES // 2)
+        self.assertEqual(len(resource_sampler.series['rss']), sampler.MAX_SAMPLES // 2)
+        self.assertEqual(resource_sampler.interval, 2)
+
+
+class TestHandlerZip(unittest.TestCase):
+
+    def test_handler_zip(self):
+        backend = ibm_cf.ComputeBackend.__new__(ibm_cf.ComputeBackend)
+        source_names = zipfile.ZipFile(io.BytesIO(backend._create_handler_zip('2.7'))).namelist()
+        self.assertIn('__main__.py', source_names)
+        self.assertIn('pywren_ibm_cloud/runtime/function_handler/handler.py', source_names)
+        self.assertFalse([name for name in source_names if name.endswith('.pyc')])
+        self.assertIs(backend._create_handler_zip(None), backend._create_handler_zip('2.7'))
+
+        # The runtimes with the Python version of the client also get the bytecode of the package
+        compiled_names = zipfile.ZipFile(io.BytesIO(backend._create_handler_zip(version_str(sys.version_info)))).namelist()
+        pyc_names = set(name for name in compiled_names if name.endswith('.pyc'))
+        self.assertEqual(set(compiled_names) - pyc_names, set(source_names))
+        self.assertIn('pywren_ibm_cloud/runtime/function_handler/__pycache__/handler.{}.pyc'
+                      .format(sys.implementation.cache_tag), pyc_names)
+        self.assertNotIn('__pycache__/__main__.{}.pyc'.format(sys.implementation.cache_tag), pyc_names)
+
+
+class TestRuntimeMemory(unittest.TestCase):
+
+    def test_runtime_memory_auto(self):
+        # Simulation with recorded profiles: calls that peak around 150MB, measured with 1024MB
+        rand = random.Random(0)
+        records = [{'runtime_memory': 1024, 'peak_memory': rand.gauss(150, 10) * 1024 ** 2,
+                    'duration': rand.uniform(1, 2)} for _ in range(100)]
+        self.assertIsNone(memory.recommend_memory(records[:memory.MIN_PROFILE_CALLS - 1]))
+        self.assertEqual(memory.recommend_memory(records), 256)
+
+        # A few calls that need more memory move the job to the next tier
+        heavy = [{'runtime_memory': 1024, 'peak_memory': 300 * 1024 ** 2, 'duration': 2}] * 5
+        self.assertEqual(memory.recommend_memory(records + heavy), 512)
+
+        # Replaying the recorded calls with the selected memory keeps the failures under the threshold
+        for recorded in (records, records + heavy):
+            tier = memory.recommend_memory(recorded)
+            self.assertLessEqual(memory.failure_risk(recorded, tier), memory.AUTO_MEMORY_RISK)
+
+        # Calls that ran out of memory are assumed to need the next tier
+        oom = [{'runtime_memory': 256, 'oom': True}] * 5
+        self.assertEqual(memory.recommend_memory(records + oom), 512)
+
+        # Profiles are persisted by function and input size class
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            key = memory.profile_key(simple_map_function, 1000)
+            self.assertEqual(key, memory.profile_key(simple_map_function, 1023))
+            self.assertNotEqual(key, memory.profile_key(simple_map_function, 1024))
+            profiles = memory.MemoryProfiles(os.path.join(tmp_dir, 'memory_profiles.json'))
+            profiles.record(key, records)
+            profiles.save()
+            self.assertEqual(memory.MemoryProfiles(profiles.path).recommend(key), 256)
+
+
+class FakeRuntimeCompute:
+    """
+    Compute backend that deploys runtimes. Each deployment waits in a barrier for
+    the other deployments of the test, so they fail unless they run concurrently.
+    """
+
+    def __init__(self, compute_config, test):
+        self.region = compute_config['ibm_cf'].get('region')
+        self.test = test
+
+    def get_runtime_key(self, runtime_name, runtime_memory):
+        return '{}/{}_{}MB'.format(self.region, runtime_name, runtime_memory)
+
+    def generate_runtime_meta(self, runtime_name):
+        self.test.generated.append(runtime_name)
+        return {'python_ver': version_str(sys.version_info), 'preinstalls': [['json', True]]}
+
+    def create_runtime(self, runtime_name, runtime_memory, timeout, python_ver):
+        start = time.time()
+        self.test.barrier.wait()
+        self.test.deployed.append((runtime_memory, start, time.time()))
+
+
+class TestRuntimeDeploy(unittest.TestCase):
+
+    def setUp(self):
+        self.generated = []
+        self.deployed = []
+        self.barrier = threading.Barrier(2, timeout=10)
+        self.storage = MemoryStorage()
+        pywren_runtime.invalidate_runtime_registry()
+        self.addCleanup(pywren_runtime.invalidate_runtime_registry)
+        patcher = mock.patch.object(pywren_runtime, 'Compute', lambda compute_config:
+                                    FakeRuntimeCompute(compute_config, self))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def map_reduce(self):
+        config = {'pywren': dict(CONFIG['pywren'], runtime='runtime', runtime_memory=256, runtime_timeout=600),
+                  'ibm_cf': {}}
+        executor = fake_executor(config, self.storage)
+        map_job = {'job_id': 'M000', 'total_calls': 10}
+        reduce_job = {'job_id': 'R000', 'total_calls': 1}
+        with mock.patch.object(pywren_executor, 'create_map_job', return_value=(map_job, None)), \
+                mock.patch.object(pywren_executor, 'create_reduce_job', return_value=reduce_job), \
+                mock.patch.object(self.storage, 'get_runtime_meta', wraps=self.storage.get_runtime_meta) as get_meta:
+            executor.map_reduce(simple_map_function, range(10), sum, map_runtime_memory=256,
+                                reduce_runtime_memory=2048)
+        return get_meta.call_count
+
+    def test_concurrent_deploy(self):
+        # The runtimes of both phases are deployed before the map phase, at the same time,
+        # and the preinstalled modules of the image are only extracted once. The storage is
+        # checked for each memory, and again by its deployment, under the deployment lock
+        with mock.patch.dict(os.environ, {'CB_LOG_LEVEL': 'INFO'}):
+            self.assertEqual(self.map_reduce(), 4)
+        self.assertEqual(sorted(memory for memory, _, _ in self.deployed), [256, 2048])
+        self.assertLess(max(start for _, start, _ in self.deployed), min(end for _, _, end in self.deployed))
+        self.assertEqual(self.generated, ['runtime'])
+        self.assertEqual(sorted(self.storage.storage_handler.objects),
+                         ['None/runtime_2048MB.meta.json', 'None/runtime_256MB.meta.json'])
+
+        # Within RUNTIME_REGISTRY_TTL the runtimes are in the registry of the process
+        with mock.patch.dict(os.environ, {'CB_LOG_LEVEL': 'INFO'}):
+            self.assertEqual(self.map_reduce(), 0)
+        self.assertEqual(len(self.deployed), 2)
+
+        # Once expired, the metadata is read again from the storage, without deploying
+        for runtime_key, (runtime_meta, expiration) in list(pywren_runtime._registry.items()):
+            self.assertLessEqual(expiration, time.time() + pywren_runtime.RUNTIME_REGISTRY_TTL)
+            pywren_runtime._registry[runtime_key] = (runtime_meta, time.time() - 1)
+        with mock.patch.dict(os.environ, {'CB_LOG_LEVEL': 'INFO'}):
+            self.assertEqual(self.map_reduce(), 2)
+        self.assertEqual(len(self.deployed), 2)
+        self.assertEqual(self.generated, ['runtime'])
+
+
+class TestInvoker(unittest.TestCase):
+
+    def test_shard_calls(self):
+        capacities = OrderedDict([('us-south', 1000), ('eu-de', 3000), ('jp-tok', None)])
+
+        # Without a local region the calls are split proportionally to the capacity, unknown
+        # capacities count as the largest known one
+        shards = shard_calls(700, capacities)
+        self.assertEqual(list(shards.items()), [('us-south', 100), ('eu-de', 300), ('jp-tok', 300)])
+        self.assertEqual(sum(shard_calls(1001, capacities).values()), 1001)
+
+        # The region of the storage is filled first, the rest spills over the others
+        self.assertEqual(list(shard_calls(800, capacities, 'eu-de').items()), [('eu-de', 800), ('us-south', 0), ('jp-tok', 0)])
+        self.assertEqual(list(shard_calls(4000, capacities, 'eu-de').items()), [('eu-de', 3000), ('us-south', 250), ('jp-tok', 750)])
+        # Jobs larger than the total capacity are split proportionally
+        self.assertEqual(list(shard_calls(14000, capacities, 'eu-de').items()), [('eu-de', 6000), ('us-south', 2000), ('jp-tok', 6000)])
+
+        # The invoker gives each region a contiguous range of calls, and returns the futures in call order
+        invoker = Invoker.__new__(Invoker)
+        invoker.log_level = 'INFO'
+        invoker.config = {}
+        invoker.executor_id = 'executor'
+        invoker.storage_config = STORAGE_CONFIG
+        invoker.internal_computes = OrderedDict([('us-south', FakeCompute('us-south', 4)),
+                                                 ('eu-de', FakeCompute('eu-de', 6))])
+        invoker.local_region = 'eu-de'
+        job_description = {'job_id': '000', 'func_name': 'simple_map_function', 'total_calls': 10,
+                           'data_ranges': [(i * 10, i * 10 + 9) for i in range(10)], 'host_job_meta': {},
+                           'func_key': 'func_key', 'data_key': 'data_key', 'task_execution_timeout': 600,
+                           'compression_codecs': [], 'extra_env': None, 'extra_meta': None,
+                           'overwrite_invoke_args': None, 'runtime_name': 'runtime', 'runtime_memory': 256,
+                           'invoke_pool_threads': 4, 'remote_invocation': False, 'trace_context': None}
+        futures = invoker.run(job_description)
+        self.assertEqual([f.call_id for f in futures], ['{:05d}'.format(i) for i in range(10)])
+        self.assertEqual([f.activation_id for f in futures], ['activation{:05d}'.format(i) for i in range(10)])
+        self.assertEqual([f.invoke_status['compute_region'] for f in futures], ['eu-de'] * 6 + ['us-south'] * 4)
+        self.assertEqual(sorted(invoker.internal_computes['eu-de'].call_ids), ['{:05d}'.format(i) for i in range(6)])
+        self.assertEqual(sorted(invoker.internal_computes['us-south'].call_ids), ['{:05d}'.format(i) for i in range(6, 10)])
+
+
+    def template_payload(self):
+        return {'executor_id': 'executor', 'job_id': '000', 'config': CONFIG, 'log_level': 'INFO'}
+
+    def remote_invocation(self, total_calls, fanout, failed_calls=()):
+        compute = FakeCompute(failed_calls=failed_calls)
+        data_ranges = [(i * 10, i * 10 + 9) for i in range(total_calls)]
+        with mock.patch.object(pywren_invoker, 'Compute', return_value=compute):
+            pywren_invoker.invoke_range(compute, 'runtime', 256, self.template_payload(), (0, total_calls),
+                                        data_ranges, fanout, 8, root=True)
+        return compute
+
+    def test_split_call_range(self):
+        for first_call, total_calls in [(0, 1), (0, 4), (5, 17), (0, 1000), (100, 50001)]:
+            for fanout in (2, 4, 100):
+                call_range = (first_call, first_call + total_calls)
+                sub_ranges = pywren_invoker.split_call_range(call_range, fanout)
+                # At most `fanout` contiguous sub-ranges of similar size that cover the range
+                self.assertLessEqual(len(sub_ranges), fanout)
+                self.assertEqual(sub_ranges[0][0], call_range[0])
+                self.assertEqual(sub_ranges[-1][1], call_range[1])
+                for (_, last_call), (next_first_call, _) in zip(sub_ranges, sub_ranges[1:]):
+                    self.assertEqual(last_call, next_first_call)
+                sizes = [last_call - first for first, last_call in sub_ranges]
+                self.assertGreater(min(sizes), 0)
+                self.assertLessEqual(max(sizes), -(-total_calls // len(sub_ranges)))
+
+    def test_remote_invocation(self):
+        fanout = 4
+        for total_calls in (1, fanout, fanout ** 2 + 1):
+            compute = self.remote_invocation(total_calls, fanout)
+            self.assertEqual(compute.invoker_errors, [])
+
+            # Every call is started exactly once, with its data byte range
+            self.assertEqual(Counter(compute.call_ids), Counter('{:05d}'.format(i) for i in range(total_calls)))
+            calls = [(ts, payload) for ts, payload in compute.invocations if not payload.get('remote_invoker')]
+            for _, payload in calls:
+                i = int(payload['call_id'])
+                self.assertEqual(payload['data_byte_range'], (i * 10, i * 10 + 9))
+
+            # The invokers form a tree with at most `fanout` children by node: the parent of each
+            # invocation is the smallest invoker range that contains it
+            invokers = [(ts, tuple(payload['call_range'])) for ts, payload in compute.invocations
+                        if payload.get('remote_invoker')]
+            children = Counter()
+
+            def parent_of(call_range, strict):
+                containing = [(ts, r) for ts, r in invokers if r[0] <= call_range[0] and call_range[1] <= r[1]
+                              and (not strict or r != call_range)]
+                return min(containing, key=lambda invoker: invoker[1][1] - invoker[1][0], default=(None, None))
+
+            for ts, call_range in invokers:
+                parent_ts, parent = parent_of(call_range, strict=True)
+                children[parent] += 1
+                self.assertTrue(parent is None or parent_ts <= ts)
+            for ts, payload in calls:
+                i = int(payload['call_id'])
+                parent_ts, parent = parent_of((i, i + 1), strict=False)
+                self.assertIsNotNone(parent)
+                self.assertLessEqual(parent[1] - parent[0], fanout)
+                self.assertLessEqual(parent_ts, ts)
+                children[parent] += 1
+            self.assertLessEqual(max(children.values()), fanout)
+
+        compute = self.remote_invocation(50000, 100)
+        self.assertEqual(Counter(compute.call_ids), Counter('{:05d}'.format(i) for i in range(50000)))
+        self.assertEqual(len(compute.invocations) - 50000, 100 + 500)
+
+    def test_set_calls_failed(self):
+        storage = MemoryStorage()
+        with mock.patch('pywren_ibm_cloud.storage.InternalStorage', return_value=storage), \
+                self.assertLogs(pywren_invoker.logger, 'ERROR'):
+            pywren_invoker.set_calls_failed(self.template_payload(), (3, 6),
+                                            (Exception, Exception('Unable to invoke'), None))
+        self.assertEqual(sorted(storage.storage_handler.objects),
+                         [create_status_key(storage.prefix, 'executor', '000', '{:05d}'.format(i)) for i in range(3, 6)])
+        for key, data in storage.storage_handler.objects.items():
+            call_status = json.loads(data)
+            self.assertTrue(call_status['exception'])
+            self.assertEqual(key, create_status_key(storage.prefix, 'executor', '000', call_status['call_id']))
+            exc_type, exc_value, exc_traceback = pickle.loads(eval(call_status['exc_info']))
+            self.assertEqual(str(exc_value), 'Unable to invoke')
+
+        # A failed call, and all the calls of a failed invoker, are reported as failed
+        storage = MemoryStorage()
+        with mock.patch('pywren_ibm_cloud.storage.InternalStorage', return_value=storage), \
+                self.assertLogs(pywren_invoker.logger, 'ERROR') as logs:
+            with self.assertRaises(Exception):
+                self.remote_invocation(17, 4, failed_calls={'00002', 'I00005-00009'})
+        self.assertEqual(len(logs.records), 2)
+        failed_calls = [json.loads(data)['call_id'] for data in storage.storage_handler.objects.values()]
+        self.assertEqual(sorted(failed_calls), ['{:05d}'.format(i) for i in [2, 5, 6, 7, 8, 9]])
+
+
+class TestCOSStorageBackend(unittest.TestCase):
+
+    def storage_backend(self, failed_parts=()):
+        storage_backend = COSStorageBackend.__new__(COSStorageBackend)
+        storage_backend.multipart_threshold = 64
+        storage_backend.multipart_chunksize = 16
+        storage_backend.multipart_concurrency = 3
+        storage_backend.cos_client = StubCOSClient(failed_parts)
+        return storage_backend
+
+    def test_single_put(self):
+        # Bodies under the threshold are uploaded with a single request
+        for data in (b'x' * 63, 'x' * 63, io.BytesIO(b'x' * 63), iter([b'x' * 30, b'x' * 33])):
+            storage_backend = self.storage_backend()
+            storage_backend.put_object('bucket', 'key', data)
+            self.assertEqual(storage_backend.cos_client.requests, ['put_object'])
+            self.assertEqual(storage_backend.cos_client.objects['key'], b'x' * 63)
+
+    def test_multipart_upload(self):
+        data = os.urandom(1000)
+        chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+        for body in (data, bytearray(data), io.BytesIO(data), iter(chunks), (bytes(chunk) for chunk in chunks)):
+            storage_backend = self.storage_backend()
+            storage_backend.put_object('bucket', 'key', body)
+            cos_client = storage_backend.cos_client
+            self.assertEqual(cos_client.requests, ['create_multipart_upload', 'complete_multipart_upload'])
+            # The parts are completed in order, whatever order they finish in
+            self.assertEqual(cos_client.completed_parts, list(range(1, 64)))
+            self.assertTrue(all(len(cos_client.uploaded_parts[i]) == 16 for i in range(1, 63)))
+            self.assertEqual(cos_client.objects['key'], data)
+
+    def test_multipart_upload_abort(self):
+        # A failed part aborts the upload, and the exception is raised
+        for body in (os.urandom(1000), io.BytesIO(os.urandom(1000))):
+            storage_backend = self.storage_backend(failed_parts={2})
+            with self.assertRaisesRegex(Exception, 'Unable to upload part 2'):
+                storage_backend.put_object('bucket', 'key', body)
+            self.assertEqual(storage_backend.cos_client.requests, ['create_multipart_upload', 'abort_multipart_upload'])
+            self.assertNotIn('key', storage_backend.cos_client.objects)
+
+
+class TestWait(unittest.TestCase):
+
+    def test_callset_done(self):
+        storage = MemoryStorage()
+        objects = storage.storage_handler.objects
+
+        def put_done(job_id, call_id):
+            objects[create_output_key(storage.prefix, 'executor', job_id, call_id)] = b''
+            objects[create_status_key(storage.prefix, 'executor', job_id, call_id)] = b''
+
+        put_done('000', '00000')
+        put_done('000', '00002')
+        done = storage.get_callset_done('executor', CallsetDone())
+        self.assertEqual(list(done), ['000'])
+        self.assertEqual([i for i, d in enumerate(done['000']) if d], [0, 2])
+        self.assertEqual(len(done.listed_keys), 2)
+
+        # The next listing parses only the new status keys: the bit cleared here stays cleared
+        done['000'][0] = 0
+        put_done('000', '00005')
+        put_done('001', '00001')
+        self.assertIs(storage.get_callset_done('executor', done), done)
+        self.assertEqual([i for i, d in enumerate(done['000']) if d], [2, 5])
+        self.assertEqual([i for i, d in enumerate(done['001']) if d], [1])
+        self.assertEqual(len(done.listed_keys), 4)
+
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(TimeoutError):
+            pywren_wait.wait(invoked_futures(5), 'executor', MemoryStorage(), timeout=0.5, WAIT_DUR_SEC=0.2)
+        self.assertLess(time.time() - start, 2)
+
+    def test_cancel(self):
+        # The wait runs in a thread other than the main one, and is cancelled from another one
+        cancel_event = threading.Event()
+        result = {}
+
+        def run():
+            try:
+                pywren_wait.wait(invoked_futures(5), 'executor', MemoryStorage(),
+                                 cancel_event=cancel_event, WAIT_DUR_SEC=5)
+            except CancelledError:
+                result['cancelled'] = time.time()
+
+        waiter = threading.Thread(target=run)
+        waiter.start()
+        time.sleep(0.2)
+        cancelled = time.time()
+        cancel_event.set()
+        waiter.join()
+        self.assertLess(result['cancelled'] - cancelled, 1)
+
+    def test_wait_async(self):
+        from pywren_ibm_cloud.executor import FunctionExecutor, ExecutorState
+        executor = FunctionExecutor.__new__(FunctionExecutor)
+        executor.jobs = {}
+        executor.executor_id = 'executor'
+        executor.log_level = 'INFO'
+        executor.config = {}
+        executor.is_cf_cluster = True
+        executor.data_cleaner = False
+        executor.rabbitmq_monitor = False
+        executor.internal_storage = MemoryStorage()
+        executor._cancel_events = set()
+        executor._state = ExecutorState.ready
+
+        async def main():
+            task = asyncio.ensure_future(executor.wait_async(futures=invoked_futures(2), WAIT_DUR_SEC=5))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await executor.wait_async(futures=invoked_futures(2), timeout=0.3, WAIT_DUR_SEC=0.1)
+
+        fs_dones, fs_notdones = asyncio.run(main())
+        self.assertEqual(len(fs_notdones), 2)
+        self.assertEqual(executor._cancel_events, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
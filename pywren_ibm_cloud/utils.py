@@ -16,8 +16,11 @@
 
 import base64
 import os
+import sys
 import uuid
+import marshal
 import inspect
+import importlib.util
 import subprocess
 import struct
 import platform
@@ -31,10 +34,6 @@ def create_executor_id(lenght=9):
     return uuid_str()[9:9+lenght]
 
 
-def timeout_handler(signum, frame):
-    raise TimeoutError()
-
-
 def version_str(version_info):
     return "{}.{}".format(version_info[0], version_info[1])
 
@@ -143,6 +142,26 @@ def split_path(path):
     return bucket_name, key
 
 
+def compile_bytecode(source, filename):
+    """
+    Compiles a Python source file into an unchecked hash-based .pyc file (PEP 552),
+    which the interpreter loads without checking the source file.
+    Only a runtime with the same Python version loads it; others fall back to the source.
+    :param source: source file content
+    :param filename: file name shown in tracebacks
+    :return: .pyc file content, or None if the source can not be compiled or this
+    Python version does not support hash-based .pyc files
+    """
+    if sys.version_info < (3, 7):
+        return None
+    try:
+        code = compile(source, filename, 'exec', dont_inherit=True)
+    except (SyntaxError, ValueError):
+        return None
+    flags = (0b01).to_bytes(4, 'little')  # hash-based, unchecked
+    return importlib.util.MAGIC_NUMBER + flags + importlib.util.source_hash(source) + marshal.dumps(code)
+
+
 def get_current_memory_usage():
     """
     Gets the current memory usage of the runtime.
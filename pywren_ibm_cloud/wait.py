@@ -16,13 +16,14 @@
 
 import json
 import time
-import pika
 import queue
 import random
 import logging
 import threading
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import CancelledError
+from pywren_ibm_cloud import tracing
 from .future import JobState
+from .storage import CallsetDone
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +34,8 @@ ALWAYS = 3
 
 def wait(fs, executor_id, internal_storage, download_results=False,
          throw_except=True, rabbit_amqp_url=None, pbar=None,
-         return_when=ALL_COMPLETED, THREADPOOL_SIZE=128, WAIT_DUR_SEC=1):
+         return_when=ALL_COMPLETED, THREADPOOL_SIZE=128, WAIT_DUR_SEC=1,
+         timeout=None, cancel_event=None):
     """
     Wait for the Future instances `fs` to complete. Returns a 2-tuple of
     lists. The first list contains the futures that completed
@@ -49,6 +51,9 @@ def wait(fs, executor_id, internal_storage, download_results=False,
     :param return_when: One of `ALL_COMPLETED`, `ANY_COMPLETED`, `ALWAYS`
     :param THREADPOOL_SIZE: Number of threads to use. Default 64
     :param WAIT_DUR_SEC: Time interval between each check.
+    :param timeout: Seconds to wait before raising TimeoutError. Default None (no timeout).
+    :param cancel_event: threading.Event that cancels the wait, raising CancelledError, when set.
+    Both are checked between the checks of the futures. Default None
     :return: `(fs_dones, fs_notdones)`
         where `fs_dones` is a list of futures that have completed
         and `fs_notdones` is a list of futures that have not completed.
@@ -58,74 +63,104 @@ def wait(fs, executor_id, internal_storage, download_results=False,
     # number of futures have completed without too much network traffic
     # by exploiting the callset
 
-    N = len(fs)
-    # These are performance-related settings that we may eventually
-    # want to expose to end users:
-    MAX_DIRECT_QUERY_N = 64
-    RETURN_EARLY_N = 32
-    RANDOM_QUERY = False
-
-    if return_when == ALL_COMPLETED:
-
-        if rabbit_amqp_url and not download_results:
-            job_id = fs[0].job_id
-            return _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, N)
-
-        result_count = 0
-
-        while result_count < N:
-            fs_dones, fs_notdones = _wait_storage(fs, executor_id,
-                                                  internal_storage,
-                                                  download_results,
-                                                  throw_except,
-                                                  RETURN_EARLY_N,
-                                                  MAX_DIRECT_QUERY_N,
-                                                  random_query=RANDOM_QUERY,
-                                                  THREADPOOL_SIZE=THREADPOOL_SIZE,
-                                                  pbar=pbar)
-            N = len(fs)
-            if pbar and pbar.total != N:
-                pbar.total = N
-                pbar.refresh()
-
-            result_count = len(fs_dones)
-            if result_count == N:
-                return fs_dones, fs_notdones
-            else:
-                sleep = WAIT_DUR_SEC
-                if fs_dones:
-                    sleep = max(float(round(WAIT_DUR_SEC-((len(fs_dones)/N)*WAIT_DUR_SEC), 3)), 0)
-                #print("Sleep:", sleep)
-                time.sleep(sleep)
-                #print('---')
-
-    elif return_when == ANY_COMPLETED:
-        while True:
-            fs_dones, fs_notdones = _wait_storage(fs, executor_id,
-                                                  internal_storage,
-                                                  download_results,
-                                                  throw_except,
-                                                  RETURN_EARLY_N,
-                                                  MAX_DIRECT_QUERY_N,
-                                                  random_query=RANDOM_QUERY,
-                                                  THREADPOOL_SIZE=THREADPOOL_SIZE)
-
-            if len(fs_dones) != 0:
-                return fs_dones, fs_notdones
-            else:
-                time.sleep(WAIT_DUR_SEC)
-
-    elif return_when == ALWAYS:
-        return _wait_storage(fs, executor_id,
-                             internal_storage,
-                             download_results,
-                             throw_except,
-                             RETURN_EARLY_N,
-                             MAX_DIRECT_QUERY_N,
-                             random_query=RANDOM_QUERY,
-                             THREADPOOL_SIZE=THREADPOOL_SIZE)
+    deadline = time.time() + timeout if timeout is not None else None
+    # Done bitmaps of the callset, kept between the polls of this wait
+    done_bitmaps = CallsetDone()
+
+    with tracing.start_span('wait', executor_id=executor_id, futures=len(fs),
+                            download_results=download_results):
+        N = len(fs)
+        # These are performance-related settings that we may eventually
+        # want to expose to end users:
+        MAX_DIRECT_QUERY_N = 64
+        RETURN_EARLY_N = 32
+        RANDOM_QUERY = False
+
+        if return_when == ALL_COMPLETED:
+
+            if rabbit_amqp_url and not download_results:
+                job_id = fs[0].job_id
+                return _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, N,
+                                      deadline, cancel_event, WAIT_DUR_SEC)
+
+            result_count = 0
+
+            while result_count < N:
+                fs_dones, fs_notdones = _wait_storage(fs, executor_id,
+                                                      internal_storage,
+                                                      download_results,
+                                                      throw_except,
+                                                      RETURN_EARLY_N,
+                                                      MAX_DIRECT_QUERY_N,
+                                                      random_query=RANDOM_QUERY,
+                                                      THREADPOOL_SIZE=THREADPOOL_SIZE,
+                                                      pbar=pbar,
+                                                      done_bitmaps=done_bitmaps)
+                N = len(fs)
+                if pbar and pbar.total != N:
+                    pbar.total = N
+                    pbar.refresh()
+
+                result_count = len(fs_dones)
+                if result_count == N:
+                    return fs_dones, fs_notdones
+                else:
+                    sleep = WAIT_DUR_SEC
+                    if fs_dones:
+                        sleep = max(float(round(WAIT_DUR_SEC-((len(fs_dones)/N)*WAIT_DUR_SEC), 3)), 0)
+                    #print("Sleep:", sleep)
+                    _sleep(sleep, deadline, cancel_event)
+                    #print('---')
+
+        elif return_when == ANY_COMPLETED:
+            while True:
+                fs_dones, fs_notdones = _wait_storage(fs, executor_id,
+                                                      internal_storage,
+                                                      download_results,
+                                                      throw_except,
+                                                      RETURN_EARLY_N,
+                                                      MAX_DIRECT_QUERY_N,
+                                                      random_query=RANDOM_QUERY,
+                                                      THREADPOOL_SIZE=THREADPOOL_SIZE,
+                                                      done_bitmaps=done_bitmaps)
+
+                if len(fs_dones) != 0:
+                    return fs_dones, fs_notdones
+                else:
+                    _sleep(WAIT_DUR_SEC, deadline, cancel_event)
+
+        elif return_when == ALWAYS:
+            return _wait_storage(fs, executor_id,
+                                 internal_storage,
+                                 download_results,
+                                 throw_except,
+                                 RETURN_EARLY_N,
+                                 MAX_DIRECT_QUERY_N,
+                                 random_query=RANDOM_QUERY,
+                                 THREADPOOL_SIZE=THREADPOOL_SIZE)
+        else:
+            raise ValueError()
+
+
+def _check_deadline(deadline, cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise CancelledError()
+    if deadline is not None and time.time() >= deadline:
+        raise TimeoutError()
+
+
+def _sleep(secs, deadline, cancel_event):
+    """
+    Sleeps `secs` seconds, returning early when the deadline is reached or the wait is cancelled
+    """
+    _check_deadline(deadline, cancel_event)
+    if deadline is not None:
+        secs = min(secs, max(deadline - time.time(), 0))
+    if cancel_event is not None:
+        cancel_event.wait(secs)
     else:
-        raise ValueError()
+        time.sleep(secs)
+    _check_deadline(deadline, cancel_event)
 
 
 class rabbitmq_checker_worker(threading.Thread):
@@ -137,6 +172,7 @@ class rabbitmq_checker_worker(threading.Thread):
         threading.Thread.__init__(self)
         self.executor_id = executor_id
         self.q = q
+        import pika
         params = pika.URLParameters(rabbit_amqp_url)
         self.connection = pika.BlockingConnection(params)
         self.channel = self.connection.channel()  # start a channel
@@ -153,7 +189,8 @@ class rabbitmq_checker_worker(threading.Thread):
         self.channel.stop_consuming()
 
 
-def _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, total):
+def _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, total,
+                   deadline=None, cancel_event=None, WAIT_DUR_SEC=1):
     q = queue.Queue()
     td = rabbitmq_checker_worker(executor_id, rabbit_amqp_url, q)
     td.setDaemon(True)
@@ -170,6 +207,7 @@ def _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, total):
         for f in fs:
             if f.job_id in task_statuses and f.call_id in task_statuses[f.job_id]:
                 f.run_status = task_statuses[f.job_id][f.call_id]
+                tracing.export_spans(f.run_status.pop('trace_spans', []))
                 f.invoke_status['status_done_timestamp'] = f.run_status['status_done_timestamp']
                 del f.run_status['status_done_timestamp']
                 f._set_state(JobState.ready)
@@ -190,11 +228,18 @@ def _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, total):
 
     while not reception_finished():
         try:
-            call_status = json.loads(q.get())
+            body = None
+            while body is None:
+                _check_deadline(deadline, cancel_event)
+                try:
+                    body = q.get(timeout=WAIT_DUR_SEC)
+                except queue.Empty:
+                    pass
+            call_status = json.loads(body)
             call_status['status_done_timestamp'] = time.time()
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, TimeoutError, CancelledError):
             call_ids_to_futures()
-            raise KeyboardInterrupt
+            raise
 
         rcvd_job_id = call_status['job_id']
         rcvd_task_id = call_status['call_id']
@@ -233,7 +278,7 @@ def _wait_rabbitmq(fs, executor_id, job_id, rabbit_amqp_url, pbar, total):
 
 def _wait_storage(fs, executor_id, internal_storage, download_results,
                   throw_except, return_early_n, max_direct_query_n,
-                  random_query=False, THREADPOOL_SIZE=128, pbar=None):
+                  random_query=False, THREADPOOL_SIZE=128, pbar=None, done_bitmaps=None):
     """
     internal function that performs the majority of the WAIT task
     work.
@@ -249,6 +294,9 @@ def _wait_storage(fs, executor_id, internal_storage, download_results,
 
     random_query decides whether we get the fs in the order they are presented
     or in a random order.
+
+    done_bitmaps is the CallsetDone of the previous polls, it is updated with the
+    status keys of the new listing.
     """
     # get all the futures that are not yet done
     if download_results:
@@ -259,23 +307,24 @@ def _wait_storage(fs, executor_id, internal_storage, download_results,
     if len(not_done_futures) == 0:
         return fs, []
 
-    # note this returns everything done, so we have to figure out
-    # the intersection of those that are done
-    #t0 = time.time()
-    callids_done_in_callset = set(internal_storage.get_callset_status(executor_id))
-    #print('Time getting list: ', time.time()-t0, len(callids_done_in_callset))
-    # print('CALLSET:', callids_done_in_callset, len(callids_done_in_callset))
-
-    not_done_call_ids = set([(f.job_id, f.call_id) for f in not_done_futures])
-    # print('NO TDONE:' ,not_done_call_ids, len(not_done_call_ids))
-
-    done_call_ids = not_done_call_ids.intersection(callids_done_in_callset)
-    not_done_call_ids = not_done_call_ids - done_call_ids
-    still_not_done_futures = [f for f in not_done_futures if ((f.job_id, f.call_id) in not_done_call_ids)]
+    # Calls whose status is listed in the callset, from the done bitmap of their job.
+    # The listing can be behind due to eventual consistency, the rest are queried directly.
+    done_bitmaps = internal_storage.get_callset_done(executor_id, done_bitmaps)
+    listed_futures = []
+    still_not_done_futures = []
+    for f in not_done_futures:
+        store = f._store
+        bitmap = done_bitmaps.get(store.job_id)
+        call_no = store.first_call + f._index
+        if bitmap is not None and call_no < len(bitmap) and bitmap[call_no]:
+            listed_futures.append(f)
+        else:
+            still_not_done_futures.append(f)
 
     def fetch_future_status(f):
         return internal_storage.get_call_status(f.executor_id, f.job_id, f.call_id)
 
+    from multiprocessing.pool import ThreadPool
     pool = ThreadPool(THREADPOOL_SIZE)
 
     # now try up to max_direct_query_n direct status queries, quitting once
@@ -287,36 +336,29 @@ def _wait_storage(fs, executor_id, internal_storage, download_results,
         random.shuffle(still_not_done_futures)
 
     while query_count < max_queries:
-        if len(done_call_ids) >= return_early_n:
+        if len(listed_futures) >= return_early_n:
             break
         num_to_query_at_once = THREADPOOL_SIZE
         fs_to_query = still_not_done_futures[query_count:query_count + num_to_query_at_once]
 
         fs_statuses = pool.map(fetch_future_status, fs_to_query)
-
-        callids_found = [(fs_to_query[i].job_id, fs_to_query[i].call_id) for i in range(len(fs_to_query))
-                         if fs_statuses[i] is not None]
-
-        # print('FOUND:', callids_found, len(callids_found))
-
-        done_call_ids = done_call_ids.union(set(callids_found))
+        listed_futures.extend(f for f, status in zip(fs_to_query, fs_statuses) if status is not None)
         query_count += len(fs_to_query)
 
     # now we walk through all the original queries and get
     # the ones that are actually done.
     fs_dones = []
     fs_notdones = []
-    f_to_wait_on = []
+    f_to_wait_on = listed_futures
+    waiting_on = set(map(id, f_to_wait_on))
     for f in fs:
-        if (not download_results and f.ready or f.done) or (f.done and download_results):
+        if f.done or (not download_results and f.ready):
             # done, don't need to do anything
             fs_dones.append(f)
+        elif id(f) in waiting_on:
+            fs_dones.append(f)
         else:
-            if (f.job_id, f.call_id) in done_call_ids:
-                f_to_wait_on.append(f)
-                fs_dones.append(f)
-            else:
-                fs_notdones.append(f)
+            fs_notdones.append(f)
 
 #     if still_not_done_futures and len(still_not_done_futures) < max(1, int(len(fs)*0.015)):
 #         f_to_wait_on.extend(still_not_done_futures)